@@ -40,9 +40,15 @@ INSTALLED_APPS = [
         'core',
         'user',
         'recipe',
+        'jobs',
 ]
 
 MIDDLEWARE = [
+        'core.middleware.PerformanceMiddleware',  # first so its total covers every other middleware
+        'core.middleware.ProfilingMiddleware',
+        'core.middleware.MetricsMiddleware',
+        'core.middleware.LoadSheddingMiddleware',
+        'core.middleware.MemoryTrackingMiddleware',
         'django.middleware.security.SecurityMiddleware',
         'django.contrib.sessions.middleware.SessionMiddleware',
         'django.middleware.common.CommonMiddleware',
@@ -127,3 +133,143 @@ STATIC_ROOT = '/vol/web/static'
 MEDIA_ROOT = '/vol/web/media'
 
 AUTH_USER_MODEL = 'core.user'
+
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+# Performance instrumentation (core.middleware.PerformanceMiddleware)
+# Budgets are per URL name with 'default' applying to every route. Keys are total_ms, view_ms, db_ms,
+# serialize_ms, render_ms and db_queries; requests going over are logged as warnings
+
+PERFORMANCE_SERVER_TIMING = True
+PERFORMANCE_BUDGETS = {
+        'default': {'total_ms': 500, 'db_queries': 50},
+}
+
+# Request profiling (core.middleware.ProfilingMiddleware). Off unless PROFILING_ENABLED is set in the environment.
+# A request is profiled at PROFILING_SAMPLE_RATE or when it sends a token from `manage.py profile_token` in the
+# trigger header. Sampled requests run under cProfile (PROFILING_CPROFILE_SHARE of them) or the stack sampler,
+# triggered ones under cProfile. Read the results with `manage.py profile_report`
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '') == '1'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0.01'))
+PROFILING_TRIGGER_HEADER = 'X-Profile'
+PROFILING_TOKEN_MAX_AGE = 60 * 60  # seconds
+PROFILING_CPROFILE_SHARE = 0.5
+PROFILING_INTERVAL = 0.005  # seconds between stack samples
+PROFILING_DIR = os.environ.get('PROFILING_DIR', '/vol/web/profiles')
+PROFILING_KEEP = int(os.environ.get('PROFILING_KEEP', '200'))  # newest pstats files kept per route
+PROFILING_COLLAPSED_MAX_BYTES = 10 * 1024 * 1024  # per route, one older file is kept
+
+# Prometheus metrics served at /metrics (core.metrics). Each worker writes its values to METRICS_DIR so any
+# worker can report totals for all of them; leave it unset for a single process. Scrapers must send METRICS_TOKEN
+# as a bearer token, without one only admin users signed in to the site can read the metrics
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5  # seconds
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Per route allocation tracking (core.middleware.MemoryTrackingMiddleware), off unless MEMORY_TRACKING_ENABLED is
+# set in the environment. Admin users can read this worker's report at /api/memory/
+
+MEMORY_TRACKING_ENABLED = os.environ.get('MEMORY_TRACKING_ENABLED', '') == '1'
+MEMORY_TRACKING_FRAMES = 10  # traceback depth stored per allocation
+MEMORY_TRACKING_SNAPSHOT_RATE = 0.1  # fraction of tracked requests whose allocation sites are recorded
+MEMORY_TRACKING_TOP_SITES = 10
+MEMORY_REPORT_MAX_LIMIT = 100  # most allocation sites ?limit= can ask for per route
+
+# Slow query log (core.slow_queries). Queries at or over the threshold are written as JSON lines to a rotating
+# file, a sample with their Postgres EXPLAIN (ANALYZE, BUFFERS). Summarise with `manage.py slow_query_report`.
+# SLOW_QUERY_THRESHOLD_MS None, or empty or "off" in the environment, turns the observer off
+
+_slow_query_threshold = os.environ.get('SLOW_QUERY_THRESHOLD_MS', '200').strip()
+SLOW_QUERY_THRESHOLD_MS = None if _slow_query_threshold.lower() in ('', 'off') else float(_slow_query_threshold)
+SLOW_QUERY_EXPLAIN_RATE = 0.1
+SLOW_QUERY_LOG_FILE = os.environ.get('SLOW_QUERY_LOG_FILE', '/vol/web/logs/slow_queries.log')
+SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+
+# Deadlines and load shedding (core.middleware.LoadSheddingMiddleware). REQUEST_DEADLINES_MS is the time budget
+# per URL name, enforced on Postgres as statement_timeout. In flight limits are per worker process
+
+REQUEST_DEADLINES_MS = {
+        'default':            10000,
+        'recipe:recipe-list': 5000,
+}
+LOAD_SHED_MAX_QUEUE_MS = 5000  # requests that waited longer in the proxy queue are refused unprocessed
+LOAD_SHED_MAX_IN_FLIGHT = 50
+LOAD_SHED_MAX_IN_FLIGHT_PER_CLIENT = 10
+LOAD_SHED_RETRY_AFTER = 1  # seconds
+MAX_FILTER_IDS = 100  # longest ?tags= / ?ingredients= list accepted
+DUPLICATE_MAX_RECIPES = 100  # most recipes copied by one bulk-duplicate request
+LIST_GZIP_MIN_BYTES = 16 * 1024  # list responses at least this big are gzipped for clients that accept it
+
+# Recipe statistics (/api/recipe/recipes/stats/, recipe.stats), cached per user change number
+
+STATS_TIME_BUCKETS = (15, 30, 60, 120)  # minutes, upper bounds of the histogram buckets before the open last one
+STATS_PRICE_BUCKETS = (5, 10, 20, 50)
+STATS_TOP_COUNT = 10  # tags and ingredients listed
+STATS_CACHE_TIMEOUT = 24 * 60 * 60  # seconds, entries never go stale so this only bounds memory
+FACET_LIMIT = 50  # most values listed per ?facets= section of the recipe list
+
+# Tag and ingredient autocomplete (recipe.typeahead). Off Postgres each process caches the names of up to
+# TYPEAHEAD_CACHE_SIZE (user, kind) pairs
+
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_MAX_LIMIT = 50
+TYPEAHEAD_CACHE_SIZE = 1000
+
+# Similar recipes (/api/recipe/recipes/<id>/similar/, recipe.similarity), patched as recipes change and recomputed
+# with `manage.py rebuild_similar_recipes`
+
+SIMILAR_RECIPES_COUNT = 10  # matches kept per recipe
+SIMILAR_RECIPES_MIN_SCORE = 0.1  # Jaccard index of the tag and ingredient sets below which recipes aren't alike
+
+# Canonical ingredient catalog (core.catalog), each process remembers the ids of up to this many names
+
+CANONICAL_INGREDIENT_CACHE_SIZE = 10000
+
+# Pre-rendered recipe detail documents (recipe.documents). A tag or ingredient rename re-renders up to
+# RECIPE_DOCUMENT_FANOUT_LIMIT recipes in the request, more are marked stale and rendered by a job
+
+RECIPE_DOCUMENT_BATCH_SIZE = 200  # documents stored per UPDATE, two parameters each keeps SQLite under its limit
+RECIPE_DOCUMENT_FANOUT_LIMIT = 1000
+
+# Delta sync for offline clients (/api/recipe/sync/, core.sync). Most rows of each kind returned per request
+
+SYNC_PAGE_SIZE = 500
+
+# Batched requests (/api/batch/, core.batch). The batch as a whole gets the 'batch' entry of REQUEST_DEADLINES_MS
+
+BATCH_MAX_REQUESTS = 20
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+BATCH_MAX_RESPONSE_BYTES = 1024 * 1024  # larger sub-responses are answered 413, fetch them on their own
+
+# Batched deletion of users and recipes (core.deletion)
+
+DELETION_BATCH_SIZE = 1000
+
+# Database backed job queue (jobs app), run workers with `manage.py run_worker`. Lanes are drained in the order
+# listed, a job running longer than JOBS_LOCK_TIMEOUT is presumed lost with its worker and handed to another
+
+BACKGROUND_TASKS_INLINE = False  # run background work in the request instead, core.test_runner turns it on
+JOBS_QUEUES = ['high', 'default', 'low']
+JOBS_CONCURRENCY = int(os.environ.get('JOBS_CONCURRENCY', '2'))
+JOBS_POLL_INTERVAL = 1.0  # seconds an idle worker waits before looking again
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_BACKOFF = 10  # seconds before the first retry, doubled on each one after
+JOBS_RETRY_BACKOFF_MAX = 60 * 60
+JOBS_LOCK_TIMEOUT = 30 * 60  # seconds
+JOBS_CLAIM_CANDIDATES = 10  # rows tried per lane when the database has no SKIP LOCKED
+CORE_LOG_LEVEL = os.environ.get('CORE_LOG_LEVEL', 'INFO')
+
+LOGGING = {
+        'version':                  1,
+        'disable_existing_loggers': False,
+        'handlers':                 {
+                'console': {'class': 'logging.StreamHandler'},
+        },
+        'loggers':                  {
+                'core': {'handlers': ['console'], 'level': CORE_LOG_LEVEL},
+                'jobs': {'handlers': ['console'], 'level': CORE_LOG_LEVEL},
+        },
+}
@@ -17,9 +17,13 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
+from core import views as core_views
 
 urlpatterns = [
                       path('admin/', admin.site.urls),
                       path('api/user/', include('user.urls')),
                       path('api/recipe/', include('recipe.urls')),
+                      path('api/batch/', core_views.batch, name='batch'),
+                      path('api/memory/', core_views.memory_report, name='memory-report'),
+                      path('metrics', core_views.metrics, name='metrics'),
               ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
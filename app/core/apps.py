@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import m2m_changed
+        from core import slow_queries, sync
+        from core.models import Recipe
+        connection_created.connect(slow_queries.install, dispatch_uid='core.slow_queries')
+        for through in (Recipe.tags.through, Recipe.ingredients.through):
+            m2m_changed.connect(sync.recipe_links_changed, sender=through, dispatch_uid=f'core.sync.{through.__name__}')
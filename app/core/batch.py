@@ -0,0 +1,139 @@
+"""
+Several API requests in one round trip.
+
+POST /api/batch/ with {"requests": [{"method": "GET", "path": "/api/recipe/tags/"}, ...]} runs each sub-request
+in this process, in order, as the user the batch was authenticated as, and answers
+{"responses": [{"status": 200, "body": ...}, ...]} in the same order. Sub-requests go straight to their view:
+the middleware stack, authentication and the database connection are the batch request's. What
+LoadSheddingMiddleware enforces is applied to each of them here: its route's statement_timeout, capped by what
+is left of the batch's deadline, and one of the client's in-flight slots. Each sub-response is rendered once, as
+JSON, directly into the combined body; conditional and caching headers of the batch request aren't passed on.
+"""
+import io
+import json
+import logging
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import Http404
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+
+from core import deadlines, metrics
+from core.middleware import LoadSheddingMiddleware
+
+logger = logging.getLogger('core.batch')
+
+# caching headers the client sent for the batch itself, not for any of its entries
+CACHING_HEADERS = ('HTTP_CACHE_CONTROL', 'HTTP_PRAGMA', 'HTTP_RANGE')
+
+SUBREQUESTS = metrics.Counter(metrics.registry, 'batch_subrequests_total', 'Requests run inside /api/batch/',
+                              ('route', 'method', 'status'))
+
+
+def parse(data):
+    """Validate a batch body, returning (method, path, query string, JSON body) per sub-request"""
+    items = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValidationError({'requests': 'A non empty list of requests is required'})
+    if len(items) > settings.BATCH_MAX_REQUESTS:
+        raise ValidationError({'requests': f'At most {settings.BATCH_MAX_REQUESTS} requests can be batched'})
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            raise ValidationError({'requests': f'Request {index} needs a path'})
+        method = str(item.get('method', 'GET')).upper()
+        if method not in settings.BATCH_METHODS:
+            raise ValidationError({'requests': f'Request {index} uses {method}, allowed: {settings.BATCH_METHODS}'})
+        url = urlsplit(item['path'])
+        if url.scheme or url.netloc or not url.path.startswith('/api/'):
+            raise ValidationError({'requests': f'Request {index} must be a path under /api/'})
+        parsed.append((method, url.path, url.query, item.get('body')))
+    return parsed
+
+
+def _error(message):
+    return json.dumps({'detail': message}).encode()
+
+
+def _subrequest(request, method, path, query, body):
+    """
+    A request for one batch entry that DRF treats as already authenticated. It asks for plain JSON, whatever
+    ?format= the entry gives, since the body is pasted into the batch's JSON
+    """
+    payload = b'' if body is None else json.dumps(body).encode()
+    query = urlencode([(key, value) for key, value in parse_qsl(query, keep_blank_values=True)
+                       if key != api_settings.URL_FORMAT_OVERRIDE])
+    environ = {key: value for key, value in request.META.items()
+               if not key.startswith('HTTP_IF_') and key not in CACHING_HEADERS}
+    environ.update(REQUEST_METHOD=method, PATH_INFO=path, QUERY_STRING=query, CONTENT_TYPE='application/json',
+                   CONTENT_LENGTH=str(len(payload)), HTTP_ACCEPT='application/json')
+    environ['wsgi.input'] = io.BytesIO(payload)
+    environ.pop('HTTP_ACCEPT_ENCODING', None)  # the body is pasted into the batch's JSON, it must stay plain
+    subrequest = WSGIRequest(environ)
+    subrequest._force_auth_user, subrequest._force_auth_token = request.user, request.auth
+    return subrequest
+
+
+def _statement_budget(route, deadline):
+    """The route's own budget in milliseconds, never running past the batch's deadline"""
+    remaining = max(1, int((deadline - time.monotonic()) * 1000))  # 0 would turn statement_timeout off
+    budget = deadlines.route_budget(route)
+    return remaining if budget is None else min(budget, remaining)
+
+
+def _execute(request, method, path, query, body, deadline):
+    """Run one entry, returning its status and JSON encoded body"""
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return 404, _error('Not found.')
+    if match.view_name == 'batch':
+        return 400, _error('Batches can not be nested.')
+    shedding = getattr(request, 'load_shedding', None)  # missing when the middleware isn't installed
+    client = LoadSheddingMiddleware.client_key(request)
+    if shedding is not None and not shedding.claim(client):
+        return 429, _error('Too many concurrent requests.')
+    subrequest = _subrequest(request, method, path, query, body)
+    subrequest.resolver_match = match
+    try:
+        deadlines.apply_statement_timeout(_statement_budget(match.view_name, deadline))
+        response = match.func(subrequest, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+    except Http404:
+        return 404, _error('Not found.')
+    except Exception as exception:
+        if deadlines.is_statement_timeout(exception):
+            return 503, _error('Request took too long.')
+        logger.exception('Batched %s %s failed', method, path)
+        return 500, _error('Server error.')
+    finally:
+        if shedding is not None:
+            shedding.release(client)
+    SUBREQUESTS.inc(route=match.view_name, method=method, status=response.status_code)
+    content = response.content
+    if len(content) > settings.BATCH_MAX_RESPONSE_BYTES:
+        return 413, _error(f'Response over {settings.BATCH_MAX_RESPONSE_BYTES} bytes, request it on its own.')
+    if not response.get('Content-Type', '').startswith('application/json'):
+        return 406, _error('Only JSON responses can be batched, request it on its own.')
+    return response.status_code, content or b'null'
+
+
+def run(request, items):
+    """
+    Run parsed entries in order and return the combined JSON body. Entries still waiting when the batch's own
+    deadline (settings.REQUEST_DEADLINES_MS) passes are answered 504 without running
+    """
+    deadline = time.monotonic() + deadlines.route_budget('batch') / 1000
+    parts = []
+    for method, path, query, body in items:
+        if time.monotonic() > deadline:
+            status, content = 504, _error('The batch ran out of time before this request.')
+        else:
+            status, content = _execute(request, method, path, query, body, deadline)
+        parts.append(b'{"status":%d,"body":%s}' % (status, content))
+    return b'{"responses":[' + b','.join(parts) + b']}'
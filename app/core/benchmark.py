@@ -0,0 +1,156 @@
+"""Drive every API route through the test client against seeded data and record how each one performs"""
+import io
+import itertools
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.seed import seed, SEED_EMAIL, SEED_PASSWORD
+from recipe import similarity
+from recipe.urls import router, urlpatterns as recipe_urlpatterns
+from user.urls import urlpatterns as user_urlpatterns
+
+
+def route_names():
+    """Every named route in the recipe and user URLconfs"""
+    names = {f'recipe:{pattern.name}' for pattern in router.urls}
+    names.update(f'recipe:{pattern.name}' for pattern in recipe_urlpatterns if getattr(pattern, 'name', None))
+    names.update(f'user:{pattern.name}' for pattern in user_urlpatterns)
+    return names
+
+
+def _jpeg():
+    """A fresh small upload for each image request"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64)).save(buffer, format='JPEG')
+    return SimpleUploadedFile('bench.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+def cases(user, recipe_id):
+    """
+    The requests to time as (route name, method, url, payload factory, format).
+    Payloads are factories so writes never clash with the unique name indexes
+    """
+    counter = itertools.count()
+    tag_id = user.tag_set.values_list('id', flat=True).first()
+    detail = reverse('recipe:recipe-detail', args=[recipe_id])
+    recipe_list = reverse('recipe:recipe-list')
+    return [
+            ('recipe:api-root', 'get', reverse('recipe:api-root'), None, None),
+            ('recipe:tag-list', 'get', reverse('recipe:tag-list'), None, None),
+            ('recipe:tag-list', 'post', reverse('recipe:tag-list'),
+             lambda: {'name': f'bench tag {next(counter)}'}, 'json'),
+            ('recipe:tag-autocomplete', 'get', f'{reverse("recipe:tag-autocomplete")}?q=s', None, None),
+            ('recipe:ingredient-list', 'get', reverse('recipe:ingredient-list'), None, None),
+            ('recipe:ingredient-autocomplete', 'get', f'{reverse("recipe:ingredient-autocomplete")}?q=sa', None, None),
+            ('recipe:ingredient-list', 'post', reverse('recipe:ingredient-list'),
+             lambda: {'name': f'bench ingredient {next(counter)}'}, 'json'),
+            ('recipe:recipe-list', 'get', recipe_list, None, None),
+            ('recipe:recipe-list', 'get', f'{recipe_list}?tags={tag_id}', None, None),
+            ('recipe:recipe-list', 'get', f'{recipe_list}?format=columnar', None, None),
+            ('recipe:recipe-list', 'get', f'{recipe_list}?max_time=30&max_price=20&ordering=price', None, None),
+            ('recipe:recipe-list', 'post', recipe_list,
+             lambda: {'title': 'Bench recipe', 'time_minutes': 10, 'price': '5.00',
+                      'tag_names': ['bench'], 'ingredient_names': ['salt', 'pepper']}, 'json'),
+            ('recipe:recipe-similar', 'get', reverse('recipe:recipe-similar', args=[recipe_id]), None, None),
+            ('recipe:recipe-stats', 'get', reverse('recipe:recipe-stats'), None, None),
+            ('recipe:recipe-detail', 'get', detail, None, None),
+            ('recipe:recipe-detail', 'patch', detail, lambda: {'title': f'Bench {next(counter)}'}, 'json'),
+            ('recipe:recipe-upload-image', 'post', reverse('recipe:recipe-upload-image', args=[recipe_id]),
+             lambda: {'image': _jpeg()}, 'multipart'),
+            ('recipe:recipe-duplicate', 'post', reverse('recipe:recipe-duplicate', args=[recipe_id]), None, None),
+            ('recipe:recipe-bulk-duplicate', 'post', reverse('recipe:recipe-bulk-duplicate'),
+             lambda: {'ids': [recipe_id]}, 'json'),
+            ('recipe:recipe-bulk-delete', 'post', reverse('recipe:recipe-bulk-delete'),
+             lambda: {'ids': [0]}, 'json'),  # matches nothing, the seeded data has to survive the run
+            ('recipe:sync', 'get', reverse('recipe:sync'), None, None),
+            ('recipe:sync', 'get', f'{reverse("recipe:sync")}?since=1', None, None),
+            ('user:create', 'post', reverse('user:create'),
+             lambda: {'email': f'bench-{next(counter)}@example.com', 'password': 'bench-pass', 'name': 'Bench'},
+             'json'),
+            ('user:token', 'post', reverse('user:token'),
+             lambda: {'email': user.email, 'password': SEED_PASSWORD}, 'json'),
+            ('user:me', 'get', reverse('user:me'), None, None),
+            ('batch', 'post', reverse('batch'),
+             lambda: {'requests': [{'path': path} for path in (reverse('user:me'), reverse('recipe:tag-list'),
+                                                               reverse('recipe:ingredient-list'), recipe_list)]},
+             'json'),
+    ]
+
+
+def percentile(samples, fraction):
+    """Nearest rank percentile of an unsorted list"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _send(client, method, url, payload, fmt):
+    data = payload() if payload else None
+    return getattr(client, method)(url, data, format=fmt) if data is not None else getattr(client, method)(url)
+
+
+def measure(client, method, url, payload, fmt, iterations):
+    """Time iterations of one request, then trace a single extra request for queries and allocations"""
+    _send(client, method, url, payload, fmt)  # warm up caches and lazy imports
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = _send(client, method, url, payload, fmt)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        _send(client, method, url, payload, fmt)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+            'status':        response.status_code,
+            'p50_ms':        round(percentile(timings, 0.50), 3),
+            'p95_ms':        round(percentile(timings, 0.95), 3),
+            'p99_ms':        round(percentile(timings, 0.99), 3),
+            'mean_ms':       round(sum(timings) / len(timings), 3),
+            'queries':       len(queries),
+            'alloc_peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_scale(users, recipes, iterations, random_seed=0):
+    """Seed one scale into the current (empty) database and measure every case against it"""
+    seed(users=users, recipes=recipes, random_seed=random_seed)
+    user = get_user_model().objects.get(email=SEED_EMAIL.format(0))
+    recipe_id = Recipe.objects.filter(user=user).values_list('id', flat=True).first()
+    similarity.rebuild(user.id)  # seeding bypasses the signals that keep the index up to date
+    client = APIClient()
+    client.force_authenticate(user)
+    results = []
+    for name, method, url, payload, fmt in cases(user, recipe_id):
+        result = {'scale': f'{users}x{recipes}', 'route': name, 'method': method.upper(), 'url': url}
+        result.update(measure(client, method, url, payload, fmt, iterations))
+        results.append(result)
+    return results
+
+
+def result_key(result):
+    return result['scale'], result['method'], result['url']
+
+
+def compare(baseline, current, threshold):
+    """Return (key, metric, old, new) for every metric that got worse by more than threshold (a fraction)"""
+    previous = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in current:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'queries', 'alloc_peak_kb'):
+            if result[metric] > old[metric] * (1 + threshold) and result[metric] - old[metric] >= 1:
+                regressions.append((result_key(result), metric, old[metric], result[metric]))
+    return regressions
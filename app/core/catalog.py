@@ -0,0 +1,88 @@
+"""
+The shared catalog of canonical ingredient names.
+
+Every user has their own Ingredient rows, but the names they use come from a small common vocabulary. Each one is
+interned once as a CanonicalIngredient, keyed by its normalised spelling, and users' ingredients point at it, so
+the same ingredient has one id across users. Only the write path is deduplicated: creating an ingredient looks its
+name up in the cache below rather than the database. Ingredient rows keep the user's own spelling, which is what
+every read serves, so they are not smaller for it.
+
+Catalog rows are never changed or deleted, so each process keeps a name -> id map of the ones it has seen. Ids
+only enter the map once the transaction that read or created them commits, a rolled back insert would otherwise
+leave an id behind that doesn't exist.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+
+def normalize(name):
+    """The catalog key of a name: surrounding space dropped, lower cased"""
+    return name.strip().lower()
+
+
+class IdCache:
+    """Least recently used catalog key -> id map, bounded by CANONICAL_INGREDIENT_CACHE_SIZE"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                pk = self.entries.get(key)
+                if pk is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = pk
+        return found
+
+    def set_many(self, ids):
+        with self.lock:
+            self.entries.update(ids)
+            for key in ids:
+                self.entries.move_to_end(key)
+            while len(self.entries) > settings.CANONICAL_INGREDIENT_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+cache = IdCache()
+
+
+def intern_names(model, keys, attempts=3):
+    """
+    Return {key: id} for catalog keys, inserting the missing ones with one bulk insert. model is the catalog
+    model
+    """
+    keys = set(keys)
+    found = dict(model.objects.filter(name__in=keys).values_list('name', 'id')) if keys else {}
+    for _ in range(attempts):
+        missing = keys - found.keys()
+        if not missing:
+            break
+        try:
+            with transaction.atomic(using=model.objects.db):  # savepoint so a clash doesn't poison the caller
+                model.objects.bulk_create([model(name=key) for key in missing])
+        except IntegrityError:
+            pass  # another user's request interned some of these first, the re-read below picks them up
+        found.update(model.objects.filter(name__in=missing).values_list('name', 'id'))
+    return found
+
+
+def canonical_ids(model, names):
+    """{catalog key: id} for names, from the process cache where possible"""
+    keys = {normalize(name) for name in names}
+    found = cache.get_many(keys)
+    missing = keys - found.keys()
+    if missing:
+        interned = intern_names(model, missing)
+        transaction.on_commit(lambda: cache.set_many(interned), using=model.objects.db)
+        found.update(interned)
+    return found
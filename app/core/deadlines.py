@@ -0,0 +1,42 @@
+"""Per route time budgets enforced on the database with Postgres statement_timeout"""
+from django.conf import settings
+from django.db import connections
+from django.db.utils import OperationalError
+
+# Postgres' message when statement_timeout cancels a query, psycopg2 raises it as QueryCanceledError which
+# Django wraps as OperationalError
+TIMEOUT_MESSAGE = 'canceling statement due to statement timeout'
+
+
+def route_budget(route):
+    """Milliseconds a request to route may take, settings.REQUEST_DEADLINES_MS['default'] unless overridden"""
+    budgets = settings.REQUEST_DEADLINES_MS
+    return budgets.get(route, budgets.get('default'))
+
+
+def apply_statement_timeout(budget_ms, using='default'):
+    """
+    Make any single statement on this connection give up after budget_ms. Persistent connections remember the
+    value they were last given so the SET is only sent when the budget changes
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql' or budget_ms is None:
+        return
+    connection.ensure_connection()
+    key = (id(connection.connection), budget_ms)  # a reconnect gets a fresh session with the server default
+    if getattr(connection, 'statement_timeout_key', None) == key:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SET statement_timeout = %s', [int(budget_ms)])
+    connection.statement_timeout_key = key
+
+
+def is_statement_timeout(exception):
+    return isinstance(exception, OperationalError) and TIMEOUT_MESSAGE in str(exception)
+
+
+def is_connection_exhausted(exception):
+    """The server refused a new connection because every slot is in use"""
+    message = str(exception)
+    return isinstance(exception, OperationalError) and (
+            'too many connections' in message or 'remaining connection slots are reserved' in message)
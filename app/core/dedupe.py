@@ -0,0 +1,51 @@
+"""Merge case-insensitive duplicate tags and ingredients for a user, for the dedupe_attributes management command.
+
+Migration 0006 keeps its own copy of this logic, migrations must not depend on app code that changes later.
+"""
+from django.db import transaction
+from django.db.models import Count, Min
+from django.db.models.functions import Lower
+
+
+def duplicate_groups(model):
+    """Return (user_id, lower name, id to keep) for every group of case-insensitive duplicates"""
+    return (model.objects
+            .annotate(lower_name=Lower('name'))
+            .values('user_id', 'lower_name')
+            .annotate(rows=Count('id'), keep_id=Min('id'))  # oldest row survives
+            .filter(rows__gt=1)
+            .values_list('user_id', 'lower_name', 'keep_id'))
+
+
+def merge_group(model, through, user_id, lower_name, keep_id):
+    """
+    Repoint recipe links from the duplicates of a single group onto keep_id and delete the duplicates
+    :return: number of duplicate rows removed
+    """
+    column = f'{model._meta.model_name}_id'  # tag_id / ingredient_id on the recipe through table
+    duplicate_ids = list(model.objects
+                         .annotate(lower_name=Lower('name'))
+                         .filter(user_id=user_id, lower_name=lower_name)
+                         .exclude(id=keep_id)
+                         .values_list('id', flat=True))
+    if not duplicate_ids:
+        return 0
+    duplicates = model.objects.filter(id__in=duplicate_ids)
+    with transaction.atomic():
+        duplicates.record_deletion()
+        linked = set(through.objects.filter(**{f'{column}__in': duplicate_ids}).values_list('recipe_id', flat=True))
+        linked -= set(through.objects.filter(**{column: keep_id}).values_list('recipe_id', flat=True))
+        # a recipe may carry several spellings, so delete and re-insert rather than UPDATE into a unique clash
+        through.objects.filter(**{f'{column}__in': duplicate_ids}).delete()
+        through.objects.bulk_create([through(recipe_id=recipe_id, **{column: keep_id}) for recipe_id in linked])
+        duplicates.delete()
+    return len(duplicate_ids)
+
+
+def merge_duplicates(model, through):
+    """Merge every duplicate group for model. Returns (groups merged, rows removed)"""
+    groups = removed = 0
+    for user_id, lower_name, keep_id in list(duplicate_groups(model)):
+        removed += merge_group(model, through, user_id, lower_name, keep_id)
+        groups += 1
+    return groups, removed
@@ -0,0 +1,83 @@
+"""
+Delete large amounts of user data in bounded batches of set based DELETEs.
+
+Django's Collector loads every related object into memory and deletes them all in one transaction, which for a
+user with a big recipe book means a long lock on the recipe tables. Here each batch is its own short transaction
+and the rows are never loaded.
+"""
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.utils import timezone
+
+from core.models import Tag, Ingredient, Recipe, SimilarRecipe
+from recipe import similarity
+
+logger = logging.getLogger('core.deletion')
+
+
+def delete_rows(queryset, tombstones=True):
+    """
+    Delete queryset's rows, their M2M through rows and the rows cascading from them with one DELETE each, no
+    objects loaded and no signals sent. Synced rows leave tombstones unless tombstones is False (their owner is
+    going too)
+    :return: number of rows deleted from queryset's table
+    """
+    model = queryset.model
+    if tombstones and hasattr(queryset, 'record_deletion'):
+        queryset.record_deletion()
+    ids = queryset.values('id')
+    # recipes left behind whose similar recipes change, refreshed here as the raw DELETEs send no m2m_changed
+    affected = set()
+    if model is Recipe:
+        affected.update(SimilarRecipe.objects.filter(similar__in=ids).exclude(recipe__in=ids)
+                        .values_list('recipe_id', flat=True))
+    elif model in (Tag, Ingredient):
+        affected.update(Recipe.objects.filter(**{f'{model._meta.model_name}s__in': ids}).values_list('id', flat=True))
+    for field in model._meta.get_fields():  # recipe.tags / recipe.ingredients and their reverse sides
+        if field.many_to_many:
+            through = field.through if field.auto_created else field.remote_field.through
+            through.objects.filter(**{f'{model._meta.model_name}__in': ids})._raw_delete(queryset.db)
+    for relation in model._meta.related_objects:  # rows that cascade with these, e.g. recipes' similar recipes
+        if relation.one_to_many and relation.on_delete is models.CASCADE:
+            relation.related_model.objects.filter(**{f'{relation.field.name}__in': ids})._raw_delete(queryset.db)
+    deleted = queryset._raw_delete(queryset.db)
+    similarity.queue_refresh(affected)
+    return deleted
+
+
+def delete_in_batches(queryset, batch_size=None, tombstones=True):
+    """Delete queryset's rows batch_size at a time, each batch in its own transaction. Returns rows deleted"""
+    batch_size = batch_size or settings.DELETION_BATCH_SIZE
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return total
+            total += delete_rows(queryset.model.objects.filter(id__in=ids), tombstones)
+
+
+def delete_user_data(user_id, batch_size=None):
+    """Remove everything a user owns in batches, then the (now small) user row itself"""
+    counts = {
+            'recipes':     delete_in_batches(Recipe.objects.filter(user_id=user_id), batch_size, tombstones=False),
+            'tags':        delete_in_batches(Tag.objects.filter(user_id=user_id), batch_size, tombstones=False),
+            'ingredients': delete_in_batches(Ingredient.objects.filter(user_id=user_id), batch_size, tombstones=False),
+    }
+    get_user_model().objects.filter(id=user_id).delete()  # only auth tokens and permissions left to cascade
+    logger.info('Deleted user %s: %s', user_id, counts)
+    return counts
+
+
+def schedule_user_deletion(user):
+    """Lock the account out immediately and delete its data in the background"""
+    user.is_active = False
+    user.deletion_requested_at = timezone.now()
+    user.save(update_fields=['is_active', 'deletion_requested_at'])
+    if hasattr(user, 'auth_token'):
+        user.auth_token.delete()
+    from core.tasks import delete_user  # core.tasks imports this module
+    delete_user.delay(user.id)
@@ -0,0 +1,86 @@
+""" This command will be available to be ran from manage.py"""
+import json
+import platform
+import shutil
+import sys
+import tempfile
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment, override_settings
+
+from core import benchmark
+
+
+class Command(BaseCommand):
+    """
+    Django command to benchmark every API route at several data scales in a throwaway test database
+    """
+    help = 'Benchmark the API and write latency percentiles, query counts and allocations as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1x10,10x100,10x1000',
+                            help='Comma separated USERSxRECIPES scales, e.g. 1x10,10x1000')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per route')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write results here instead of stdout')
+        parser.add_argument('--compare', help='Baseline JSON from a previous run to diff against')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Fractional worsening that counts as a regression')
+
+    @staticmethod
+    def _parse_scales(value):
+        try:
+            return [tuple(int(part) for part in scale.split('x')) for scale in value.split(',')]
+        except ValueError:
+            raise CommandError(f'Invalid --scales "{value}", expected e.g. 1x10,10x100')
+
+    def handle(self, *args, **options):
+        scales = self._parse_scales(options['scales'])
+        media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                results = []
+                for users, recipes in scales:
+                    call_command('flush', interactive=False, verbosity=0)
+                    self.stderr.write(f'Benchmarking {users}x{recipes}...')
+                    results.extend(benchmark.run_scale(users, recipes, options['iterations'], options['seed']))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        missing = benchmark.route_names() - {result['route'] for result in results}
+        if missing:
+            self.stderr.write(self.style.WARNING(f'Routes not benchmarked: {", ".join(sorted(missing))}'))
+
+        report = {
+                'meta':    {
+                        'python':     platform.python_version(),
+                        'django':     django.get_version(),
+                        'database':   connection.vendor,
+                        'iterations': options['iterations'],
+                        'seed':       options['seed'],
+                },
+                'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+            regressions = benchmark.compare(baseline, results, options['threshold'])
+            for (scale, method, url), metric, old, new in regressions:
+                self.stderr.write(self.style.ERROR(f'{scale} {method} {url} {metric}: {old} -> {new}'))
+            if regressions:
+                sys.exit(1)
+            self.stderr.write(self.style.SUCCESS('No regressions against baseline'))
@@ -0,0 +1,29 @@
+""" This command will be available to be ran from manage.py"""
+from django.core.management.base import BaseCommand
+
+from core.dedupe import duplicate_groups, merge_duplicates
+from core.models import Tag, Ingredient, Recipe
+
+
+class Command(BaseCommand):
+    """
+    Django command to merge tags and ingredients that differ only by case, repointing recipes onto the survivor
+    """
+    help = 'Merge case-insensitive duplicate tags and ingredients per user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be merged')
+
+    def handle(self, *args, **options):
+        targets = (
+                (Tag, Recipe.tags.through),
+                (Ingredient, Recipe.ingredients.through),
+        )
+        for model, through in targets:
+            label = model._meta.verbose_name_plural
+            if options['dry_run']:
+                groups = duplicate_groups(model).count()
+                self.stdout.write(f'{groups} duplicate {label} groups found')
+                continue
+            groups, removed = merge_duplicates(model, through)
+            self.stdout.write(self.style.SUCCESS(f'Merged {groups} {label} groups, removed {removed} rows'))
@@ -0,0 +1,44 @@
+""" This command will be available to be ran from manage.py"""
+import glob
+import io
+import os
+import pstats
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.profiling import route_directory
+
+
+class Command(BaseCommand):
+    """
+    Django command to merge the saved request profiles for each route and print the most expensive functions
+    """
+    help = 'Summarise request profiles written by the profiling middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('routes', nargs='*', help='URL names e.g. recipe:recipe-list, all routes by default')
+        parser.add_argument('--limit', type=int, default=20, help='Functions to show per route')
+        parser.add_argument('--sort', default='cumulative', help='pstats sort key')
+
+    def handle(self, *args, **options):
+        if options['routes']:
+            directories = [route_directory(route) for route in options['routes']]
+        else:
+            directories = sorted(glob.glob(os.path.join(settings.PROFILING_DIR, '*')))
+        if not directories:
+            raise CommandError(f'No profiles in {settings.PROFILING_DIR}')
+
+        for directory in directories:
+            files = sorted(glob.glob(os.path.join(directory, '*.pstats')))
+            if not files:
+                self.stdout.write(self.style.WARNING(f'No profiles for {os.path.basename(directory)}'))
+                continue
+            self.stdout.write(self.style.SUCCESS(f'{os.path.basename(directory)}: {len(files)} requests'))
+            report = io.StringIO()  # self.stdout ends every write with a newline, pstats writes in fragments
+            stats = pstats.Stats(*files, stream=report)
+            stats.sort_stats(options['sort']).print_stats(options['limit'])
+            self.stdout.write(report.getvalue())
+            collapsed = os.path.join(directory, 'stacks.collapsed')
+            if os.path.exists(collapsed):
+                self.stdout.write(f'Flame graph input: {collapsed}')
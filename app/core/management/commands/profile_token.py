@@ -0,0 +1,15 @@
+""" This command will be available to be ran from manage.py"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import make_token
+
+
+class Command(BaseCommand):
+    """
+    Django command to print a signed header value that makes the profiling middleware profile a request
+    """
+    help = 'Print a signed profiling trigger header'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{settings.PROFILING_TRIGGER_HEADER}: {make_token()}')
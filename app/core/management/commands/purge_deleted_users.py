@@ -0,0 +1,23 @@
+""" This command will be available to be ran from manage.py"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core.deletion import delete_user_data
+
+
+class Command(BaseCommand):
+    """
+    Django command to finish deleting users whose background deletion didn't complete, e.g. after a restart
+    """
+    help = 'Delete the data of every user marked for deletion'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        user_ids = list(get_user_model().objects.filter(deletion_requested_at__isnull=False)
+                        .values_list('id', flat=True))
+        for user_id in user_ids:
+            counts = delete_user_data(user_id, options['batch_size'])
+            self.stdout.write(f'Deleted user {user_id}: {counts}')
+        self.stdout.write(self.style.SUCCESS(f'Purged {len(user_ids)} users'))
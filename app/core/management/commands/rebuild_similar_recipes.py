@@ -0,0 +1,21 @@
+""" This command will be available to be ran from manage.py"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recipe.similarity import rebuild
+
+
+class Command(BaseCommand):
+    """
+    Django command to recompute the similar recipes index, which is otherwise only patched as recipes change
+    """
+    help = "Recompute every recipe's similar recipes, for all users or those given"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='User id, may be repeated')
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or list(get_user_model().objects.filter(is_active=True).order_by('id')
+                                            .values_list('id', flat=True))
+        rows = sum(rebuild(user_id) for user_id in user_ids)
+        self.stdout.write(self.style.SUCCESS(f'Stored {rows} similar recipes for {len(user_ids)} users'))
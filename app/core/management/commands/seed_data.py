@@ -0,0 +1,32 @@
+""" This command will be available to be ran from manage.py"""
+from django.core.management.base import BaseCommand
+
+from core.seed import seed
+
+
+class Command(BaseCommand):
+    """
+    Django command to generate a deterministic synthetic data set for load testing
+    """
+    help = 'Generate N users x M recipes with Zipf distributed tags and ingredients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--recipes', type=int, default=50, help='Recipes per user')
+        parser.add_argument('--tags', type=int, default=20, help='Tags per user')
+        parser.add_argument('--ingredients', type=int, default=50, help='Ingredients per user')
+        parser.add_argument('--tags-per-recipe', type=int, default=3)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--image-ratio', type=float, default=0.0, help='Fraction of recipes given an image')
+        parser.add_argument('--zipf-exponent', type=float, default=1.1)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, same seed gives the same data')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Seeding data...')
+        counts = seed(users=options['users'], recipes=options['recipes'], tags=options['tags'],
+                      ingredients=options['ingredients'], tags_per_recipe=options['tags_per_recipe'],
+                      ingredients_per_recipe=options['ingredients_per_recipe'],
+                      image_ratio=options['image_ratio'], exponent=options['zipf_exponent'],
+                      random_seed=options['seed'])
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Created {summary}'))
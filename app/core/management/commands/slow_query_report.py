@@ -0,0 +1,59 @@
+""" This command will be available to be ran from manage.py"""
+import glob
+import json
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.slow_queries import fingerprint
+
+
+class Command(BaseCommand):
+    """
+    Django command to group the slow query log by normalised query and show the worst offenders
+    """
+    help = 'Summarise the slow query log by query fingerprint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None, help='Log file, defaults to SLOW_QUERY_LOG_FILE and rotations')
+        parser.add_argument('--limit', type=int, default=10, help='Fingerprints to show')
+        parser.add_argument('--sort', choices=('total', 'count', 'max', 'mean'), default='total')
+        parser.add_argument('--plans', action='store_true', help='Show the most recent captured plan for each')
+
+    def entries(self, path):
+        for filename in sorted(glob.glob(path + '*')):  # the live log plus .1, .2 ... rotations
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+    def handle(self, *args, **options):
+        path = options['file'] or settings.SLOW_QUERY_LOG_FILE
+        groups = defaultdict(lambda: {'count': 0, 'total': 0.0, 'max': 0.0, 'origins': Counter(), 'plan': None})
+        for entry in self.entries(path):
+            group = groups[entry['fingerprint']]
+            group['count'] += 1
+            group['total'] += entry['duration_ms']
+            group['max'] = max(group['max'], entry['duration_ms'])
+            group['origins'][entry.get('origin') or entry.get('route') or 'unknown'] += 1
+            group['sql'] = fingerprint(entry['sql'])[1]
+            if entry.get('plan'):
+                group['plan'] = entry['plan']
+        if not groups:
+            raise CommandError(f'No slow queries logged in {path}')
+
+        for group in groups.values():
+            group['mean'] = group['total'] / group['count']
+        ranked = sorted(groups.items(), key=lambda item: item[1][options['sort']], reverse=True)
+        for key, group in ranked[:options['limit']]:
+            self.stdout.write(self.style.WARNING(
+                    f"{key}  count={group['count']} total={group['total']:.1f}ms "
+                    f"mean={group['mean']:.1f}ms max={group['max']:.1f}ms"))
+            self.stdout.write(f"  {group['sql']}")
+            for where, count in group['origins'].most_common(3):
+                self.stdout.write(f'  {count}x from {where}')
+            if options['plans'] and group['plan']:
+                self.stdout.write('  ' + group['plan'].replace('\n', '\n  '))
@@ -0,0 +1,116 @@
+"""
+Per route memory allocation tracking with tracemalloc.
+
+Traces are cleared as each tracked request starts, so afterwards the traced peak is that request's peak and
+whatever is still traced is what it allocated and left alive (caches, leaks, lazily built module state). This
+assumes one request at a time per process, requests arriving while another is tracked are skipped.
+"""
+import os
+import random
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class RouteMemory:
+    """Allocation totals for one route"""
+
+    def __init__(self):
+        self.requests = 0
+        self.peak_max = 0
+        self.peak_total = 0
+        self.retained_total = 0
+        self.sites = Counter()  # site -> bytes left allocated by requests to this route
+
+    def as_dict(self, limit):
+        return {
+                'requests':     self.requests,
+                'peak_max_kb':  round(self.peak_max / 1024, 1),
+                'peak_mean_kb': round(self.peak_total / self.requests / 1024, 1),
+                'retained_kb':  round(self.retained_total / 1024, 1),
+                'top_sites':    [{'site': site, 'retained_kb': round(size / 1024, 1)}
+                                 for site, size in self.sites.most_common(limit)],
+        }
+
+
+class MemoryTracker:
+    """Collects RouteMemory for every route handled by this process"""
+
+    def __init__(self):
+        self.routes = defaultdict(RouteMemory)
+        self.busy = threading.Lock()
+        self.lock = threading.Lock()
+        self.project_dir = settings.BASE_DIR
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(settings.MEMORY_TRACKING_FRAMES)
+
+    def begin(self):
+        """Start tracking a request, False if another request is already being tracked"""
+        if not self.busy.acquire(blocking=False):
+            return False
+        tracemalloc.clear_traces()
+        return True
+
+    def end(self, route):
+        """Attribute what the request allocated to route"""
+        try:
+            retained, peak = tracemalloc.get_traced_memory()
+            snapshot = None
+            if random.random() < settings.MEMORY_TRACKING_SNAPSHOT_RATE:
+                snapshot = tracemalloc.take_snapshot().filter_traces((
+                        tracemalloc.Filter(False, tracemalloc.__file__),
+                        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                ))
+        finally:
+            self.busy.release()
+
+        with self.lock:
+            stats = self.routes[route]
+            stats.requests += 1
+            stats.peak_max = max(stats.peak_max, peak)
+            stats.peak_total += peak
+            stats.retained_total += retained
+            if snapshot is not None:
+                for stat in snapshot.statistics('traceback')[:settings.MEMORY_TRACKING_TOP_SITES]:
+                    stats.sites[self.site(stat.traceback)] += stat.size
+
+    def site(self, traceback):
+        """
+        Describe where memory was allocated, the innermost frame plus the closest frame in this project so
+        allocations made inside Django or DRF still point at the view or serializer that caused them
+        """
+        frames = list(traceback)  # oldest first, so the allocation itself is the last frame
+        if not frames:
+            return 'unknown'
+        label = f'{frames[-1].filename}:{frames[-1].lineno}'
+        for frame in reversed(frames[:-1]):
+            if frame.filename.startswith(self.project_dir):
+                relative = os.path.relpath(frame.filename, self.project_dir)
+                return f'{label} via {relative}:{frame.lineno}'
+        return label
+
+    def report(self, limit=10):
+        """Routes ordered by memory left allocated, plus the process's peak RSS"""
+        with self.lock:
+            routes = sorted(self.routes.items(), key=lambda item: item[1].retained_total, reverse=True)
+            report = {'routes': {route: stats.as_dict(limit) for route, stats in routes}}
+        if resource is not None:
+            report['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # kB on Linux
+        report['pid'] = os.getpid()
+        return report
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+
+tracker = MemoryTracker()
@@ -0,0 +1,232 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Each worker process keeps its own counters in memory and periodically writes them to its own file in
+settings.METRICS_DIR. The /metrics view adds every other worker's file to its own live values, so whichever worker
+answers the scrape reports totals for all of them. Without METRICS_DIR only the answering process is reported.
+A scrape folds the files of workers that have exited into one file of their totals, so counters don't go back
+when a worker is replaced and the directory doesn't grow with every restart.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+DEAD_WORKERS_FILE = 'metrics-exited.json'  # the summed values of workers that have exited
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(pairs):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric whose values are kept per combination of label values"""
+    kind = None
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.registry = registry
+        registry.register(self)
+
+    def key(self, labels):
+        """Label values in declaration order, as a JSON string so files can store them as keys"""
+        return json.dumps([str(labels[name]) for name in self.labels])
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            values = self.registry.values[self.name]
+            values[key] = values.get(key, 0) + amount
+
+    @staticmethod
+    def merge(total, value):
+        return total + value
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, list(zip(self.labels, json.loads(key))), value
+
+
+class Histogram(Metric):
+    """Observations counted into buckets, stored as [count per bucket..., count above last, sum]"""
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, documentation, labels)
+
+    def observe(self, amount, **labels):
+        key = self.key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if amount <= bound), len(self.buckets))
+        with self.registry.lock:
+            values = self.registry.values[self.name]
+            value = values.setdefault(key, [0] * (len(self.buckets) + 1) + [0])
+            value[index] += 1
+            value[-1] += amount
+
+    @staticmethod
+    def merge(total, value):
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            labels = list(zip(self.labels, json.loads(key)))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), value[:-1]):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + [('le', bound)], cumulative
+            yield f'{self.name}_sum', labels, value[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(path):
+    """Whether the worker that wrote a metrics-<pid>-<id>.json file is still running"""
+    try:
+        os.kill(int(os.path.basename(path).split('-')[1]), 0)
+    except ValueError:  # not a worker's file
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # running as another user
+        pass
+    return True
+
+
+class Registry:
+    """Every metric for this process plus the file backed sharing between worker processes"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.values = {}
+        self.lock = threading.Lock()
+        self.last_flush = 0
+        # pid alone can be reused by a later worker, which would look like a counter reset
+        self.filename = f'metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        self.values[metric.name] = {}
+
+    @staticmethod
+    def directory():
+        return getattr(settings, 'METRICS_DIR', None)
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.values))  # deep copy that matches what other workers' files hold
+
+    def flush(self, force=False):
+        """Write this process's values for other workers to read, at most every METRICS_FLUSH_INTERVAL seconds"""
+        directory = self.directory()
+        now = time.monotonic()
+        if not directory or (not force and now - self.last_flush < settings.METRICS_FLUSH_INTERVAL):
+            return
+        self.last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)  # readers never see a half written file
+
+    def add(self, totals, other):
+        """Sum another worker's values into totals"""
+        for name, values in other.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            into = totals.setdefault(name, {})
+            for key, value in values.items():
+                into[key] = metric.merge(into[key], value) if key in into else value
+
+    def remove_dead(self, directory):
+        """
+        Add the files of workers whose process has exited to DEAD_WORKERS_FILE and delete them, the multiprocess
+        mark_process_dead pattern. Call it holding the directory's lock
+        """
+        dead = [path for path in glob.glob(os.path.join(directory, 'metrics-*-*.json')) if not _alive(path)]
+        if not dead:
+            return
+        path = os.path.join(directory, DEAD_WORKERS_FILE)
+        exited = _read(path) or {}
+        for other in dead:
+            self.add(exited, _read(other) or {})
+        with open(path + '.tmp', 'w') as f:
+            json.dump(exited, f)
+        os.replace(path + '.tmp', path)
+        for other in dead:
+            os.remove(other)
+
+    def collect(self):
+        """Values summed across this process (live), every other worker's last flush and the workers gone since"""
+        totals = self.snapshot()
+        directory = self.directory()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, 'metrics.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # another scrape mid fold would count a dead worker twice
+                self.remove_dead(directory)
+                for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+                    other = None if os.path.basename(path) == self.filename else _read(path)
+                    if other is not None:  # None for a worker being replaced, skipped for this scrape
+                        self.add(totals, other)
+        return totals
+
+    def render(self):
+        """The Prometheus text exposition format"""
+        totals = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for sample, labels, value in metric.samples(totals[name]):
+                lines.append(f'{sample}{_format_labels(labels)} {_format_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+atexit.register(registry.flush, force=True)
+
+REQUESTS = Counter(registry, 'http_requests_total', 'Requests handled', ('route', 'method', 'status'))
+ERRORS = Counter(registry, 'http_request_errors_total', 'Requests answered with a 5xx status', ('route', 'method'))
+LATENCY = Histogram(registry, 'http_request_duration_seconds', 'Time to handle a request', ('route', 'method'))
+DB_QUERIES = Histogram(registry, 'http_request_db_queries', 'Database queries per request', ('route',),
+                       buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+DB_DURATION = Histogram(registry, 'http_request_db_duration_seconds', 'Database time per request', ('route',))
+CACHE = Counter(registry, 'cache_requests_total', 'Cache lookups by result (hit or miss)', ('cache', 'result'))
+IMAGE_UPLOAD_BYTES = Histogram(registry, 'image_upload_bytes', 'Size of uploaded recipe images', (),
+                               buckets=(10e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6))
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup, hit ratio being hits / (hits + misses) per cache name"""
+    CACHE.inc(cache=cache, result='hit' if hit else 'miss')
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+
+from core import deadlines, memory, metrics, performance, profiling
+
+logger = logging.getLogger('core.performance')
+
+
+def route_name(request):
+    """The URL name of the matched view, e.g. recipe:recipe-list, or None before/without a match"""
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else None
+
+
+class PerformanceMiddleware:
+    """
+    Record DB, view, serializer and render time for each request, report them in a Server-Timing header and a
+    structured log line, and warn when a request goes over its budget in settings.PERFORMANCE_BUDGETS
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = performance.activate()
+        request.performance = timings
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            performance.deactivate()
+        finished = time.perf_counter()
+
+        if timings.view_started is not None:
+            # DRF responses render after process_template_response, so anything after it is render time
+            view_finished = timings.view_finished or finished
+            timings.add('view', view_finished - timings.view_started)
+            if timings.view_finished is not None:
+                timings.add('render', finished - timings.view_finished)
+        timings.add('total', finished - timings.started)
+
+        if getattr(settings, 'PERFORMANCE_SERVER_TIMING', True):
+            response['Server-Timing'] = self.server_timing(timings)
+        self.log(request, response, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.performance.route = route_name(request)
+        request.performance.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        request.performance.view_finished = time.perf_counter()
+        return response
+
+    @staticmethod
+    def server_timing(timings):
+        """Format the durations as a Server-Timing header value"""
+        metrics = []
+        for name, duration in timings.milliseconds().items():
+            metric = f'{name};dur={duration}'
+            if name == 'db':
+                metric += f';desc="{timings.queries} queries"'
+            metrics.append(metric)
+        return ', '.join(metrics)
+
+    @staticmethod
+    def over_budget(route, timings):
+        """Return the budget names exceeded, route budgets overriding the default ones"""
+        budgets = getattr(settings, 'PERFORMANCE_BUDGETS', {})
+        budget = dict(budgets.get('default', {}), **budgets.get(route, {}))
+        measured = {f'{name}_ms': duration for name, duration in timings.milliseconds().items()}
+        measured['db_queries'] = timings.queries
+        return sorted(name for name, limit in budget.items() if measured.get(name, 0) > limit)
+
+    def log(self, request, response, timings):
+        route = route_name(request)
+        record = {
+                'method':     request.method,
+                'path':       request.path,
+                'route':      route,
+                'status':     response.status_code,
+                'db_queries': timings.queries,
+        }
+        record.update((f'{name}_ms', duration) for name, duration in timings.milliseconds().items())
+        exceeded = self.over_budget(route, timings)
+        if exceeded:
+            record['over_budget'] = exceeded
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+
+
+class ProfilingMiddleware:
+    """
+    Profile a sample of requests (settings.PROFILING_SAMPLE_RATE) plus any carrying a valid signed trigger header,
+    writing the results per route under settings.PROFILING_DIR. Removed from the chain when PROFILING_ENABLED is off
+    so unsampled production traffic pays one random() call at most
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.header = 'HTTP_' + settings.PROFILING_TRIGGER_HEADER.upper().replace('-', '_')
+
+    def sampled(self, request):
+        """None for a request left alone, else whether it is profiled with cProfile rather than the stack sampler"""
+        token = request.META.get(self.header)
+        if token:
+            return True if profiling.valid_token(token) else None  # asked for one request's full call graph
+        if random.random() < settings.PROFILING_SAMPLE_RATE:
+            return random.random() < settings.PROFILING_CPROFILE_SHARE
+        return None
+
+    def __call__(self, request):
+        deterministic = self.sampled(request)
+        if deterministic is None:
+            return self.get_response(request)
+        profiler = profiling.RequestProfiler(deterministic)
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        try:
+            profiler.save(route_name(request))
+        except OSError:
+            logger.exception('Could not write request profile')
+        return response
+
+
+class MetricsMiddleware:
+    """Count requests, errors, latency and queries per route for the /metrics endpoint"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+        route = route_name(request) or 'unresolved'  # unmatched paths would make label values unbounded
+
+        metrics.REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        metrics.LATENCY.observe(elapsed, route=route, method=request.method)
+        if response.status_code >= 500:
+            metrics.ERRORS.inc(route=route, method=request.method)
+        timings = getattr(request, 'performance', None)  # set by PerformanceMiddleware when it runs outside us
+        if timings is not None:
+            metrics.DB_QUERIES.observe(timings.queries, route=route)
+            metrics.DB_DURATION.observe(timings.durations['db'], route=route)
+        metrics.registry.flush()
+        return response
+
+
+class MemoryTrackingMiddleware:
+    """
+    Record peak and retained tracemalloc allocation per route, see core.memory. Removed from the chain unless
+    settings.MEMORY_TRACKING_ENABLED is on because tracing slows every allocation in the process
+    """
+
+    def __init__(self, get_response):
+        if not settings.MEMORY_TRACKING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        memory.tracker.start()
+
+    def __call__(self, request):
+        if not memory.tracker.begin():
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            memory.tracker.end(route_name(request) or 'unresolved')
+        return response
+
+
+class LoadSheddingMiddleware:
+    """
+    Turn overload into fast refusals instead of a growing backlog:
+
+    * 503 when the request already waited longer than LOAD_SHED_MAX_QUEUE_MS in the proxy queue (X-Request-Start)
+    * 503 when this worker already has LOAD_SHED_MAX_IN_FLIGHT requests running
+    * 429 when one client (auth token or address) has LOAD_SHED_MAX_IN_FLIGHT_PER_CLIENT of them
+    * 503 when a query hits the route's statement_timeout or Postgres has no connection slots left
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.per_client = Counter()
+
+    @staticmethod
+    def refuse(status, detail):
+        response = JsonResponse({'detail': detail}, status=status)
+        response['Retry-After'] = str(settings.LOAD_SHED_RETRY_AFTER)
+        return response
+
+    @staticmethod
+    def queued_ms(request):
+        """
+        Time since the proxy received the request, from X-Request-Start as t=<seconds|ms|us since the epoch>
+        (nginx and Heroku style). None when the header is missing or unreadable
+        """
+        value = request.META.get('HTTP_X_REQUEST_START', '')
+        try:
+            started = float(value[2:] if value.startswith('t=') else value)
+        except ValueError:
+            return None
+        while started > time.time() * 10:  # scale microseconds / milliseconds down to seconds
+            started /= 1000
+        return max(0.0, (time.time() - started) * 1000)
+
+    @staticmethod
+    def client_key(request):
+        credentials = request.META.get('HTTP_AUTHORIZATION')
+        if credentials:
+            return hashlib.sha1(credentials.encode()).hexdigest()  # don't keep tokens in memory
+        return request.META.get('REMOTE_ADDR')
+
+    def __call__(self, request):
+        queued = self.queued_ms(request)
+        if queued is not None and queued > settings.LOAD_SHED_MAX_QUEUE_MS:
+            return self.refuse(503, 'Server busy, request waited too long to start.')
+
+        client = self.client_key(request)
+        with self.lock:
+            if self.in_flight >= settings.LOAD_SHED_MAX_IN_FLIGHT:
+                return self.refuse(503, 'Server busy, try again shortly.')
+            if self.per_client[client] >= settings.LOAD_SHED_MAX_IN_FLIGHT_PER_CLIENT:
+                return self.refuse(429, 'Too many concurrent requests.')
+            self.in_flight += 1
+            self.per_client[client] += 1
+        request.load_shedding = self  # core.batch counts its sub-requests against the same client
+        try:
+            return self.get_response(request)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.release(client)
+
+    def claim(self, client):
+        """Take one more of client's in-flight slots for work run inside a request, False when none is left"""
+        with self.lock:
+            if self.per_client[client] >= settings.LOAD_SHED_MAX_IN_FLIGHT_PER_CLIENT:
+                return False
+            self.per_client[client] += 1
+        return True
+
+    def release(self, client):
+        with self.lock:
+            self.per_client[client] -= 1
+            if not self.per_client[client]:
+                del self.per_client[client]
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        deadlines.apply_statement_timeout(deadlines.route_budget(route_name(request)))
+
+    def process_exception(self, request, exception):
+        if deadlines.is_statement_timeout(exception):
+            logger.warning(json.dumps({'path': request.path, 'route': route_name(request),
+                                       'error': 'statement_timeout'}))
+            return self.refuse(503, 'Request took too long.')
+        if deadlines.is_connection_exhausted(exception):
+            return self.refuse(503, 'Server busy, try again shortly.')
@@ -0,0 +1,75 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+from django.db.models.functions import Lower
+
+
+def merge_duplicates(model, through):
+    """
+    Merge each user's case-insensitive duplicates of model into the oldest row, moving their recipe links onto it.
+    A copy of core.dedupe as it was when this migration was written, migrations must not import app code
+    """
+    column = f'{model._meta.model_name}_id'  # tag_id / ingredient_id on the recipe through table
+    groups = list(model.objects
+                  .annotate(lower_name=Lower('name'))
+                  .values('user_id', 'lower_name')
+                  .annotate(rows=Count('id'), keep_id=Min('id'))
+                  .filter(rows__gt=1)
+                  .values_list('user_id', 'lower_name', 'keep_id'))
+    for user_id, lower_name, keep_id in groups:
+        duplicate_ids = list(model.objects
+                             .annotate(lower_name=Lower('name'))
+                             .filter(user_id=user_id, lower_name=lower_name)
+                             .exclude(id=keep_id)
+                             .values_list('id', flat=True))
+        linked = set(through.objects.filter(**{f'{column}__in': duplicate_ids}).values_list('recipe_id', flat=True))
+        linked -= set(through.objects.filter(**{column: keep_id}).values_list('recipe_id', flat=True))
+        # a recipe may carry several spellings, so delete and re-insert rather than UPDATE into a unique clash
+        through.objects.filter(**{f'{column}__in': duplicate_ids}).delete()
+        through.objects.bulk_create([through(recipe_id=recipe_id, **{column: keep_id}) for recipe_id in linked])
+        model.objects.filter(id__in=duplicate_ids).delete()
+
+
+def merge_duplicate_attributes(apps, schema_editor):
+    """Existing duplicates would block the unique indexes below"""
+    recipe = apps.get_model('core', 'Recipe')
+    merge_duplicates(apps.get_model('core', 'Tag'), recipe.tags.through)
+    merge_duplicates(apps.get_model('core', 'Ingredient'), recipe.ingredients.through)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_recipe_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'name'], name='core_tag_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'name'], name='core_ingredient_user_name_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_attributes, migrations.RunPython.noop),
+        # expression indexes can't be declared on the model in this Django version
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX core_tag_user_lower_name_uniq ON core_tag (user_id, LOWER(name));'],
+            ['DROP INDEX core_tag_user_lower_name_uniq;'],
+        ),
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX core_ingredient_user_lower_name_uniq ON core_ingredient (user_id, LOWER(name));'],
+            ['DROP INDEX core_ingredient_user_lower_name_uniq;'],
+        ),
+        # filtering recipes by tag/ingredient walks the through tables from x_id, dropped again in 0016 as Django's own
+        # single column x_id indexes serve it
+        migrations.RunSQL(
+            ['CREATE INDEX core_recipe_tags_tag_recipe_idx ON core_recipe_tags (tag_id, recipe_id);'],
+            ['DROP INDEX core_recipe_tags_tag_recipe_idx;'],
+        ),
+        migrations.RunSQL(
+            ['CREATE INDEX core_recipe_ingredients_ingredient_recipe_idx '
+             'ON core_recipe_ingredients (ingredient_id, recipe_id);'],
+            ['DROP INDEX core_recipe_ingredients_ingredient_recipe_idx;'],
+        ),
+    ]
@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def _change_seq(model_name):
+    # existing rows count as each user's first change so a client syncing from 0 receives them, new rows are
+    # always stamped on save
+    return [
+        migrations.AddField(
+            model_name=model_name,
+            name='change_seq',
+            field=models.BigIntegerField(default=1),
+        ),
+        migrations.AlterField(
+            model_name=model_name,
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
+
+
+def _updated_at(model_name):
+    return migrations.AddField(
+        model_name=model_name,
+        name='updated_at',
+        field=models.DateTimeField(auto_now=True),  # existing rows get the migration time
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_user_deletion_requested_at'),
+    ]
+
+    operations = [
+        *_change_seq('user'),
+        *_change_seq('tag'),
+        *_change_seq('ingredient'),
+        *_change_seq('recipe'),
+        _updated_at('tag'),
+        _updated_at('ingredient'),
+        _updated_at('recipe'),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('change_seq', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'change_seq'], name='core_tag_user_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'change_seq'], name='core_ingredient_user_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'change_seq'], name='core_recipe_user_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'change_seq'], name='core_tombstone_user_seq_idx'),
+        ),
+        # SQLite rebuilds core_tag and core_ingredient to add change_seq, dropping the expression indexes 0006 made
+        # with raw SQL; on Postgres they survive and IF NOT EXISTS skips them
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX IF NOT EXISTS core_tag_user_lower_name_uniq ON core_tag (user_id, LOWER(name));',
+             'CREATE UNIQUE INDEX IF NOT EXISTS core_ingredient_user_lower_name_uniq '
+             'ON core_ingredient (user_id, LOWER(name));'],
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+TABLES = ('core_tag', 'core_ingredient')
+
+
+def create_prefix_indexes(apps, schema_editor):
+    # text_pattern_ops lets LIKE 'prefix%' use the index whatever the collation. Postgres only, other databases
+    # serve the typeahead from memory (recipe.typeahead)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in TABLES:
+        schema_editor.execute(
+            f'CREATE INDEX {table}_user_prefix_idx ON {table} (user_id, LOWER(name) text_pattern_ops)')
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in TABLES:
+        schema_editor.execute(f'DROP INDEX {table}_user_prefix_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_recipe_range_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, drop_prefix_indexes),
+    ]
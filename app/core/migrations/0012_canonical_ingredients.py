@@ -0,0 +1,32 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_similar_recipes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanonicalIngredient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        # nullable until 0013 has linked the existing rows
+        migrations.AddField(
+            model_name='ingredient',
+            name='canonical',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT,
+                                    to='core.CanonicalIngredient'),
+        ),
+        # SQLite rebuilds core_ingredient for the change, dropping the expression index 0006 made with raw SQL
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX IF NOT EXISTS core_ingredient_user_lower_name_uniq '
+             'ON core_ingredient (user_id, LOWER(name));'],
+            migrations.RunSQL.noop,
+        ),
+    ]
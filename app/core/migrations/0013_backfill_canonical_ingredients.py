@@ -0,0 +1,52 @@
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+BATCH_SIZE = 500  # distinct names per batch stay under SQLite's limit on query parameters
+
+
+def link_canonical_ingredients(apps, schema_editor):
+    """
+    Intern the names of existing ingredients and point each at its entry, each batch in its own transaction.
+    Keys are normalised as core.catalog.normalize did when this was written, migrations must not import app code
+    """
+    ingredient_model = apps.get_model('core', 'Ingredient')
+    catalog_model = apps.get_model('core', 'CanonicalIngredient')
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(ingredient_model.objects.filter(id__gt=last_id, canonical__isnull=True)
+                        .order_by('id').values_list('id', 'name')[:BATCH_SIZE])
+            if not rows:
+                return
+            by_key = {}
+            for pk, name in rows:
+                by_key.setdefault(name.strip().lower(), []).append(pk)
+            ids = dict(catalog_model.objects.filter(name__in=by_key).values_list('name', 'id'))
+            catalog_model.objects.bulk_create([catalog_model(name=key) for key in by_key.keys() - ids.keys()])
+            ids.update(catalog_model.objects.filter(name__in=by_key.keys() - ids.keys()).values_list('name', 'id'))
+            for key, pks in by_key.items():
+                ingredient_model.objects.filter(id__in=pks).update(canonical_id=ids[key])
+            last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+    atomic = False  # short batches rather than one transaction holding every ingredient row
+
+    dependencies = [
+        ('core', '0012_canonical_ingredients'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_canonical_ingredients, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='canonical',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='core.CanonicalIngredient'),
+        ),
+        # SQLite rebuilds core_ingredient for the change, dropping the expression index 0006 made with raw SQL
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX IF NOT EXISTS core_ingredient_user_lower_name_uniq '
+             'ON core_ingredient (user_id, LOWER(name));'],
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.1.15 on 2026-10-19 08:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_backfill_canonical_ingredients'),
+    ]
+
+    operations = [
+        # existing recipes start stale and are rendered on their first read
+        migrations.AddField(
+            model_name='recipe',
+            name='document',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.1.15 on 2026-10-19 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_recipe_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        # stored detail documents predate the version field, let them render again on read
+        migrations.RunSQL(["UPDATE core_recipe SET document = ''"], migrations.RunSQL.noop),
+    ]
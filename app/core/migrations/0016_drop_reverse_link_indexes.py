@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_recipe_version'),
+    ]
+
+    # Django already gives each through table a single column index on tag_id / ingredient_id, which is what
+    # Postgres plans a filter by tag or ingredient on. The (x_id, recipe_id) pairs 0006 added next to them only
+    # cost writes
+    operations = [
+        migrations.RunSQL(
+            ['DROP INDEX core_recipe_tags_tag_recipe_idx;'],
+            ['CREATE INDEX core_recipe_tags_tag_recipe_idx ON core_recipe_tags (tag_id, recipe_id);'],
+        ),
+        migrations.RunSQL(
+            ['DROP INDEX core_recipe_ingredients_ingredient_recipe_idx;'],
+            ['CREATE INDEX core_recipe_ingredients_ingredient_recipe_idx '
+             'ON core_recipe_ingredients (ingredient_id, recipe_id);'],
+        ),
+    ]
@@ -1,9 +1,14 @@
 from django.contrib.auth.models import PermissionsMixin, AbstractBaseUser, BaseUserManager
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
+from django.db.models.functions import Lower
 from django.conf import settings
+from django.utils import timezone
 import uuid
 import os
 
+from core import catalog
+
 
 def recipe_image_file_path(instance, filename): # todo move this into Recipe
     """Generate file path for new recipe image"""
@@ -42,6 +47,21 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)  # if the project uses multiple databases
         return user
 
+    def next_change(self, user_id):
+        """
+        Bump and return the user's change sequence. The UPDATE keeps the user row locked until the caller's
+        transaction commits, so one user's change numbers become visible in the order they were handed out
+        """
+        connection = transaction.get_connection(self.db)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'UPDATE {self.model._meta.db_table} SET change_seq = change_seq + 1 '
+                               f'WHERE id = %s RETURNING change_seq', [user_id])
+                row = cursor.fetchone()
+            return row and row[0]
+        self.filter(id=user_id).update(change_seq=F('change_seq') + 1)
+        return self.filter(id=user_id).values_list('change_seq', flat=True).first()
+
 
 class User(AbstractBaseUser, PermissionsMixin):
     """
@@ -54,6 +74,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     # todo set up staff users for full access and others for viewing only in Djangojobs
     is_staff = models.BooleanField(default=False)
+    # set when the user asks to be deleted, the account is deactivated and its data removed in the background
+    deletion_requested_at = models.DateTimeField(null=True, blank=True)
+    change_seq = models.BigIntegerField(default=0)  # last change number handed to this user's rows, see next_change
 
     # todo probably used in admin.py
     objects = UserManager()
@@ -61,25 +84,179 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
 
 
-class Tag(models.Model):
+class ChangeTrackedQuerySet(models.QuerySet):
+    """Bulk writes to rows that offline clients sync, which bypass ChangeTracked.save and delete"""
+
+    def touch(self):
+        """Restamp these rows with their owners' next change numbers, after changing them without save()"""
+        stale = {}
+        if self.model is Recipe:  # a changed recipe gets a new version and is rendered again on read
+            stale = {'document': '', 'version': F('version') + 1}
+        with transaction.atomic(using=self.db):
+            for user_id in set(self.order_by().values_list('user_id', flat=True)):
+                change = User.objects.next_change(user_id)
+                self.filter(user_id=user_id).update(change_seq=change, updated_at=timezone.now(), **stale)
+
+    def record_deletion(self):
+        """
+        Leave tombstones for these rows and restamp recipes that are about to lose them, before a delete that
+        doesn't go through ChangeTracked.delete. Call it in the deleting transaction
+        """
+        rows = list(self.order_by().values_list('id', 'user_id'))
+        if self.model is not Recipe:
+            Recipe.objects.filter(**{f'{self.model._meta.model_name}s__in': [pk for pk, _ in rows]}).touch()
+        changes = {user_id: User.objects.next_change(user_id) for user_id in {user_id for _, user_id in rows}}
+        Tombstone.objects.bulk_create([
+                Tombstone(user_id=user_id, kind=self.model._meta.model_name, object_id=pk,
+                          change_seq=changes[user_id])
+                for pk, user_id in rows if changes[user_id] is not None])  # None once the user itself is gone
+
+
+class ChangeTracked(models.Model):
+    """A user owned row that offline clients sync, stamped with the owner's next change number on every write"""
+    updated_at = models.DateTimeField(auto_now=True)
+    change_seq = models.BigIntegerField(default=0)
+
+    objects = ChangeTrackedQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'change_seq', 'updated_at'}
+        with transaction.atomic(using=kwargs.get('using')):  # the change number must commit with the row
+            self.change_seq = User.objects.next_change(self.user_id)
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            type(self).objects.filter(pk=self.pk).record_deletion()
+            return super().delete(*args, **kwargs)
+
+
+class Tombstone(models.Model):
+    """A deleted recipe, tag or ingredient, kept so syncing clients learn to drop their copy"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20)  # model name: recipe, tag or ingredient
+    object_id = models.IntegerField()
+    change_seq = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'change_seq'], name='core_tombstone_user_seq_idx')]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
+
+
+class UserAttributeManager(models.Manager.from_queryset(ChangeTrackedQuerySet)):
+    """Manager for user owned recipe attributes (tags and ingredients)"""
+
+    def _by_names(self, user, spellings):
+        """Map lower case name -> object for the user's rows matching any of spellings"""
+        lower_names = [name.lower() for name in spellings]
+        rows = (self.annotate(lower_name=Lower('name'))
+                .filter(Q(lower_name__in=lower_names) | Q(name__in=spellings), user=user))
+        return {row.name.lower(): row for row in rows}
+
+    def get_or_create_by_names(self, user, names, attempts=3):
+        """
+        Return the user's objects for names in the order given, creating missing ones with one bulk insert.
+        Names match case-insensitively and the first spelling seen is the one stored
+        """
+        wanted = {}
+        for name in names:
+            name = name.strip()
+            if name:
+                wanted.setdefault(name.lower(), name)
+        found = self._by_names(user, list(wanted.values())) if wanted else {}
+        for _ in range(attempts):
+            missing = [self.model(user=user, name=name) for key, name in wanted.items() if key not in found]
+            if not missing:
+                break
+            try:
+                with transaction.atomic(using=self.db):  # savepoint so a clash doesn't poison the outer transaction
+                    change = User.objects.next_change(user.id)  # bulk_create skips save(), stamp the rows here
+                    for obj in missing:
+                        obj.change_seq = change
+                    self.bulk_create(missing)
+            except IntegrityError:
+                pass  # a concurrent writer got some of these in first, re-read and insert whatever is still missing
+            else:
+                if all(obj.pk for obj in missing):  # backends that return ids from bulk inserts save a re-read
+                    found.update((obj.name.lower(), obj) for obj in missing)
+                    continue
+            found.update(self._by_names(user, [obj.name for obj in missing]))
+        return [found[key] for key in wanted]
+
+
+class Tag(ChangeTracked):
     """Tag for a recipe"""
     name = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)  # from the settings file best practice
 
+    objects = UserAttributeManager()
+
+    class Meta:
+        # matches filter(user=...).order_by('-name') in the API. Case-insensitive uniqueness on (user, lower(name))
+        # is an expression index so it lives in migration 0006 rather than here
+        indexes = [models.Index(fields=['user', 'name'], name='core_tag_user_name_idx'),
+                   models.Index(fields=['user', 'change_seq'], name='core_tag_user_seq_idx')]
+
+    def __str__(self):
+        return self.name
+
+
+class CanonicalIngredient(models.Model):
+    """An ingredient name shared by every user spelling it the same way, see core.catalog"""
+    name = models.CharField(max_length=255, unique=True)  # catalog.normalize()d
+
     def __str__(self):
         return self.name
 
 
-class Ingredient(models.Model):
-    """Ingredient for a recipe"""
+class IngredientManager(UserAttributeManager):
+    """Manager for ingredients, linking new rows to the canonical catalog"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        ids = catalog.canonical_ids(CanonicalIngredient, [obj.name for obj in objs if obj.canonical_id is None])
+        for obj in objs:
+            if obj.canonical_id is None:
+                obj.canonical_id = ids[catalog.normalize(obj.name)]
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class Ingredient(ChangeTracked):
+    """Ingredient for a recipe, the user's spelling of an entry in the canonical catalog"""
     name = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)  # from the settings file best practice
+    canonical = models.ForeignKey(CanonicalIngredient, on_delete=models.PROTECT)
+
+    objects = IngredientManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'name'], name='core_ingredient_user_name_idx'),
+                   models.Index(fields=['user', 'change_seq'], name='core_ingredient_user_seq_idx')]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'name' in update_fields:
+            self.canonical_id = catalog.canonical_ids(CanonicalIngredient, [self.name])[catalog.normalize(self.name)]
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'canonical'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class VersionConflict(Exception):
+    """A conditional save found the row at a different version than the one it was based on"""
+
+
+class Recipe(ChangeTracked):
     """Recipe objects"""
     title = models.CharField(max_length=255)
     time_minutes = models.IntegerField()
@@ -89,6 +266,55 @@ class Recipe(models.Model):
     ingredients = models.ManyToManyField(Ingredient)
     tags = models.ManyToManyField(Tag)
     image = models.ImageField(null=True,upload_to=recipe_image_file_path)
+    document = models.TextField(blank=True, default='')  # pre-rendered detail JSON, blank when stale (recipe.documents)
+    version = models.PositiveIntegerField(default=1)  # bumped by every save, for optimistic concurrency control
+
+    # set to the version an edit was based on to make the next save conditional on the row still being at it
+    expected_version = None
+
+    class Meta:
+        # the time and price indexes serve the API's range filters and ?ordering=, id breaks ties so a sort is
+        # never needed and the order is stable between requests
+        indexes = [models.Index(fields=['user', 'change_seq'], name='core_recipe_user_seq_idx'),
+                   models.Index(fields=['user', 'time_minutes', 'id'], name='core_recipe_user_time_idx'),
+                   models.Index(fields=['user', 'price', 'id'], name='core_recipe_user_price_idx')]
+
+    def save(self, *args, **kwargs):
+        """
+        Bump the version. With expected_version set the UPDATE only matches the row at that version, a single
+        statement that raises VersionConflict when another write got in first; otherwise it increments in SQL
+        """
+        adding = self._state.adding
+        if not adding:
+            self.version = F('version') + 1 if self.expected_version is None else self.expected_version + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'version'}
+        super().save(*args, **kwargs)
+        if not adding and self.expected_version is None:
+            self.refresh_from_db(fields=['version'])
+        self.expected_version = None
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if self.expected_version is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if not super()._do_update(base_qs.filter(version=self.expected_version), using, pk_val, values,
+                                  update_fields, forced_update):
+            raise VersionConflict(f'Recipe {pk_val} is no longer at version {self.expected_version}')
+        return True
 
     def __str__(self):
         return self.title
+
+
+class SimilarRecipe(models.Model):
+    """One of a recipe's closest matches by shared tags and ingredients, precomputed by recipe.similarity"""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='neighbours')
+    similar = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='neighbour_of')
+    score = models.FloatField()  # Jaccard index of the two recipes' tag and ingredient sets
+
+    class Meta:
+        unique_together = (('recipe', 'similar'),)
+        indexes = [models.Index(fields=['recipe', '-score', '-similar'], name='core_similar_rank_idx')]
+
+    def __str__(self):
+        return f'{self.recipe_id} ~ {self.similar_id} ({self.score:.2f})'
@@ -0,0 +1,88 @@
+"""Per request timing collection shared by the performance middleware and the code it measures"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+
+_local = threading.local()
+
+
+class RequestTimings:
+    """Durations (seconds) and query count gathered while handling one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.queries = 0
+        self.route = None
+        self.view_started = None
+        self.view_finished = None
+
+    def add(self, name, seconds):
+        self.durations[name] += seconds
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """Hook for connection.execute_wrapper counting and timing every query"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('db', time.perf_counter() - start)
+            self.queries += 1
+
+    def milliseconds(self):
+        """Return the collected durations in milliseconds"""
+        return {name: round(seconds * 1000, 3) for name, seconds in self.durations.items()}
+
+
+def activate():
+    """Start collecting for the current thread's request"""
+    _local.timings = RequestTimings()
+    return _local.timings
+
+
+def deactivate():
+    _local.timings = None
+
+
+def current():
+    """Return the active RequestTimings or None outside a measured request"""
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timer(name):
+    """Add the time spent in the block to the active request, a no-op when nothing is being measured"""
+    timings = current()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+@lru_cache(maxsize=None)
+def _timed_class(serializer_class):
+    """A subclass of serializer_class adding the time its .data takes to the request's serialize timing"""
+    def data(self):
+        with timer('serialize'):
+            return super(timed, self).data
+
+    timed = type(serializer_class.__name__, (serializer_class,), {'data': property(data), '__module__': __name__})
+    return timed
+
+
+class SerializerTimingMixin:
+    """
+    View mixin timing the serializers made by get_serializer. Only the top level serializer's .data is timed,
+    nested serializers call to_representation directly, so nothing is counted twice
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        serializer.__class__ = _timed_class(type(serializer))  # ListSerializer for many=True, timed the same
+        return serializer
@@ -0,0 +1,120 @@
+"""Profile individual requests into per route pstats and collapsed stack files for flame graphs"""
+import cProfile
+import glob
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+TOKEN_SALT = 'core.profiling'
+
+
+def make_token():
+    """A trigger header value that forces the request it is sent with to be profiled"""
+    return signing.dumps({'profile': True}, salt=TOKEN_SALT)
+
+
+def valid_token(value):
+    """Check a trigger header value was made by make_token and hasn't expired"""
+    try:
+        return signing.loads(value, salt=TOKEN_SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE).get('profile', False)
+    except signing.BadSignature:  # includes SignatureExpired
+        return False
+
+
+def route_directory(route):
+    """Directory holding the profiles for one URL name, recipe:recipe-list -> <PROFILING_DIR>/recipe.recipe-list"""
+    name = (route or 'unresolved').replace(':', '.').replace(os.sep, '_')
+    return os.path.join(settings.PROFILING_DIR, name)
+
+
+def collapse(frame):
+    """Render a frame's stack root first in the collapsed format flamegraph.pl and speedscope read"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    """Sample another thread's stack at a fixed interval while a request runs"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def rotate(directory):
+    """
+    Keep the newest PROFILING_KEEP pstats files of a route and start a new collapsed file once it passes
+    PROFILING_COLLAPSED_MAX_BYTES, keeping the previous one as stacks.collapsed.1
+    """
+    profiles = sorted(glob.glob(os.path.join(directory, '*.pstats')))  # named by time, oldest first
+    for path in profiles[:max(len(profiles) - settings.PROFILING_KEEP, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # another worker rotated it first
+            pass
+    collapsed = os.path.join(directory, 'stacks.collapsed')
+    try:
+        if os.path.getsize(collapsed) > settings.PROFILING_COLLAPSED_MAX_BYTES:
+            os.replace(collapsed, collapsed + '.1')
+    except FileNotFoundError:
+        pass
+
+
+class RequestProfiler:
+    """
+    cProfile or a stack sampler around one request, never both: each would be timed as part of the other's
+    request. cProfile gives exact call counts, the sampler costs the request next to nothing
+    """
+
+    def __init__(self, deterministic):
+        self.profile = cProfile.Profile() if deterministic else None
+        self.sampler = None if deterministic else StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL)
+
+    def start(self):
+        if self.profile is not None:
+            self.profile.enable()
+        else:
+            self.sampler.start()
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+        else:
+            self.sampler.stop()
+
+    def save(self, route):
+        """
+        Write this request's pstats file or append its stacks to the route's collapsed file, then rotate the
+        route's files. Collapsed lines repeat across requests and workers but flame graph tools sum duplicate stacks
+        """
+        directory = route_directory(route)
+        os.makedirs(directory, exist_ok=True)
+        if self.profile is not None:
+            self.profile.dump_stats(os.path.join(directory, f'{time.time():.6f}-{os.getpid()}.pstats'))
+        elif self.sampler.stacks:
+            lines = ''.join(f'{stack} {count}\n' for stack, count in self.sampler.stacks.items())
+            with open(os.path.join(directory, 'stacks.collapsed'), 'a') as f:
+                f.write(lines)
+        rotate(directory)
@@ -0,0 +1,111 @@
+"""Deterministic synthetic data for load testing and benchmarks"""
+import io
+import random
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image
+
+from core.models import Tag, Ingredient, Recipe, recipe_image_file_path
+
+SEED_PASSWORD = 'seed-pass-123'
+SEED_EMAIL = 'seed-user-{}@example.com'
+BATCH_SIZE = 1000
+
+WORDS = ('salt', 'pepper', 'garlic', 'onion', 'butter', 'flour', 'egg', 'milk', 'sugar', 'lemon', 'rice', 'beans',
+         'chicken', 'beef', 'pork', 'fish', 'tomato', 'basil', 'ginger', 'chilli', 'curry', 'stew', 'soup', 'tart',
+         'bread', 'pasta', 'cheese', 'vegan', 'quick', 'spicy', 'sweet', 'roast', 'grill', 'bake', 'salad', 'sauce')
+
+
+def _name(rng, index):
+    """A readable unique name, the index keeps names distinct however many are asked for"""
+    return f'{rng.choice(WORDS)} {rng.choice(WORDS)} {index}'
+
+
+def _zipf_sampler(rng, population, exponent):
+    """Return a function drawing k distinct items with Zipf weights, low indexes being the popular ones"""
+    cumulative = list(accumulate(1 / (rank ** exponent) for rank in range(1, len(population) + 1)))
+
+    def sample(k):
+        k = min(k, len(population))
+        chosen = set()
+        while len(chosen) < k:
+            chosen.update(rng.choices(population, cum_weights=cumulative, k=k - len(chosen)))
+        return chosen
+
+    return sample
+
+
+def _image_names(rng, count):
+    """Store count small JPEGs and return their storage names for recipes to share"""
+    names = []
+    for _ in range(count):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), tuple(rng.randrange(256) for _ in range(3))).save(buffer, format='JPEG')
+        names.append(default_storage.save(recipe_image_file_path(None, 'seed.jpg'), ContentFile(buffer.getvalue())))
+    return names
+
+
+def _bulk_create(model, rows):
+    """bulk_create in batches no bigger than the backend allows, SQLite caps the terms in one insert"""
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    batch_size = min(BATCH_SIZE, max(connection.ops.bulk_batch_size(fields, rows), 1))
+    model.objects.bulk_create(rows, batch_size=batch_size)
+
+
+def seed(users=10, recipes=50, tags=20, ingredients=50, tags_per_recipe=3, ingredients_per_recipe=8,
+         image_ratio=0.0, exponent=1.1, random_seed=0):
+    """
+    Generate users x recipes with Zipf distributed tags and ingredients. The same arguments always produce the
+    same rows so results can be compared between runs
+    :return: dict of row counts created
+    """
+    rng = random.Random(random_seed)
+    password = make_password(SEED_PASSWORD)  # hashing once per user would dominate the run
+    through_tags, through_ingredients = Recipe.tags.through, Recipe.ingredients.through
+    images = _image_names(rng, min(users, 10)) if image_ratio else []
+    counts = dict.fromkeys(('users', 'tags', 'ingredients', 'recipes', 'recipe_tags', 'recipe_ingredients'), 0)
+
+    user_model = get_user_model()  # every seeded row is the users' first change so a sync from 0 returns it
+    start = user_model.objects.count()
+    with transaction.atomic():
+        _bulk_create(user_model, [user_model(email=SEED_EMAIL.format(start + i), name=f'Seed user {start + i}',
+                                             password=password, change_seq=1) for i in range(users)])
+        user_ids = list(user_model.objects.filter(email__in=[SEED_EMAIL.format(start + i) for i in range(users)])
+                        .order_by('id').values_list('id', flat=True))
+        counts['users'] = len(user_ids)
+
+        for user_id in user_ids:
+            _bulk_create(Tag, [Tag(user_id=user_id, name=_name(rng, i), change_seq=1) for i in range(tags)])
+            _bulk_create(Ingredient, [Ingredient(user_id=user_id, name=_name(rng, i), change_seq=1)
+                                      for i in range(ingredients)])
+            tag_ids = list(Tag.objects.filter(user_id=user_id).order_by('id').values_list('id', flat=True))
+            ingredient_ids = list(Ingredient.objects.filter(user_id=user_id).order_by('id')
+                                  .values_list('id', flat=True))
+            _bulk_create(Recipe, [
+                    Recipe(user_id=user_id, title=_name(rng, i), time_minutes=rng.randint(5, 240), change_seq=1,
+                           price=round(rng.uniform(0.5, 99.99), 2), link=f'https://example.com/recipes/{i}',
+                           image=rng.choice(images) if images and rng.random() < image_ratio else None)
+                    for i in range(recipes)])
+            recipe_ids = list(Recipe.objects.filter(user_id=user_id).order_by('id').values_list('id', flat=True))
+
+            pick_tags = _zipf_sampler(rng, tag_ids, exponent)
+            pick_ingredients = _zipf_sampler(rng, ingredient_ids, exponent)
+            tag_rows = [through_tags(recipe_id=recipe_id, tag_id=tag_id)
+                        for recipe_id in recipe_ids for tag_id in pick_tags(tags_per_recipe)]
+            ingredient_rows = [through_ingredients(recipe_id=recipe_id, ingredient_id=ingredient_id)
+                               for recipe_id in recipe_ids
+                               for ingredient_id in pick_ingredients(ingredients_per_recipe)]
+            _bulk_create(through_tags, tag_rows)
+            _bulk_create(through_ingredients, ingredient_rows)
+
+            counts['tags'] += len(tag_ids)
+            counts['ingredients'] += len(ingredient_ids)
+            counts['recipes'] += len(recipe_ids)
+            counts['recipe_tags'] += len(tag_rows)
+            counts['recipe_ingredients'] += len(ingredient_rows)
+    return counts
@@ -0,0 +1,128 @@
+"""
+Log ORM queries slower than settings.SLOW_QUERY_THRESHOLD_MS with the view or serializer line that ran them,
+capturing EXPLAIN (ANALYZE, BUFFERS) on Postgres for a sample. Lines are JSON in a rotating file summarised by
+`manage.py slow_query_report`.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import transaction
+
+from core import performance
+
+logger = logging.getLogger('core.slow_queries')
+_local = threading.local()
+_handler_lock = threading.Lock()
+
+# frames from these files are the observer machinery, not the code that asked for the query
+_OWN_FILES = tuple(os.path.join(os.path.dirname(__file__), name)
+                   for name in ('slow_queries.py', 'performance.py', 'middleware.py'))
+
+
+def fingerprint(sql):
+    """Normalise a query so executions differing only in literals or IN list length group together"""
+    normalised = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    normalised = re.sub(r'\b\d+(\.\d+)?\b', '?', normalised)
+    normalised = re.sub(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)', '(...)', normalised)
+    normalised = re.sub(r'\s+', ' ', normalised).strip()
+    return hashlib.sha1(normalised.encode()).hexdigest()[:12], normalised
+
+
+def origin():
+    """
+    The innermost frame outside django.db and this instrumentation, e.g. recipe/views.py:58 get_queryset. Lazy
+    querysets are often evaluated by DRF, which then shows as e.g. rest_framework/mixins.py:45 list
+    """
+    django_db = os.path.dirname(transaction.__file__)
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(_OWN_FILES) and not filename.startswith(django_db):
+            # project files relative to the project, packages relative to site-packages
+            base = settings.BASE_DIR if filename.startswith(settings.BASE_DIR) \
+                else os.path.dirname(os.path.dirname(filename))
+            return f'{os.path.relpath(filename, base)}:{frame.f_lineno} {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+def _ensure_handler():
+    """Attach the rotating file handler on first use so a missing log directory can't stop Django starting"""
+    if logger.handlers:
+        return
+    with _handler_lock:
+        if logger.handlers:
+            return
+        try:
+            os.makedirs(os.path.dirname(settings.SLOW_QUERY_LOG_FILE), exist_ok=True)
+            handler = RotatingFileHandler(settings.SLOW_QUERY_LOG_FILE, maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES,
+                                          backupCount=settings.SLOW_QUERY_LOG_BACKUPS)
+        except OSError:
+            handler = logging.StreamHandler()  # unwritable log directory, keep the entries on stderr instead
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def explain(connection, sql, params):
+    """EXPLAIN ANALYZE re-runs the query, so only plain SELECTs, inside a savepoint in case it fails"""
+    statement = sql.lstrip().upper()
+    if connection.vendor != 'postgresql' or not statement.startswith('SELECT') or 'FOR UPDATE' in statement:
+        return None
+    try:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sql, params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+    except Exception as exc:  # the plan is a nice to have, never break the request for it
+        return f'EXPLAIN failed: {exc}'
+
+
+def observe(execute, sql, params, many, context):
+    """connection.execute_wrapper hook installed on every connection by CoreConfig.ready"""
+    if getattr(_local, 'explaining', False):
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms >= settings.SLOW_QUERY_THRESHOLD_MS:
+            record(context['connection'], sql, params, many, elapsed_ms)
+
+
+def record(connection, sql, params, many, elapsed_ms):
+    key, _ = fingerprint(sql)
+    timings = performance.current()
+    entry = {
+            'time':        time.time(),
+            'fingerprint': key,
+            'duration_ms': round(elapsed_ms, 3),
+            'sql':         sql,
+            'route':       getattr(timings, 'route', None),
+            'origin':      origin(),
+            'database':    connection.alias,
+    }
+    if not many and random.random() < settings.SLOW_QUERY_EXPLAIN_RATE:
+        _local.explaining = True
+        try:
+            entry['plan'] = explain(connection, sql, params)
+        finally:
+            _local.explaining = False
+    _ensure_handler()
+    logger.info(json.dumps(entry))
+
+
+def install(connection, **kwargs):
+    """connection_created receiver, wrappers live on the connection wrapper so only add ours once"""
+    if settings.SLOW_QUERY_THRESHOLD_MS is not None and observe not in connection.execute_wrappers:
+        connection.execute_wrappers.append(observe)
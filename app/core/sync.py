@@ -0,0 +1,98 @@
+"""
+Delta sync for offline clients.
+
+Every write to a user's recipes, tags and ingredients stamps the row with the next number of that user's change
+sequence (User.change_seq) and every delete leaves a Tombstone numbered the same way. A client keeps the cursor of
+its last sync and asks for what changed after it, which the (user, change_seq) indexes answer without touching
+anything older.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
+
+from core.models import Tag, Ingredient, Recipe, Tombstone
+
+KINDS = (('recipes', Recipe), ('tags', Tag), ('ingredients', Ingredient))
+
+_collecting = threading.local()
+
+
+@contextmanager
+def collect_link_changes():
+    """
+    Gather the ids of recipes whose tags or ingredients change in the block instead of restamping each of them on
+    every m2m signal, for a write that saves the recipe itself and then stamps and renders it once
+    """
+    outer = getattr(_collecting, 'recipe_ids', None)
+    _collecting.recipe_ids = recipe_ids = set()
+    try:
+        yield recipe_ids
+    finally:
+        _collecting.recipe_ids = outer
+        if outer is not None:
+            outer |= recipe_ids
+
+
+def collecting():
+    """Whether link changes are being gathered by collect_link_changes rather than handled by the receivers"""
+    return getattr(_collecting, 'recipe_ids', None) is not None
+
+
+def recipe_links_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """m2m_changed receiver: adding or removing a recipe's tags or ingredients is a change to the recipe"""
+    if collecting():
+        if not reverse:
+            _collecting.recipe_ids.add(instance.pk)
+        elif action == 'pre_clear':
+            _collecting.recipe_ids.update(
+                    Recipe.objects.filter(**{f'{type(instance)._meta.model_name}s': instance})
+                    .values_list('id', flat=True))
+        elif action in ('post_add', 'post_remove'):
+            _collecting.recipe_ids.update(pk_set)
+    elif not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Recipe.objects.filter(pk=instance.pk).touch()
+            instance.refresh_from_db(fields=['version'])  # touch moved it on, keep the instance's ETag current
+    elif action == 'pre_clear':  # pk_set isn't given for a clear, find the recipes before their links go
+        Recipe.objects.filter(**{f'{type(instance)._meta.model_name}s': instance}).touch()
+    elif action in ('post_add', 'post_remove'):
+        Recipe.objects.filter(pk__in=pk_set).touch()
+
+
+def _page(queryset, since, upto, limit):
+    return list(queryset.filter(change_seq__gt=since, change_seq__lte=upto).order_by('change_seq')[:limit + 1])
+
+
+def changes_since(user, since, limit):
+    """
+    The user's rows and tombstones numbered after since, at most about limit of each kind.
+    :return: dict with the cursor to send next time, has_more, each kind's changed rows and the deleted ids
+    """
+    # numbers up to current are all committed (see UserManager.next_change), anything above may still be in flight
+    current = get_user_model().objects.filter(id=user.id).values_list('change_seq', flat=True).get()
+    querysets = {
+            'recipes':     Recipe.objects.filter(user=user).defer('document').prefetch_related(
+                    Prefetch('tags', queryset=Tag.objects.only('id')),
+                    Prefetch('ingredients', queryset=Ingredient.objects.only('id'))),
+            'tags':        Tag.objects.filter(user=user),
+            'ingredients': Ingredient.objects.filter(user=user),
+            'deleted':     Tombstone.objects.filter(user=user),
+    }
+    pages = {name: _page(queryset, since, current, limit) for name, queryset in querysets.items()}
+
+    # stop just before the first number a full page didn't reach, so a cursor never splits one change number
+    unreached = [page[limit].change_seq for page in pages.values() if len(page) > limit]
+    cursor = min(unreached) - 1 if unreached else max(current, since)
+    if unreached and cursor <= since:  # one change number alone is bigger than a page, send all of it
+        cursor = min(unreached)
+        pages = {name: list(querysets[name].filter(change_seq__gt=since, change_seq__lte=cursor))
+                 for name in querysets}
+
+    changes = {name: [row for row in page if row.change_seq <= cursor] for name, page in pages.items()}
+    deleted = {name: [] for name, _ in KINDS}
+    for tombstone in changes.pop('deleted'):
+        deleted[f'{tombstone.kind}s'].append(tombstone.object_id)
+    changes.update(cursor=cursor, has_more=cursor < current, deleted=deleted)
+    return changes
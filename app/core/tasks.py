@@ -0,0 +1,19 @@
+"""Background jobs for core, run by `manage.py run_worker`"""
+from core.deletion import delete_in_batches, delete_user_data
+from core.models import Recipe
+from jobs.queue import task
+
+
+@task(queue='low')
+def delete_user(user_id):
+    """Remove a user marked for deletion and everything they own"""
+    delete_user_data(user_id)
+
+
+@task(queue='low')
+def delete_recipes(user_id, ids=None):
+    """Delete a user's recipes, only those in ids when given"""
+    queryset = Recipe.objects.filter(user_id=user_id)
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    delete_in_batches(queryset)
@@ -0,0 +1,18 @@
+"""The test runner, set as TEST_RUNNER in the settings"""
+import logging
+import os
+
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Keep the per request log lines of the core and jobs loggers out of the output unless CORE_LOG_LEVEL asks for
+    them. Tests that need a job's effects straight away run it inline with override_settings
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        if 'CORE_LOG_LEVEL' not in os.environ:
+            for name in ('core', 'jobs'):
+                logging.getLogger(name).setLevel(logging.ERROR)
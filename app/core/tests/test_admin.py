@@ -1,6 +1,8 @@
+from unittest.mock import patch
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from core.models import Recipe, Tag
 
 
 class AdminSiteTests(TestCase):
@@ -46,3 +48,51 @@ class AdminSiteTests(TestCase):
         url = reverse('admin:core_user_add')
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
+
+
+class RecipeAdminTests(TestCase):
+    """Test the recipe, tag and ingredient admins"""
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(email='admin@test.com', password='password123')
+        self.client.force_login(self.admin_user)
+        self.recipe = Recipe.objects.create(user=self.admin_user, title='Stew', time_minutes=5, price=1.00)
+        self.tag = Tag.objects.create(user=self.admin_user, name='Winter')
+        self.recipe.tags.add(self.tag)
+
+    def test_changelists(self):
+        """Test the changelists load with the owner joined in"""
+        for url_name in ('admin:core_recipe_changelist', 'admin:core_tag_changelist',
+                         'admin:core_ingredient_changelist'):
+            response = self.client.get(reverse(url_name), {'q': 'admin@test.com'})
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('admin:core_recipe_changelist'))
+        self.assertContains(response, 'Stew')
+
+    def test_recipe_change_page_uses_autocomplete(self):
+        """Test tags and ingredients aren't rendered as full multi-selects"""
+        response = self.client.get(reverse('admin:core_recipe_change', args=[self.recipe.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'admin-autocomplete')
+
+    def test_delete_selected_rows(self):
+        """Test the set based delete removes the tags and their recipe links"""
+        response = self.client.post(reverse('admin:core_tag_changelist'), {
+                'action':           'delete_selected_rows',
+                '_selected_action': [self.tag.id],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Tag.objects.exists())
+        self.assertEqual(self.recipe.tags.count(), 0)
+
+    def test_clear_tags(self):
+        """Test the bulk action unlinks tags without deleting them and refreshes the recipes' similar recipes"""
+        with patch('recipe.similarity.queue_refresh') as queue_refresh:
+            self.client.post(reverse('admin:core_recipe_changelist'), {
+                    'action':           'clear_tags',
+                    '_selected_action': [self.recipe.id],
+            })
+        self.assertEqual(self.recipe.tags.count(), 0)
+        self.assertTrue(Tag.objects.filter(id=self.tag.id).exists())
+        queue_refresh.assert_called_once_with([self.recipe.id])
@@ -0,0 +1,157 @@
+import itertools
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Tag, Recipe
+from recipe.views import RecipeViewSet
+
+BATCH_URL = reverse('batch')
+
+
+class PublicBatchApiTests(TestCase):
+    """Test the batch endpoint needs authentication"""
+
+    def test_auth_required(self):
+        response = APIClient().post(BATCH_URL, {'requests': [{'path': '/api/user/me/'}]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateBatchApiTests(TestCase):
+    """Test running several API requests in one"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('batch@test.com', 'testPass', name='Batch')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(user=self.user, name='Vegan')
+
+    def batch(self, *requests):
+        response = self.client.post(BATCH_URL, {'requests': list(requests)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()['responses']
+
+    def test_screen_load(self):
+        """Test a typical screen's reads come back together, in order, as the batch's user"""
+        responses = self.batch(
+                {'path': '/api/user/me/'},
+                {'path': '/api/recipe/tags/'},
+                {'path': '/api/recipe/ingredients/'},
+                {'path': '/api/recipe/recipes/'},
+        )
+
+        self.assertEqual([entry['status'] for entry in responses], [200] * 4)
+        self.assertEqual(responses[0]['body']['email'], 'batch@test.com')
+        self.assertEqual([tag['name'] for tag in responses[1]['body']], ['Vegan'])
+        self.assertEqual(responses[3]['body'], [])
+
+    def test_query_string_and_writes(self):
+        """Test sub-requests keep their query string and writes run in order"""
+        responses = self.batch(
+                {'method': 'POST', 'path': '/api/recipe/recipes/',
+                 'body': {'title': 'Soup', 'time_minutes': 5, 'price': '1.00', 'tag_names': ['Quick']}},
+                {'path': '/api/recipe/tags/?assigned_only=1'},
+        )
+
+        self.assertEqual(responses[0]['status'], status.HTTP_201_CREATED)
+        self.assertTrue(Recipe.objects.filter(user=self.user, title='Soup').exists())
+        self.assertEqual([tag['name'] for tag in responses[1]['body']], ['Quick'])
+
+    def test_batch_headers_not_passed_on(self):
+        """Test the batch request's conditional headers don't turn its entries into 304s or 412s"""
+        recipe = Recipe.objects.create(user=self.user, title='Soup', time_minutes=5, price='1.00')
+        etag = self.client.get(f'/api/recipe/recipes/{recipe.id}/')['ETag']
+
+        response = self.client.post(BATCH_URL, {'requests': [
+                {'path': f'/api/recipe/recipes/{recipe.id}/'},
+                {'method': 'PATCH', 'path': f'/api/recipe/recipes/{recipe.id}/', 'body': {'title': 'Stew'}},
+        ]}, format='json', HTTP_IF_NONE_MATCH=etag, HTTP_IF_MATCH='"0"')
+
+        self.assertEqual([entry['status'] for entry in response.json()['responses']], [200, 200])
+        self.assertEqual(response.json()['responses'][0]['body']['title'], 'Soup')
+
+    def test_entries_rendered_as_json(self):
+        """Test an entry asking for another format still gets JSON, one that can't is refused"""
+        Recipe.objects.create(user=self.user, title='Soup', time_minutes=5, price='1.00')
+
+        responses = self.batch({'path': '/api/recipe/recipes/?format=columnar'},
+                               {'path': '/api/recipe/tags/?format=api'})
+
+        self.assertEqual([entry['status'] for entry in responses], [200, 200])
+        self.assertEqual([recipe['title'] for recipe in responses[0]['body']], ['Soup'])
+        self.assertEqual([tag['name'] for tag in responses[1]['body']], ['Vegan'])
+        with patch.object(RecipeViewSet, 'list', lambda view, request: HttpResponse('Soup')):
+            responses = self.batch({'path': '/api/recipe/recipes/'})
+
+        self.assertEqual(responses[0]['status'], status.HTTP_406_NOT_ACCEPTABLE)
+
+    @override_settings(LIST_GZIP_MIN_BYTES=1)
+    def test_large_list_not_compressed(self):
+        """Test a list big enough to be gzipped on its own is embedded as plain JSON"""
+        Tag.objects.bulk_create([Tag(user=self.user, name=f'Tag {i:02}') for i in range(30)])
+
+        response = self.client.post(BATCH_URL, {'requests': [{'path': '/api/recipe/tags/'}]}, format='json',
+                                    HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['responses'][0]['body']), 31)
+
+    def test_errors_are_per_request(self):
+        """Test a failing sub-request doesn't fail its neighbours"""
+        responses = self.batch(
+                {'path': '/api/recipe/recipes/999/'},
+                {'path': '/api/nowhere/'},
+                {'method': 'POST', 'path': '/api/recipe/tags/', 'body': {'name': ''}},
+                {'method': 'POST', 'path': '/api/batch/', 'body': {'requests': []}},
+                {'path': '/api/user/me/'},
+        )
+
+        self.assertEqual([entry['status'] for entry in responses], [404, 404, 400, 400, 200])
+
+    @override_settings(BATCH_MAX_RESPONSE_BYTES=10)
+    def test_response_size_limit(self):
+        """Test an oversized sub-response is replaced by a 413"""
+        responses = self.batch({'path': '/api/user/me/'})
+
+        self.assertEqual(responses[0]['status'], status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    @override_settings(REQUEST_DEADLINES_MS={'default': 10000, 'batch': 0})
+    def test_deadline(self):
+        """Test entries left when the batch's deadline passes are answered without running"""
+        with patch('core.batch.time.monotonic', side_effect=itertools.count()):
+            responses = self.batch({'path': '/api/user/me/'}, {'path': '/api/user/me/'})
+
+        self.assertEqual([entry['status'] for entry in responses], [504, 504])
+
+    @override_settings(REQUEST_DEADLINES_MS={'default': 10000, 'batch': 5000, 'recipe:tag-list': 250})
+    def test_statement_timeout_per_request(self):
+        """Test each entry runs under its own route's statement_timeout, capped by the batch's deadline"""
+        with patch('core.batch.deadlines.apply_statement_timeout') as apply_timeout:
+            self.batch({'path': '/api/recipe/tags/'}, {'path': '/api/user/me/'})
+
+        tags, me = [call[0][0] for call in apply_timeout.call_args_list][-2:]  # after the batch's own
+        self.assertEqual(tags, 250)
+        self.assertTrue(4000 < me <= 5000)
+
+    def test_entries_count_against_client(self):
+        """Test each entry takes one of the client's in-flight slots while it runs"""
+        with override_settings(LOAD_SHED_MAX_IN_FLIGHT_PER_CLIENT=1):  # the batch itself holds the only one
+            refused = self.batch({'path': '/api/user/me/'}, {'path': '/api/recipe/tags/'})
+        allowed = self.batch({'path': '/api/user/me/'}, {'path': '/api/recipe/tags/'})
+
+        self.assertEqual([entry['status'] for entry in refused], [429, 429])
+        self.assertEqual([entry['status'] for entry in allowed], [200, 200])
+
+    def test_invalid_batches(self):
+        """Test malformed batches are rejected outright"""
+        too_many = [{'path': '/api/user/me/'}] * 21
+        for body in ({}, {'requests': []}, {'requests': too_many}, {'requests': [{'method': 'GET'}]},
+                     {'requests': [{'path': 'https://example.com/api/'}]}, {'requests': [{'path': '/admin/'}]},
+                     {'requests': [{'method': 'TRACE', 'path': '/api/user/me/'}]}):
+            with self.subTest(body=body):
+                response = self.client.post(BATCH_URL, body, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
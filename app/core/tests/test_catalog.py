@@ -0,0 +1,68 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from core import catalog
+from core.models import CanonicalIngredient, Ingredient
+
+
+def sample_user(email='test@test.com', password='testPass'):
+    return get_user_model().objects.create_user(email, password)
+
+
+class CanonicalIngredientTests(TestCase):
+    """Test users' ingredients are linked to the shared catalog"""
+
+    def tearDown(self):
+        catalog.cache.clear()
+
+    def test_spellings_share_an_entry(self):
+        """Test every user's spelling of a name links to one catalog entry"""
+        salt = Ingredient.objects.create(user=sample_user(), name='Salt')
+        other = Ingredient.objects.create(user=sample_user('other@test.com'), name=' SALT')
+
+        self.assertEqual(salt.canonical, other.canonical)
+        self.assertEqual(salt.canonical.name, 'salt')
+        self.assertEqual(CanonicalIngredient.objects.count(), 1)
+
+    def test_bulk_created_rows_linked(self):
+        """Test ingredients created by name in bulk are linked too"""
+        user = sample_user()
+        pepper = Ingredient.objects.create(user=sample_user('other@test.com'), name='pepper')
+
+        created = Ingredient.objects.get_or_create_by_names(user, ['Pepper', 'Thyme'])
+
+        self.assertEqual([obj.canonical.name for obj in created], ['pepper', 'thyme'])
+        self.assertEqual(created[0].canonical_id, pepper.canonical_id)
+
+    def test_rename_relinks(self):
+        """Test renaming an ingredient moves it to the new name's entry"""
+        ingredient = Ingredient.objects.create(user=sample_user(), name='Chilli')
+
+        ingredient.name = 'Chili'
+        ingredient.save(update_fields=['name'])
+
+        ingredient.refresh_from_db()
+        self.assertEqual(ingredient.canonical.name, 'chili')
+
+    def test_cached_ids_skip_the_database(self):
+        """Test names the process already knows are resolved without a query"""
+        entry = CanonicalIngredient.objects.create(name='basil')
+        catalog.cache.set_many({'basil': entry.id})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.canonical_ids(CanonicalIngredient, ['Basil ']), {'basil': entry.id})
+
+    def test_uncommitted_ids_not_cached(self):
+        """Test ids are only cached once their transaction commits, a rollback would leave them dangling"""
+        Ingredient.objects.create(user=sample_user(), name='Fennel')  # the test transaction never commits
+
+        self.assertEqual(catalog.cache.get_many(['fennel']), {})
+
+    def test_intern_names(self):
+        """Test interning inserts only the names the catalog doesn't have yet"""
+        egg = CanonicalIngredient.objects.create(name='egg')
+
+        ids = catalog.intern_names(CanonicalIngredient, ['egg', 'milk', 'oats'])
+
+        self.assertEqual(ids['egg'], egg.id)
+        self.assertEqual(set(ids), {'egg', 'milk', 'oats'})
+        self.assertEqual(CanonicalIngredient.objects.count(), 3)
@@ -1,7 +1,11 @@
+from io import StringIO
 from unittest.mock import patch
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
+from django.db import connection
 from django.db.utils import OperationalError
 from django.test import TestCase
+from core.models import Tag, Recipe
 
 
 class CommandTests(TestCase):
@@ -24,3 +28,63 @@ class CommandTests(TestCase):
             gi.side_effect=[OperationalError]*5 +[True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count,6)
+
+
+class DedupeAttributesCommandTests(TestCase):
+    """Test merging case-insensitive duplicate tags and ingredients"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('dedupe@test.com', 'testPass')
+
+    def test_merge_repoints_recipes(self):
+        """Test duplicates are merged onto the oldest row and recipes keep a single link"""
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX core_tag_user_lower_name_uniq')
+        keep = Tag.objects.create(user=self.user, name='Salt')
+        lower = Tag.objects.create(user=self.user, name='salt')
+        upper = Tag.objects.create(user=self.user, name='SALT')
+        recipe1 = Recipe.objects.create(user=self.user, title='Chips', time_minutes=5, price=1.00)
+        recipe2 = Recipe.objects.create(user=self.user, title='Soup', time_minutes=5, price=1.00)
+        recipe1.tags.add(keep, lower)
+        recipe2.tags.add(lower, upper)
+
+        call_command('dedupe_attributes', stdout=StringIO())
+
+        self.assertEqual(list(Tag.objects.filter(user=self.user)), [keep])
+        self.assertEqual(list(recipe1.tags.all()), [keep])
+        self.assertEqual(list(recipe2.tags.all()), [keep])
+
+    def test_dry_run_changes_nothing(self):
+        """Test dry run only reports"""
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX core_tag_user_lower_name_uniq')
+        Tag.objects.create(user=self.user, name='Salt')
+        Tag.objects.create(user=self.user, name='salt')
+        out = StringIO()
+        call_command('dedupe_attributes', dry_run=True, stdout=out)
+        self.assertIn('1 duplicate tags groups found', out.getvalue())
+        self.assertEqual(Tag.objects.count(), 2)
+
+
+class SeedDataCommandTests(TestCase):
+    """Test generating synthetic data"""
+
+    def test_seed_data_counts(self):
+        """Test the requested number of rows are created"""
+        call_command('seed_data', users=2, recipes=5, tags=4, ingredients=6, tags_per_recipe=2,
+                     ingredients_per_recipe=3, stdout=StringIO())
+        self.assertEqual(get_user_model().objects.count(), 2)
+        self.assertEqual(Recipe.objects.count(), 10)
+        self.assertEqual(Tag.objects.count(), 8)
+        self.assertEqual(Recipe.tags.through.objects.count(), 20)
+        self.assertEqual(Recipe.ingredients.through.objects.count(), 30)
+
+    def test_seed_data_deterministic(self):
+        """Test the same seed produces the same recipes"""
+        call_command('seed_data', users=1, recipes=5, seed=7, stdout=StringIO())
+        first = list(Recipe.objects.order_by('id').values_list('title', 'time_minutes', 'price'))
+        Recipe.objects.all().delete()
+        get_user_model().objects.all().delete()
+        call_command('seed_data', users=1, recipes=5, seed=7, stdout=StringIO())
+        second = list(Recipe.objects.order_by('id').values_list('title', 'time_minutes', 'price'))
+        self.assertEqual(first, second)
@@ -0,0 +1,78 @@
+import time
+from unittest.mock import patch, MagicMock
+from django.contrib.auth import get_user_model
+from django.db.utils import OperationalError
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core import deadlines
+from core.middleware import LoadSheddingMiddleware
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class LoadSheddingMiddlewareTests(TestCase):
+    """Test refusing work the server can't get through in time"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_request_queued_too_long(self):
+        """Test requests that waited past the limit in the proxy queue are refused with 503"""
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user('shed@test.com', 'testPass'))
+        stale = f't={int((time.time() - 10) * 1e6)}'  # microseconds, as nginx sends it
+        response = client.get(TAGS_URL, HTTP_X_REQUEST_START=stale)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        fresh = f't={time.time():.3f}'
+        self.assertEqual(client.get(TAGS_URL, HTTP_X_REQUEST_START=fresh).status_code, 200)
+
+    @override_settings(LOAD_SHED_MAX_IN_FLIGHT=1)
+    def test_worker_saturated(self):
+        """Test a request arriving while the worker is full gets 503"""
+        statuses = []
+
+        def view(request):
+            statuses.append(middleware(self.factory.get('/')).status_code)  # arrives while this one runs
+            return HttpResponse()
+
+        middleware = LoadSheddingMiddleware(view)
+        self.assertEqual(middleware(self.factory.get('/')).status_code, 200)
+        self.assertEqual(statuses, [503])
+        self.assertEqual(middleware.in_flight, 0)
+
+    @override_settings(LOAD_SHED_MAX_IN_FLIGHT_PER_CLIENT=1)
+    def test_client_saturated(self):
+        """Test one client's concurrent requests are limited with 429 without blocking others"""
+        statuses = []
+
+        def view(request):
+            if not statuses:
+                statuses.append(middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token a')).status_code)
+                statuses.append(middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token b')).status_code)
+            return HttpResponse()
+
+        middleware = LoadSheddingMiddleware(view)
+        middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token a'))
+        self.assertEqual(statuses, [429, 200])
+
+    def test_statement_timeout_becomes_503(self):
+        """Test a query cancelled by statement_timeout is answered with 503"""
+        middleware = LoadSheddingMiddleware(lambda request: HttpResponse())
+        error = OperationalError('canceling statement due to statement timeout')
+        response = middleware.process_exception(self.factory.get('/'), error)
+        self.assertEqual(response.status_code, 503)
+        self.assertIsNone(middleware.process_exception(self.factory.get('/'), ValueError()))
+
+    @override_settings(REQUEST_DEADLINES_MS={'default': 1000, 'recipe:recipe-list': 250})
+    def test_statement_timeout_set_once_per_budget(self):
+        """Test the route budget is sent to Postgres only when it changes"""
+        connection = MagicMock(vendor='postgresql', connection=object())
+        cursor = connection.cursor.return_value.__enter__.return_value
+        with patch.object(deadlines, 'connections', {'default': connection}):
+            deadlines.apply_statement_timeout(deadlines.route_budget('recipe:recipe-list'))
+            deadlines.apply_statement_timeout(deadlines.route_budget('recipe:recipe-list'))
+            deadlines.apply_statement_timeout(deadlines.route_budget('recipe:tag-list'))
+        self.assertEqual([call[0][1] for call in cursor.execute.call_args_list], [[250], [1000]])
@@ -0,0 +1,50 @@
+import tracemalloc
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.memory import tracker
+
+MEMORY_URL = reverse('memory-report')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+@override_settings(MEMORY_TRACKING_ENABLED=True, MEMORY_TRACKING_SNAPSHOT_RATE=1.0)
+class MemoryTrackingTests(TestCase):
+    """Test per route memory tracking and its report"""
+
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser('admin@test.com', 'testPass')
+        self.client = APIClient()  # created inside the override so the middleware is loaded
+        self.client.force_authenticate(self.admin)
+        tracker.reset()
+
+    def tearDown(self):
+        tracemalloc.stop()
+
+    def test_allocations_attributed_to_route(self):
+        """Test a tracked request shows up in the report with its allocation sites"""
+        self.client.get(TAGS_URL)
+        response = self.client.get(MEMORY_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        route = response.data['routes']['recipe:tag-list']
+        self.assertEqual(route['requests'], 1)
+        self.assertGreater(route['peak_max_kb'], 0)
+        self.assertTrue(route['top_sites'])
+
+    def test_report_limit(self):
+        """Test ?limit= must be a number and is kept to a sane range"""
+        self.assertEqual(self.client.get(MEMORY_URL, {'limit': 'ten'}).status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(MEMORY_REPORT_MAX_LIMIT=1):
+            self.client.get(TAGS_URL)
+            response = self.client.get(MEMORY_URL, {'limit': 1000})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['routes']['recipe:tag-list']['top_sites']), 1)
+
+    def test_report_admin_only(self):
+        """Test ordinary users can't read the report"""
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user('user@test.com', 'testPass'))
+        response = client.get(MEMORY_URL)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
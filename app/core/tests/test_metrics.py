@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core import metrics
+
+METRICS_URL = reverse('metrics')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class MetricsRegistryTests(TestCase):
+    """Test the metrics registry and text format"""
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.counter = metrics.Counter(self.registry, 'jobs_total', 'Jobs run', ('queue',))
+        self.histogram = metrics.Histogram(self.registry, 'job_seconds', 'Job time', (), buckets=(1, 5))
+
+    def test_render(self):
+        """Test counters and cumulative histogram buckets are rendered"""
+        self.counter.inc(queue='default')
+        self.counter.inc(2, queue='default')
+        self.histogram.observe(0.5)
+        self.histogram.observe(3)
+        self.histogram.observe(30)
+        text = self.registry.render()
+        self.assertIn('# TYPE jobs_total counter', text)
+        self.assertIn('jobs_total{queue="default"} 3', text)
+        self.assertIn('job_seconds_bucket{le="1"} 1', text)
+        self.assertIn('job_seconds_bucket{le="5"} 2', text)
+        self.assertIn('job_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('job_seconds_sum 33.5', text)
+        self.assertIn('job_seconds_count 3', text)
+
+    def test_collect_other_workers(self):
+        """Test values flushed by other worker processes are added to this one's"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'metrics-1-other.json'), 'w') as f:
+            json.dump({'jobs_total': {'["default"]': 5, '["slow"]': 1}}, f)
+        self.counter.inc(queue='default')
+        with override_settings(METRICS_DIR=directory):
+            self.registry.flush(force=True)
+            totals = self.registry.collect()
+        self.assertEqual(totals['jobs_total'], {'["default"]': 6, '["slow"]': 1})
+        self.assertTrue(os.path.exists(os.path.join(directory, self.registry.filename)))
+
+
+    def test_exited_workers_folded(self):
+        """Test an exited worker's file is folded into one file for exited workers, its values kept in the totals"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        for name, value in ((f'metrics-{exited.pid}-gone.json', 5), (metrics.DEAD_WORKERS_FILE, 2)):
+            with open(os.path.join(directory, name), 'w') as f:
+                json.dump({'jobs_total': {'["default"]': value}}, f)
+        with override_settings(METRICS_DIR=directory):
+            first, second = self.registry.collect(), self.registry.collect()
+        self.assertEqual(first['jobs_total'], {'["default"]': 7})
+        self.assertEqual(second, first)
+        self.assertEqual(sorted(name for name in os.listdir(directory) if name.endswith('.json')),
+                         [metrics.DEAD_WORKERS_FILE])
+
+
+class MetricsEndpointTests(TestCase):
+    """Test the /metrics endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('metrics@test.com', 'testPass'))
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_requests_counted_per_route(self):
+        """Test requests are labelled with their route name"""
+        self.client.get(TAGS_URL)
+        response = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'http_requests_total{route="recipe:tag-list",method="GET",status="200"}')
+        self.assertContains(response, 'http_request_db_queries_bucket{route="recipe:tag-list"')
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required(self):
+        """Test scrapers must send the bearer token when one is configured"""
+        self.assertEqual(self.client.get(METRICS_URL).status_code, 403)
+        response = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_admin_only_without_token(self):
+        """Test that without a token configured the metrics are refused, except to signed in admin users"""
+        self.assertEqual(self.client.get(METRICS_URL).status_code, 403)
+        self.assertEqual(self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+        self.client.force_login(get_user_model().objects.create_superuser('admin@test.com', 'testPass'))
+        self.assertEqual(self.client.get(METRICS_URL).status_code, 200)
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core import profiling
+from core.models import Tag
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class PerformanceMiddlewareTests(TestCase):
+    """Test per request performance instrumentation"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('perf@test.com', 'testPass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(user=self.user, name='Vegan')
+
+    def test_server_timing_header(self):
+        """Test db, view, serializer and render timings are reported"""
+        response = self.client.get(TAGS_URL)
+        header = response['Server-Timing']
+        for metric in ('db;dur=', 'view;dur=', 'serialize;dur=', 'render;dur=', 'total;dur='):
+            self.assertIn(metric, header)
+        self.assertIn('"1 queries"', header)
+
+    @override_settings(PERFORMANCE_SERVER_TIMING=False)
+    def test_server_timing_disabled(self):
+        """Test the header can be turned off"""
+        response = self.client.get(TAGS_URL)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(PERFORMANCE_BUDGETS={'default': {'total_ms': 10000}, 'recipe:tag-list': {'db_queries': 0}})
+    def test_over_budget_logged(self):
+        """Test a route specific budget overrides the default and is flagged when exceeded"""
+        with self.assertLogs('core.performance', level='WARNING') as logs:
+            self.client.get(TAGS_URL)
+        self.assertIn('"over_budget": ["db_queries"]', logs.output[0])
+        self.assertIn('"route": "recipe:tag-list"', logs.output[0])
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """Test sampled request profiling"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('profile@test.com', 'testPass')
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+
+    def _get(self, **extra):
+        client = APIClient()  # a fresh client loads middleware under the overridden settings
+        client.force_authenticate(self.user)
+        return client.get(TAGS_URL, **extra)
+
+    def _profiles(self):
+        return os.listdir(os.path.join(self.profile_dir, 'recipe.tag-list'))
+
+    def test_sampled_request_profiled(self):
+        """Test a sampled request writes pstats for its route"""
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_CPROFILE_SHARE=1.0,
+                               PROFILING_DIR=self.profile_dir):
+            response = self._get()
+        self.assertEqual(response.status_code, 200)
+        files = self._profiles()
+        self.assertTrue(any(name.endswith('.pstats') for name in files))
+
+    def test_one_profiler_per_request(self):
+        """Test a request given to the stack sampler isn't run under cProfile as well"""
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_CPROFILE_SHARE=0.0,
+                               PROFILING_DIR=self.profile_dir, PROFILING_INTERVAL=0.0001), \
+                patch('core.profiling.cProfile.Profile') as profile:
+            self._get()
+        profile.assert_not_called()
+        self.assertFalse(any(name.endswith('.pstats') for name in self._profiles()))
+
+    def test_profiles_rotated(self):
+        """Test only the newest PROFILING_KEEP pstats files of a route are kept"""
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_CPROFILE_SHARE=1.0,
+                               PROFILING_DIR=self.profile_dir, PROFILING_KEEP=2):
+            for _ in range(3):
+                self._get()
+        self.assertEqual(len([name for name in self._profiles() if name.endswith('.pstats')]), 2)
+
+    def test_trigger_header(self):
+        """Test a signed trigger header forces profiling and a forged one doesn't"""
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0.0, PROFILING_DIR=self.profile_dir):
+            self._get(HTTP_X_PROFILE='forged')
+            self.assertFalse(os.path.exists(os.path.join(self.profile_dir, 'recipe.tag-list')))
+            self._get(HTTP_X_PROFILE=profiling.make_token())
+        self.assertEqual(len(self._profiles()), 1)
+
+    def test_disabled(self):
+        """Test nothing is written when profiling is off"""
+        with override_settings(PROFILING_ENABLED=False, PROFILING_SAMPLE_RATE=1.0, PROFILING_DIR=self.profile_dir):
+            self._get()
+        self.assertEqual(os.listdir(self.profile_dir), [])
@@ -1,5 +1,6 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError
 from core import models
 from unittest.mock import patch
 
@@ -50,6 +51,24 @@ class ModelTests(TestCase):
         tag = models.Tag.objects.create(user=sample_user(), name='bork')
         self.assertEqual(str(tag), tag.name)
 
+    def test_tag_name_unique_per_user_ignoring_case(self):
+        """Test a user can't have the same tag twice in different cases"""
+        user = sample_user()
+        models.Tag.objects.create(user=user, name='Vegan')
+        models.Tag.objects.create(user=sample_user(email='other@test.com'), name='vegan')  # other users are fine
+        with self.assertRaises(IntegrityError):
+            models.Tag.objects.create(user=user, name='vegan')
+
+    def test_get_or_create_by_names(self):
+        """Test names are matched case-insensitively and only missing ones are created"""
+        user = sample_user()
+        salt = models.Ingredient.objects.create(user=user, name='Salt')
+        ingredients = models.Ingredient.objects.get_or_create_by_names(user, ['salt', ' Pepper ', 'PEPPER', ''])
+        self.assertEqual(ingredients[0], salt)
+        self.assertEqual(ingredients[1].name, 'Pepper')
+        self.assertEqual(len(ingredients), 2)
+        self.assertEqual(models.Ingredient.objects.filter(user=user).count(), 2)
+
     def test_ingredient_str(self):
         """Test the ingredient string representation"""
         ingredient = models.Ingredient.objects.create(user=sample_user(), name='fish')
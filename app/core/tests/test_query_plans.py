@@ -0,0 +1,134 @@
+"""
+Snapshot the query plans of the API's core querysets against a seeded data set.
+
+Snapshots live in core/tests/query_plans/<database vendor>.json. A test fails when a table that was read through
+an index is now scanned sequentially, or when the estimated cost (Postgres only) grows by more than
+PLAN_COST_THRESHOLD. Record or refresh the snapshots for the current database with
+
+    UPDATE_QUERY_PLANS=1 python manage.py test core.tests.test_query_plans
+"""
+import json
+import os
+import re
+import unittest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+from core.models import Recipe
+from core.seed import seed, SEED_EMAIL
+from recipe import views
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), 'query_plans')
+UPDATE = os.environ.get('UPDATE_QUERY_PLANS') == '1'
+PLAN_COST_THRESHOLD = 0.5  # fractional increase in estimated cost that counts as a regression
+
+
+def viewset_queryset(viewset_class, params):
+    """The queryset a viewset would run for a list request with params"""
+    user = get_user_model().objects.get(email=SEED_EMAIL.format(0))
+    django_request = APIRequestFactory().get('/', params)
+    force_authenticate(django_request, user)
+    view = viewset_class(action='list', format_kwarg=None)
+    view.request = Request(django_request)
+    return view.get_queryset()
+
+
+def popular_ids(relation, count):
+    """Ids of the most used tags or ingredients of the first seeded user, so filters hit real rows"""
+    return ','.join(str(pk) for pk in (
+            getattr(Recipe, relation).through.objects
+            .filter(recipe__user__email=SEED_EMAIL.format(0))
+            .values_list(f'{relation[:-1]}_id', flat=True)
+            .annotate(uses=Count('recipe_id')).order_by('-uses')[:count]))
+
+
+def canonical_querysets():
+    """Name -> queryset for every query the list endpoints run"""
+    return {
+            'recipe_list':              viewset_queryset(views.RecipeViewSet, {}),
+            'recipe_tag_filter':        viewset_queryset(views.RecipeViewSet, {'tags': popular_ids('tags', 2)}),
+            'recipe_ingredient_filter': viewset_queryset(
+                    views.RecipeViewSet, {'ingredients': popular_ids('ingredients', 2)}),
+            'recipe_time_price_filter': viewset_queryset(
+                    views.RecipeViewSet, {'max_time': 30, 'max_price': '20.00', 'ordering': 'time_minutes'}),
+            'recipe_price_ordering':    viewset_queryset(views.RecipeViewSet, {'ordering': '-price'}),
+            'tag_list':                 viewset_queryset(views.TagViewSet, {}),
+            'tag_assigned_only':        viewset_queryset(views.TagViewSet, {'assigned_only': 1}),
+            'ingredient_list':          viewset_queryset(views.IngredientViewSet, {}),
+            'ingredient_assigned_only': viewset_queryset(views.IngredientViewSet, {'assigned_only': 1}),
+    }
+
+
+def _postgres_nodes(plan, depth=0):
+    """Flatten a Postgres JSON plan into (depth, node type, relation, index) tuples"""
+    yield depth, plan['Node Type'], plan.get('Relation Name'), plan.get('Index Name')
+    for child in plan.get('Plans', ()):
+        yield from _postgres_nodes(child, depth + 1)
+
+
+def capture(queryset):
+    """Return the normalised plan lines, the tables read sequentially and the estimated cost (None on SQLite)"""
+    if connection.vendor == 'postgresql':
+        # QuerySet.explain() str()s each row, which for the JSON format is the list psycopg2 already decoded
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0][0]['Plan']
+        lines, scanned = [], set()
+        for depth, node, relation, index in _postgres_nodes(plan):
+            lines.append('  ' * depth + ' '.join(part for part in (node, relation, index and f'using {index}') if part))
+            if node == 'Seq Scan':
+                scanned.add(relation)
+        return lines, sorted(scanned), plan['Total Cost']
+    # SQLite EXPLAIN QUERY PLAN rows are "id parent notused detail", older versions say "SCAN TABLE x"
+    lines = [re.sub(r'^(\d+ ){3}', '', line).replace(' TABLE ', ' ') for line in queryset.explain().splitlines()]
+    scanned = sorted(line.split()[1] for line in lines
+                     if line.startswith('SCAN ') and 'USING' not in line)
+    return lines, scanned, None
+
+
+class QueryPlanSnapshotTests(TestCase):
+    """Test the core querysets keep their index backed plans"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(users=20, recipes=200, tags=30, ingredients=80)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')  # the planner needs statistics to pick the plans production would
+        cls.snapshot_file = os.path.join(SNAPSHOT_DIR, f'{connection.vendor}.json')
+        cls.snapshots = {}
+        if os.path.exists(cls.snapshot_file):
+            with open(cls.snapshot_file) as f:
+                cls.snapshots = json.load(f)
+
+    def test_query_plans(self):
+        """Test no canonical query gains a sequential scan or a large cost increase"""
+        captured = {}
+        for name, queryset in canonical_querysets().items():
+            lines, scanned, cost = capture(queryset)
+            captured[name] = {'plan': lines, 'seq_scans': scanned, 'cost': cost}
+
+        if UPDATE:
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            with open(self.snapshot_file, 'w') as f:
+                json.dump(captured, f, indent=2, sort_keys=True)
+                f.write('\n')
+            return
+        if not self.snapshots:
+            raise unittest.SkipTest(f'No {connection.vendor} plan snapshots, record them with UPDATE_QUERY_PLANS=1')
+
+        for name, current in captured.items():
+            with self.subTest(query=name):
+                expected = self.snapshots.get(name)
+                if expected is None:
+                    self.fail(f'No snapshot for {name}, record it with UPDATE_QUERY_PLANS=1')
+                plan = '\n'.join(current['plan'])
+                new_scans = set(current['seq_scans']) - set(expected['seq_scans'])
+                self.assertFalse(new_scans, f'{name} now scans {sorted(new_scans)} sequentially:\n{plan}')
+                if expected['cost'] is not None and current['cost'] is not None:
+                    limit = expected['cost'] * (1 + PLAN_COST_THRESHOLD)
+                    self.assertLessEqual(current['cost'], limit,
+                                         f'{name} cost rose from {expected["cost"]} to {current["cost"]}:\n{plan}')
@@ -0,0 +1,50 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core import slow_queries
+
+
+class SlowQueryLogTests(TestCase):
+    """Test logging queries over the slow query threshold"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.log_file = os.path.join(directory, 'slow.log')
+        self.addCleanup(self._remove_handler)
+
+    @staticmethod
+    def _remove_handler():
+        for handler in list(slow_queries.logger.handlers):
+            handler.close()
+            slow_queries.logger.removeHandler(handler)
+
+    def test_fingerprint_ignores_literals(self):
+        """Test queries differing only in literals and IN list length share a fingerprint"""
+        first = slow_queries.fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND name = 'a'")
+        second = slow_queries.fingerprint("SELECT * FROM t WHERE id IN (%s) AND name = 'bb'")
+        self.assertEqual(first, second)
+
+    def test_slow_query_logged_with_origin(self):
+        """Test a slow API query is written with its route and originating project frame, then reported"""
+        user = get_user_model().objects.create_user('slow@test.com', 'testPass')
+        client = APIClient()
+        client.force_authenticate(user)
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_LOG_FILE=self.log_file):
+            client.get(reverse('recipe:tag-list'))
+        with open(self.log_file) as f:
+            entries = [json.loads(line) for line in f]
+        tag_queries = [entry for entry in entries if 'core_tag' in entry['sql']]
+        self.assertEqual(tag_queries[0]['route'], 'recipe:tag-list')
+        self.assertIn('rest_framework/serializers.py', tag_queries[0]['origin'])  # the list serializer ran it
+
+        out = StringIO()
+        call_command('slow_query_report', file=self.log_file, stdout=out)
+        self.assertIn('core_tag', out.getvalue())
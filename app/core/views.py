@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+
+from core import batch as batches
+from core.memory import tracker
+from core.metrics import registry
+
+
+def metrics(request):
+    """
+    Expose metrics for every worker in the Prometheus text format, to scrapers sending METRICS_TOKEN or, when no
+    token is configured, to admin users signed in to the site
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+    else:
+        allowed = request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET', 'DELETE'])
+@authentication_classes((TokenAuthentication,))
+@permission_classes((IsAdminUser,))
+def memory_report(request):
+    """Allocation per route for the worker that answers, DELETE starts a fresh measurement window"""
+    if request.method == 'DELETE':
+        tracker.reset()
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        raise ValidationError('limit must be an integer')
+    limit = max(1, min(limit, settings.MEMORY_REPORT_MAX_LIMIT))
+    return Response(dict(tracker.report(limit), enabled=settings.MEMORY_TRACKING_ENABLED))
+
+
+@api_view(['POST'])
+@authentication_classes((TokenAuthentication,))
+@permission_classes((IsAuthenticated,))
+def batch(request):
+    """Run a list of API requests as the authenticated user and return their responses together"""
+    items = batches.parse(request.data)
+    return HttpResponse(batches.run(request, items), content_type='application/json')
@@ -0,0 +1,17 @@
+from django.contrib import admin
+
+from core.admin import EstimatedCountPaginator
+from jobs.models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'queue', 'priority', 'status', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'queue')
+    search_fields = ('=task',)
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = ('locked_by', 'locked_at', 'created_at', 'finished_at', 'last_error')
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,30 @@
+""" This command will be available to be ran from manage.py"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs.worker import Worker
+
+
+class Command(BaseCommand):
+    """Django command to run queued background jobs until stopped with SIGTERM or Ctrl-C"""
+    help = 'Claim and run jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queues', default=','.join(settings.JOBS_QUEUES),
+                            help='Comma separated lanes, highest priority first')
+        parser.add_argument('--concurrency', type=int, default=settings.JOBS_CONCURRENCY,
+                            help='Pool processes, 0 runs jobs in this process')
+        parser.add_argument('--poll-interval', type=float, default=settings.JOBS_POLL_INTERVAL)
+        parser.add_argument('--burst', action='store_true', help='Exit once the queues are empty')
+        parser.add_argument('--max-jobs', type=int, default=None, help='Exit after this many jobs')
+
+    def handle(self, *args, **options):
+        worker = Worker(
+                queues=[name.strip() for name in options['queues'].split(',') if name.strip()],
+                concurrency=options['concurrency'],
+                poll_interval=options['poll_interval'],
+                burst=options['burst'],
+                max_jobs=options['max_jobs'],
+        )
+        processed = worker.run()
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker.id} processed {processed} jobs'))
@@ -0,0 +1,68 @@
+import json
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """A unit of background work waiting for, or done by, `manage.py run_worker`"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = ((QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed'))
+
+    task = models.CharField(max_length=255)
+    arguments = models.TextField(default='{}')  # JSON {"args": [...], "kwargs": {...}}
+    queue = models.CharField(max_length=50, default='default')  # priority lane, workers drain lanes in order
+    priority = models.SmallIntegerField(default=0)  # higher runs first within a lane
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)  # pushed back after a failure
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # the worker's claim query: ready jobs in one lane, best first
+        indexes = [models.Index(fields=['queue', 'status', '-priority', 'run_at'], name='jobs_job_claim_idx')]
+
+    def __str__(self):
+        return f'{self.task} #{self.id} ({self.status})'
+
+    def load_arguments(self):
+        data = json.loads(self.arguments)
+        return data.get('args', []), data.get('kwargs', {})
+
+    def retry_delay(self):
+        """Exponential backoff with jitter so failed jobs don't all come back at once"""
+        delay = min(settings.JOBS_RETRY_BACKOFF * 2 ** max(self.attempts - 1, 0), settings.JOBS_RETRY_BACKOFF_MAX)
+        return timedelta(seconds=delay * random.uniform(1, 1.1))
+
+    def finish(self, error=None):
+        """Mark the job done, or queue it again with backoff until it runs out of attempts"""
+        now = timezone.now()
+        self.locked_by = ''
+        self.locked_at = None
+        if error is None:
+            self.status = self.DONE
+            self.finished_at = now
+        elif self.attempts < self.max_attempts:
+            self.status = self.QUEUED
+            self.run_at = now + self.retry_delay()
+            self.last_error = error
+        else:
+            self.status = self.FAILED
+            self.finished_at = now
+            self.last_error = error
+        self.save(update_fields=['status', 'run_at', 'locked_by', 'locked_at', 'last_error', 'finished_at'])
+
+    def outcome(self):
+        """How the last attempt went, for the jobs metrics: done, retry or failed"""
+        return 'done' if self.status == self.DONE else 'retry' if self.status == self.QUEUED else 'failed'
@@ -0,0 +1,141 @@
+"""
+A persistent job queue in the application database.
+
+Tasks are plain functions registered with @task; calling `func.delay(...)` stores a Job row (inside the caller's
+transaction, so a rolled back request never leaves work behind) and `manage.py run_worker` claims and runs it.
+Claims use SELECT ... FOR UPDATE SKIP LOCKED where the database has it (Postgres) so any number of workers can poll
+the same lane without blocking each other; elsewhere a conditional UPDATE decides which worker won the row.
+"""
+import json
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core import metrics
+from jobs.models import Job
+
+logger = logging.getLogger('jobs')
+
+TASKS = {}
+
+PROCESSED = metrics.Counter(metrics.registry, 'jobs_processed_total', 'Jobs run by outcome (done, retry or failed)',
+                            ('queue', 'task', 'outcome'))
+DURATION = metrics.Histogram(metrics.registry, 'job_duration_seconds', 'Time to run a job', ('queue', 'task'),
+                             buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900))
+WAIT = metrics.Histogram(metrics.registry, 'job_wait_seconds', 'Time from a job being due to being claimed',
+                         ('queue',), buckets=(.1, .5, 1, 5, 10, 30, 60, 300, 900, 3600))
+
+
+class Task:
+    """A function workers can run by name, with the lane and retry policy its jobs get by default"""
+
+    def __init__(self, func, queue, priority, max_attempts):
+        self.func = func
+        self.name = f'{func.__module__}.{func.__name__}'
+        self.queue = queue
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """Queue a run with the task's defaults, arguments must be JSON serialisable"""
+        return self.enqueue(args, kwargs)
+
+    def enqueue(self, args=(), kwargs=None, queue=None, priority=None, run_at=None):
+        """
+        Queue a run, or run it now when settings.BACKGROUND_TASKS_INLINE is on (tests and debugging)
+        :return: the Job, None when run inline
+        """
+        if settings.BACKGROUND_TASKS_INLINE:
+            self.func(*args, **(kwargs or {}))
+            return None
+        return Job.objects.create(
+                task=self.name,
+                arguments=json.dumps({'args': list(args), 'kwargs': kwargs or {}}),
+                queue=queue or self.queue,
+                priority=self.priority if priority is None else priority,
+                max_attempts=self.max_attempts,
+                run_at=run_at or timezone.now(),
+        )
+
+
+def task(queue='default', priority=0, max_attempts=None):
+    """Register the decorated function as a Task, its module must be an app's tasks.py to be found by workers"""
+
+    def decorator(func):
+        registered = Task(func, queue, priority, max_attempts or settings.JOBS_MAX_ATTEMPTS)
+        TASKS[registered.name] = registered
+        return registered
+
+    return decorator
+
+
+def _ready(now):
+    """Due queued jobs, plus running jobs whose worker died, once older than JOBS_LOCK_TIMEOUT"""
+    return (Q(status=Job.QUEUED, run_at__lte=now)
+            | Q(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)))
+
+
+def claim(queues, worker_id):
+    """Lock the best ready job from the first lane in queues that has one and mark it running. None when idle"""
+    now = timezone.now()
+    for queue in queues:
+        candidates = Job.objects.filter(_ready(now), queue=queue).order_by('-priority', 'run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                job = candidates.select_for_update(skip_locked=True).first()
+                if job is None:
+                    continue
+                job.status, job.locked_by, job.locked_at = Job.RUNNING, worker_id, now
+                job.attempts += 1
+                job.save(update_fields=['status', 'locked_by', 'locked_at', 'attempts'])
+        else:
+            for job_id in candidates.values_list('id', flat=True)[:settings.JOBS_CLAIM_CANDIDATES]:
+                # whichever worker's UPDATE still sees the row ready wins it
+                won = Job.objects.filter(_ready(now), id=job_id).update(
+                        status=Job.RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1)
+                if won:
+                    job = Job.objects.get(id=job_id)
+                    break
+            else:
+                continue
+        WAIT.observe(max((now - job.run_at).total_seconds(), 0), queue=job.queue)
+        return job
+    return None
+
+
+def execute(job_id):
+    """
+    Run a claimed job and record how it went on its row. Runs in the worker's pool processes
+    :return: (outcome, seconds) where outcome is done, retry or failed
+    """
+    job = Job.objects.get(id=job_id)
+    start = time.perf_counter()
+    try:
+        registered = TASKS.get(job.task)
+        if registered is None:
+            raise LookupError(f'No task named {job.task}, is its tasks.py in an installed app?')
+        args, kwargs = job.load_arguments()
+        registered.func(*args, **kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception('Job %s (%s) failed on attempt %s', job.id, job.task, job.attempts)
+    else:
+        error = None
+    duration = time.perf_counter() - start
+    job.finish(error)
+    return job.outcome(), duration
+
+
+def record(job, outcome, duration):
+    PROCESSED.inc(queue=job.queue, task=job.task, outcome=outcome)
+    DURATION.observe(duration, queue=job.queue, task=job.task)
@@ -0,0 +1,196 @@
+import json
+from concurrent.futures import Future
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from jobs import queue
+from jobs.models import Job
+from jobs.worker import Worker
+
+CALLS = []
+
+
+@queue.task(queue='default')
+def record_call(*args, **kwargs):
+    CALLS.append((args, kwargs))
+
+
+@queue.task(queue='default', max_attempts=2)
+def always_fails():
+    raise ValueError('broken')
+
+
+@override_settings(BACKGROUND_TASKS_INLINE=False)
+class JobQueueTests(TestCase):
+    """Test queueing, claiming and running background jobs"""
+
+    def setUp(self):
+        CALLS.clear()
+
+    def test_delay_stores_job(self):
+        """Test delay queues a job with the task's defaults and its arguments as JSON"""
+        job = record_call.delay(1, 'two', three=3)
+
+        self.assertEqual(job.task, 'jobs.tests.test_queue.record_call')
+        self.assertEqual(job.queue, 'default')
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(json.loads(job.arguments), {'args': [1, 'two'], 'kwargs': {'three': 3}})
+        self.assertEqual(CALLS, [])
+
+    @override_settings(BACKGROUND_TASKS_INLINE=True)
+    def test_delay_inline(self):
+        """Test tasks run straight away without a job when running inline"""
+        self.assertIsNone(record_call.delay(1))
+        self.assertEqual(CALLS, [((1,), {})])
+        self.assertFalse(Job.objects.exists())
+
+    def test_claim_order(self):
+        """Test lanes are drained in order and higher priority jobs go first within a lane"""
+        low = record_call.enqueue(queue='low', priority=10)
+        normal = record_call.enqueue()
+        urgent = record_call.enqueue(priority=5)
+
+        claimed = [queue.claim(['high', 'default', 'low'], 'test').id for _ in range(3)]
+
+        self.assertEqual(claimed, [urgent.id, normal.id, low.id])
+        self.assertIsNone(queue.claim(['high', 'default', 'low'], 'test'))
+
+    def test_claim_marks_running(self):
+        """Test a claimed job is locked to its worker and not handed out again"""
+        record_call.delay()
+        job = queue.claim(['default'], 'worker-1')
+
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertEqual(job.locked_by, 'worker-1')
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(queue.claim(['default'], 'worker-2'))
+
+    def test_claim_skips_future_jobs(self):
+        """Test jobs waiting out a retry delay are not claimed early"""
+        record_call.enqueue(run_at=timezone.now() + timedelta(minutes=5))
+        self.assertIsNone(queue.claim(['default'], 'test'))
+
+    @override_settings(JOBS_LOCK_TIMEOUT=60)
+    def test_claim_recovers_lost_job(self):
+        """Test a job whose worker died is handed to another worker after the lock timeout"""
+        job = record_call.delay()
+        Job.objects.filter(id=job.id).update(status=Job.RUNNING, locked_by='dead', attempts=1,
+                                             locked_at=timezone.now() - timedelta(minutes=2))
+
+        claimed = queue.claim(['default'], 'alive')
+
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.locked_by, 'alive')
+        self.assertEqual(claimed.attempts, 2)
+
+    def test_execute_success(self):
+        """Test a successful job runs with its arguments and is marked done"""
+        job = record_call.delay(4, five=5)
+        queue.claim(['default'], 'test')
+
+        outcome, _ = queue.execute(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(outcome, 'done')
+        self.assertEqual(job.status, Job.DONE)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(CALLS, [((4,), {'five': 5})])
+
+    def test_execute_retries_then_fails(self):
+        """Test a failing job is retried with backoff until it runs out of attempts"""
+        job = always_fails.delay()
+        queue.claim(['default'], 'test')
+
+        with self.assertLogs('jobs', 'ERROR'):
+            self.assertEqual(queue.execute(job.id)[0], 'retry')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('ValueError: broken', job.last_error)
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        queue.claim(['default'], 'test')
+        with self.assertLogs('jobs', 'ERROR'):
+            self.assertEqual(queue.execute(job.id)[0], 'failed')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_execute_unknown_task(self):
+        """Test a job naming a task that doesn't exist fails instead of crashing the worker"""
+        job = Job.objects.create(task='nowhere.missing', max_attempts=1)
+        queue.claim(['default'], 'test')
+
+        with self.assertLogs('jobs', 'ERROR'):
+            self.assertEqual(queue.execute(job.id)[0], 'failed')
+        job.refresh_from_db()
+        self.assertIn('No task named nowhere.missing', job.last_error)
+
+    def test_worker_burst(self):
+        """Test a burst worker runs every ready job, records metrics and exits"""
+        for i in range(3):
+            record_call.delay(i)
+        before = queue.PROCESSED.registry.snapshot()['jobs_processed_total']
+        key = queue.PROCESSED.key({'queue': 'default', 'task': record_call.name, 'outcome': 'done'})
+
+        processed = Worker(['default'], concurrency=0, burst=True).run()
+
+        after = queue.PROCESSED.registry.snapshot()['jobs_processed_total']
+        self.assertEqual(processed, 3)
+        self.assertEqual(sorted(args[0] for args, _ in CALLS), [0, 1, 2])
+        self.assertEqual(after[key] - before.get(key, 0), 3)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 3)
+
+    def test_worker_max_jobs(self):
+        """Test a worker stops after max_jobs"""
+        for i in range(3):
+            record_call.delay(i)
+
+        self.assertEqual(Worker(['default'], concurrency=0, max_jobs=2).run(), 2)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+
+    def test_pool_goes_on_after_failed_future(self):
+        """Test a job whose pool future raises is logged and failed, and the worker runs the next one"""
+        broken, fine = record_call.delay('lost'), record_call.delay('next')
+        Job.objects.filter(id=broken.id).update(max_attempts=1)
+
+        class Pool:  # runs jobs in this process, the result of the broken one can't be sent back
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def submit(self, func, job_id):
+                future = Future()
+                if job_id == broken.id:
+                    future.set_exception(OSError('result lost'))
+                else:
+                    future.set_result(queue.execute(job_id))
+                return future
+
+        with patch('jobs.worker.ProcessPoolExecutor', Pool), patch('jobs.worker.connections'), \
+                self.assertLogs('jobs', 'ERROR'):
+            processed = Worker(['default'], concurrency=2, burst=True).run()
+
+        self.assertEqual(processed, 2)
+        broken.refresh_from_db()
+        self.assertEqual(broken.status, Job.FAILED)
+        self.assertIn('OSError: result lost', broken.last_error)
+        self.assertEqual(Job.objects.get(id=fine.id).status, Job.DONE)
+
+    def test_run_worker_command(self):
+        """Test run_worker drains the queues in burst mode"""
+        record_call.delay()
+        out = StringIO()
+
+        call_command('run_worker', '--burst', '--concurrency', '0', stdout=out)
+
+        self.assertIn('processed 1 jobs', out.getvalue())
+        self.assertEqual(len(CALLS), 1)
@@ -0,0 +1,121 @@
+"""The loop behind `manage.py run_worker`: claim jobs in this process, run them in a pool of child processes"""
+import logging
+import os
+import signal
+import socket
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.db import connections
+
+from core import metrics
+from jobs import queue
+
+logger = logging.getLogger('jobs')
+
+
+def _init_process():
+    """Pool processes start without the parent's database connections and with Django ready (spawn platforms)"""
+    django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent decides when to stop, children finish their job
+
+
+def _run(job_id):
+    try:
+        return queue.execute(job_id)
+    finally:
+        connections.close_all()  # a pool process may sit idle for a long time
+
+
+class Worker:
+    """
+    Claims up to `concurrency` jobs at a time from `queues` (lanes drained in the order given) and runs them in a
+    process pool. concurrency=0 runs jobs one at a time in this process, handy for debugging. With burst=True the
+    worker exits once every lane is empty
+    """
+
+    def __init__(self, queues, concurrency=1, poll_interval=1.0, burst=False, max_jobs=None):
+        self.queues = list(queues)
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.max_jobs = max_jobs
+        self.id = f'{socket.gethostname()}:{os.getpid()}'
+        self.processed = 0
+        self.stopping = False
+
+    def stop(self, *args):
+        """Finish the jobs already running, claim no more"""
+        if not self.stopping:
+            logger.info('Worker %s stopping after its running jobs', self.id)
+        self.stopping = True
+
+    def done(self, running=0):
+        """True once no more jobs should be claimed, running being the jobs claimed but not finished"""
+        return self.stopping or (self.max_jobs is not None and self.processed + running >= self.max_jobs)
+
+    def finished(self, job, outcome, duration):
+        queue.record(job, outcome, duration)
+        metrics.registry.flush()
+        self.processed += 1
+        logger.info('Job %s (%s) %s in %.3fs', job.id, job.task, outcome, duration)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info('Worker %s started on %s with concurrency %s', self.id, ','.join(self.queues), self.concurrency)
+        try:
+            if self.concurrency:
+                self.run_pool()
+            else:
+                self.run_inline()
+        finally:
+            metrics.registry.flush(force=True)
+        return self.processed
+
+    def run_inline(self):
+        while not self.done():
+            job = queue.claim(self.queues, self.id)
+            if job is None:
+                if self.burst:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            self.finished(job, *queue.execute(job.id))
+
+    def run_pool(self):
+        connections.close_all()  # forked children must not share this process's database sockets
+        running = {}
+        with ProcessPoolExecutor(self.concurrency, initializer=_init_process) as pool:
+            while running or not self.done():
+                while len(running) < self.concurrency and not self.done(len(running)):
+                    job = queue.claim(self.queues, self.id)
+                    if job is None:
+                        break
+                    running[pool.submit(_run, job.id)] = job, time.perf_counter()
+                if not running:
+                    if self.burst:
+                        return
+                    time.sleep(self.poll_interval)
+                    continue
+                completed, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    job, started = running.pop(future)
+                    try:
+                        outcome, duration = future.result()
+                    except BrokenProcessPool:
+                        # a pool process died mid job, the row stays running until JOBS_LOCK_TIMEOUT frees it.
+                        # The pool can't take new work so exit and let the supervisor start a fresh worker
+                        logger.exception('Job %s (%s) lost its process', job.id, job.task)
+                        self.stop()
+                        continue
+                    except Exception:
+                        # the task's own errors are caught by queue.execute, this failed around it (e.g. the
+                        # database or pickling the result). Fail this attempt and go on with the others
+                        logger.exception('Job %s (%s) failed outside its task', job.id, job.task)
+                        job.finish(traceback.format_exc())
+                        outcome, duration = job.outcome(), time.perf_counter() - started
+                    self.finished(job, outcome, duration)
@@ -3,3 +3,17 @@ from django.apps import AppConfig
 
 class RecipeConfig(AppConfig):
     name = 'recipe'
+
+    def ready(self):
+        from django.db.models.signals import m2m_changed, post_save
+        from core.models import Tag, Ingredient, Recipe
+        from recipe import documents, similarity
+        for through in (Recipe.tags.through, Recipe.ingredients.through):
+            m2m_changed.connect(similarity.recipe_links_changed, sender=through,
+                                dispatch_uid=f'recipe.similarity.{through.__name__}')
+            m2m_changed.connect(documents.recipe_links_changed, sender=through,
+                                dispatch_uid=f'recipe.documents.{through.__name__}')
+        post_save.connect(documents.recipe_saved, sender=Recipe, dispatch_uid='recipe.documents.Recipe')
+        for model in (Tag, Ingredient):
+            post_save.connect(documents.attribute_saved, sender=model,
+                              dispatch_uid=f'recipe.documents.{model.__name__}')
@@ -0,0 +1,129 @@
+"""
+Pre-rendered recipe detail documents.
+
+Serialising a recipe for the detail endpoint takes three queries (recipe, tags, ingredients) and a pass through
+RecipeDetailSerializer. Recipe.document keeps the JSON that would produce, rendered in the transaction of every
+write that changes it, so a detail request is one primary key read returning stored bytes.
+
+Writes that bypass save() and the m2m signals (bulk updates, deletes of tags and ingredients) restamp recipes with
+ChangeTrackedQuerySet.touch, which also blanks their documents. A blank document is stale and rendered again on
+its next read.
+"""
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, TextField, Value, When
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from core import sync
+from core.models import Recipe
+from recipe.serializers import RecipeDetailSerializer
+
+# changes to these recipe columns show in the document
+DOCUMENT_FIELDS = frozenset(RecipeDetailSerializer.Meta.fields) - {'ingredients', 'tags'}
+
+
+def render(recipe):
+    """The JSON text the detail endpoint would send for recipe, byte for byte"""
+    return JSONRenderer().render(RecipeDetailSerializer(recipe).data).decode()
+
+
+def refresh(recipe_ids, stale_only=False):
+    """
+    Render and store the documents of recipe_ids, RECIPE_DOCUMENT_BATCH_SIZE at a time with one UPDATE per batch.
+    Writers lock the recipes while rendering so a concurrent edit can't slip in between the read and the UPDATE.
+    Readers repairing stale documents pass stale_only, which takes no locks and only fills documents still blank,
+    so a render of an older state never replaces the one a write committed meanwhile
+    :return: dict of recipe id -> document as rendered
+    """
+    recipe_ids = list(recipe_ids)
+    batch_size = settings.RECIPE_DOCUMENT_BATCH_SIZE
+    documents = {}
+    for start in range(0, len(recipe_ids), batch_size):
+        with transaction.atomic():
+            recipes = Recipe.objects.filter(id__in=recipe_ids[start:start + batch_size]).defer('document')
+            if not stale_only:
+                recipes = recipes.select_for_update().order_by('id')  # a steady lock order, no deadlocks
+            batch = {recipe.id: render(recipe) for recipe in recipes.prefetch_related('tags', 'ingredients')}
+            if batch:
+                targets = Recipe.objects.filter(id__in=batch)
+                if stale_only:
+                    targets = targets.filter(document='')
+                targets.update(document=Case(*[When(id=pk, then=Value(document)) for pk, document in batch.items()],
+                                             output_field=TextField()))
+        documents.update(batch)
+    return documents
+
+
+def refresh_stale(user_id):
+    """Render every blank document the user has, batch by batch. Returns how many were rendered"""
+    stale = Recipe.objects.filter(user_id=user_id, document='').order_by('id').values_list('id', flat=True)
+    return len(refresh(stale, stale_only=True))
+
+
+def recipe_saved(sender, instance, created, update_fields, **kwargs):
+    """post_save receiver: re-render a recipe whose title, time, price or link may have changed"""
+    if sync.collecting():  # the API write renders it once it's done
+        return
+    if update_fields is None or DOCUMENT_FIELDS & set(update_fields):
+        refresh([instance.pk])
+
+
+def recipe_links_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """m2m_changed receiver: re-render recipes that gained or lost tags or ingredients"""
+    if sync.collecting():
+        return
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        refresh(pk_set)
+    # a clear from the tag / ingredient side touches the recipes first (core.sync), leaving them to render on read
+
+
+def attribute_saved(sender, instance, created, update_fields, **kwargs):
+    """
+    post_save receiver for tags and ingredients: a rename shows in every recipe using it. Up to
+    RECIPE_DOCUMENT_FANOUT_LIMIT recipes are rendered here, a bigger fan out is marked stale and left to a job
+    """
+    if created or update_fields is not None and 'name' not in update_fields:
+        return
+    recipes = Recipe.objects.filter(**{sender._meta.model_name + 's': instance})
+    recipe_ids = list(recipes.values_list('id', flat=True)[:settings.RECIPE_DOCUMENT_FANOUT_LIMIT + 1])
+    if len(recipe_ids) <= settings.RECIPE_DOCUMENT_FANOUT_LIMIT:
+        refresh(recipe_ids)
+        return
+    from recipe.tasks import refresh_recipe_documents  # recipe.tasks imports this module
+    Recipe.objects.filter(id__in=recipes.values('id')).update(document='')
+    refresh_recipe_documents.delay(instance.user_id)
+
+
+class DocumentResponse(Response):
+    """
+    A response carrying a stored document. JSON requests get its bytes as they are, other renderers (the
+    browsable API) and tests reading .data get it decoded
+    """
+
+    def __init__(self, document, **kwargs):
+        self.document = document
+        super().__init__(**kwargs)
+
+    @property
+    def data(self):
+        if self._data is None and self.document:
+            self._data = json.loads(self.document)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def rendered_content(self):
+        # DRF's JSONRenderer output is what was stored, unless the client asked for it indented
+        if type(self.accepted_renderer) is JSONRenderer and 'indent' not in self.accepted_media_type:
+            self['Content-Type'] = self.accepted_renderer.media_type
+            return self.document.encode()
+        return super().rendered_content
@@ -0,0 +1,71 @@
+"""
+Server side copies of recipes, for users making variations.
+
+The copied rows are inserted in bulk and their tag and ingredient links are copied inside the database with one
+INSERT ... SELECT per relation, so nothing is sent back and forth through the API. A copy shares its source's
+stored image file. Uploads always get a fresh file name (core.models.recipe_image_file_path) and files are never
+deleted with a recipe, so changing one recipe's image can't affect the other.
+"""
+from django.db import connection, transaction
+
+from core.models import Recipe, User
+from recipe import documents
+from recipe.tasks import refresh_similar_recipes
+
+COPIED_FIELDS = ('title', 'time_minutes', 'price', 'link')
+PAIRS_PER_STATEMENT = 400  # two parameters per (source, copy) pair keeps SQLite under its limit
+
+
+def _insert_copies(sources, title):
+    """Insert one new row per source, in one statement where the database returns the new ids. Same order"""
+    copies = [Recipe(user_id=source.user_id, image=source.image.name or None,  # the file's name, shared as is
+                     **{name: getattr(source, name) for name in COPIED_FIELDS})
+              for source in sources]
+    if title is not None:
+        for copy in copies:
+            copy.title = title
+    if connection.features.can_return_ids_from_bulk_insert:
+        change = User.objects.next_change(sources[0].user_id)  # bulk_create skips save(), stamp the rows here
+        for copy in copies:
+            copy.change_seq = change
+        Recipe.objects.bulk_create(copies)
+    else:  # SQLite doesn't hand back the ids of a bulk insert
+        for copy in copies:
+            copy.save()
+    return copies
+
+
+def _copy_links(pairs):
+    """Copy the tag and ingredient links of each (source id, copy id) pair with INSERT ... SELECT"""
+    quote = connection.ops.quote_name
+    for relation in ('tags', 'ingredients'):
+        through = getattr(Recipe, relation).through
+        recipe_column = quote(through._meta.get_field('recipe').column)
+        target_column = quote(through._meta.get_field(relation[:-1]).column)
+        table = quote(through._meta.db_table)
+        for start in range(0, len(pairs), PAIRS_PER_STATEMENT):
+            batch = pairs[start:start + PAIRS_PER_STATEMENT]
+            mapping = ' UNION ALL '.join(['SELECT %s AS source_id, %s AS copy_id'] * len(batch))
+            with connection.cursor() as cursor:
+                cursor.execute(f'INSERT INTO {table} ({recipe_column}, {target_column}) '
+                               f'SELECT mapping.copy_id, links.{target_column} FROM {table} links '
+                               f'JOIN ({mapping}) mapping ON links.{recipe_column} = mapping.source_id',
+                               [value for pair in batch for value in pair])
+
+
+def duplicate(user, recipe_ids, title=None):
+    """
+    Copy the user's recipes among recipe_ids with their tags, ingredients and image. Ids the user doesn't own are
+    skipped. title replaces the copies' titles when given
+    :return: list of (source id, copy) pairs in id order
+    """
+    with transaction.atomic():
+        sources = list(Recipe.objects.filter(user=user, id__in=recipe_ids).defer('document').order_by('id'))
+        if not sources:
+            return []
+        copies = _insert_copies(sources, title)
+        pairs = [(source.id, copy.id) for source, copy in zip(sources, copies)]
+        _copy_links(pairs)
+        documents.refresh([copy.id for copy in copies])
+        refresh_similar_recipes.delay(*[copy.id for copy in copies])
+    return [(source.id, copy) for source, copy in zip(sources, copies)]
@@ -1,9 +1,26 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 
-from core.models import Tag, Ingredient, Recipe
+from core.models import Tag, Ingredient, Recipe, SimilarRecipe
 
 
-class TagSerializer(serializers.ModelSerializer):
+class UniqueNameMixin:
+    """Reject a name the requesting user already has in any letter case"""
+
+    def validate_name(self, value):
+        request = self.context.get('request')
+        if request is None:
+            return value
+        queryset = self.Meta.model.objects.filter(user=request.user, name__iexact=value)
+        if self.instance is not None:
+            queryset = queryset.exclude(id=self.instance.id)
+        if queryset.exists():
+            raise serializers.ValidationError(f'{self.Meta.model.__name__} "{value}" already exists')
+        return value
+
+
+class TagSerializer(UniqueNameMixin, serializers.ModelSerializer):
     """Serializer for tag objects"""
 
     class Meta:
@@ -12,7 +29,7 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(UniqueNameMixin, serializers.ModelSerializer):
     """Serializer for ingredient objects"""
 
     class Meta:
@@ -24,13 +41,46 @@ class IngredientSerializer(serializers.ModelSerializer):
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializer for recipe objects"""
     ingredients = serializers.PrimaryKeyRelatedField(
-            many=True, queryset=Ingredient.objects.all())  # kind of like a Foreign Key for serializers
-    tags = serializers.PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
+            many=True, queryset=Ingredient.objects.all(), default=list)  # kind of like a Foreign Key for serializers
+    tags = serializers.PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all(), default=list)
+    # names are resolved or created for the recipe owner so a client can create a recipe in one request
+    ingredient_names = serializers.ListField(
+            child=serializers.CharField(max_length=255), write_only=True, required=False)
+    tag_names = serializers.ListField(child=serializers.CharField(max_length=255), write_only=True, required=False)
 
     class Meta:
         model = Recipe
-        fields = ('id', 'title', 'ingredients', 'tags', 'time_minutes', 'price', 'link')
-        read_only_fields = ('id',)
+        fields = ('id', 'title', 'ingredients', 'tags', 'time_minutes', 'price', 'link', 'version',
+                  'ingredient_names', 'tag_names')
+        read_only_fields = ('id', 'version')
+
+    def _resolve_names(self, validated_data, user):
+        """
+        Fold tag_names and ingredient_names into the tags and ingredients lists. A partial update sending names
+        without ids adds to the recipe's current links rather than replacing them
+        """
+        for field, model in (('tags', Tag), ('ingredients', Ingredient)):
+            names = validated_data.pop(field[:-1] + '_names', None)
+            if names is None:
+                continue
+            resolved = model.objects.get_or_create_by_names(user, names)
+            if field in validated_data or not self.partial:
+                existing = list(validated_data.get(field, []))
+            else:
+                existing = list(getattr(self.instance, field).all())
+            validated_data[field] = existing + [obj for obj in resolved if obj not in existing]
+
+    def create(self, validated_data):
+        """Create a recipe, creating any named tags and ingredients in the same transaction"""
+        with transaction.atomic():
+            self._resolve_names(validated_data, validated_data['user'])
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        """Update a recipe, creating any named tags and ingredients in the same transaction"""
+        with transaction.atomic():
+            self._resolve_names(validated_data, instance.user)
+            return super().update(instance, validated_data)
 
 
 class RecipeDetailSerializer(RecipeSerializer):
@@ -46,3 +96,44 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+
+class SimilarRecipeSerializer(serializers.ModelSerializer):
+    """Serializer for a similar recipe and how alike it is, 1 when the tags and ingredients are the same"""
+    recipe = RecipeSerializer(source='similar', read_only=True)
+
+    class Meta:
+        model = SimilarRecipe
+        fields = ('score', 'recipe')
+
+
+class RecipeBulkDeleteSerializer(serializers.Serializer):
+    """Serializer for deleting many recipes at once"""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    all = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, attrs):
+        if not attrs['ids'] and not attrs['all']:
+            raise serializers.ValidationError('Give the recipe ids to delete or all=true')
+        return attrs
+
+
+class RecipeDuplicateSerializer(serializers.Serializer):
+    """Serializer for copying a recipe, optionally under a new title"""
+    title = serializers.CharField(max_length=255, required=False)
+
+
+class RecipeBulkDuplicateSerializer(serializers.Serializer):
+    """Serializer for copying many recipes at once"""
+    ids = serializers.ListField(child=serializers.IntegerField(), min_length=1,
+                                max_length=settings.DUPLICATE_MAX_RECIPES)
+
+
+class SyncSerializer(serializers.Serializer):
+    """Serializer for a page of delta sync changes"""
+    cursor = serializers.IntegerField()
+    has_more = serializers.BooleanField()
+    recipes = RecipeSerializer(many=True)
+    tags = TagSerializer(many=True)
+    ingredients = IngredientSerializer(many=True)
+    deleted = serializers.DictField(child=serializers.ListField(child=serializers.IntegerField()))
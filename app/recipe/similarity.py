@@ -0,0 +1,157 @@
+"""
+Recipes like this one.
+
+A recipe is treated as a sparse vector of features, its tags and ingredients, and two recipes are as alike as the
+Jaccard index of their feature sets. Comparing one recipe with a user's whole book on every request is too slow,
+so each recipe's SIMILAR_RECIPES_COUNT best matches are stored as SimilarRecipe rows.
+
+Scores come from an inverted index (feature -> recipes having it). Only recipes sharing a feature are compared, and
+counting a recipe's features over the posting lists gives its intersection with every other recipe in one pass,
+the sparse matrix product a NumPy/SciPy version would do, without the dependency.
+"""
+import heapq
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from core.models import Recipe, SimilarRecipe
+
+RELATIONS = ('tags', 'ingredients')
+
+
+def load_features(user_id, recipe_ids=None):
+    """recipe id -> set of its ('tags', id) and ('ingredients', id) features, for the user's recipes or recipe_ids"""
+    recipes = Recipe.objects.filter(user_id=user_id)
+    if recipe_ids is not None:
+        recipes = recipes.filter(id__in=recipe_ids)
+    vectors = {pk: set() for pk in recipes.values_list('id', flat=True)}
+    for relation in RELATIONS:
+        links = getattr(Recipe, relation).through.objects.filter(recipe__user_id=user_id)
+        if recipe_ids is not None:
+            links = links.filter(recipe_id__in=recipe_ids)
+        for recipe_id, feature in links.values_list('recipe_id', f'{relation[:-1]}_id'):
+            vectors[recipe_id].add((relation, feature))
+    return vectors
+
+
+def inverted_index(vectors):
+    """feature -> ids of the recipes having it"""
+    postings = defaultdict(list)
+    for pk, features in vectors.items():
+        for feature in features:
+            postings[feature].append(pk)
+    return postings
+
+
+def scores(features, vectors, postings, exclude=None):
+    """other recipe id -> Jaccard index with features, for every recipe sharing at least one of them"""
+    shared = Counter()
+    for feature in features:
+        shared.update(postings.get(feature, ()))
+    shared.pop(exclude, None)
+    return {other: overlap / (len(features) + len(vectors[other]) - overlap) for other, overlap in shared.items()}
+
+
+def best(scored, count, min_score):
+    """The count highest (score, id) pairs of an id -> score dict at or above min_score, best first"""
+    return heapq.nlargest(count, ((score, pk) for pk, score in scored.items() if score >= min_score))
+
+
+def rebuild(user_id):
+    """Recompute the neighbours of every recipe the user has. Returns the number of rows stored"""
+    vectors = load_features(user_id)
+    postings = inverted_index(vectors)
+    rows = [SimilarRecipe(recipe_id=pk, similar_id=other, score=score)
+            for pk, features in vectors.items()
+            for score, other in best(scores(features, vectors, postings, exclude=pk),
+                                     settings.SIMILAR_RECIPES_COUNT, settings.SIMILAR_RECIPES_MIN_SCORE)]
+    with transaction.atomic():
+        SimilarRecipe.objects.filter(recipe__user_id=user_id).delete()
+        SimilarRecipe.objects.bulk_create(rows)
+    return len(rows)
+
+
+def refresh(recipe_id):
+    """
+    Bring the index up to date after one recipe's tags or ingredients changed: recompute its own neighbours and
+    move it into or out of the lists of the recipes it shares features with. Those lists are patched, not
+    recomputed, so one that loses the recipe is a match short until the next rebuild
+    """
+    count, min_score = settings.SIMILAR_RECIPES_COUNT, settings.SIMILAR_RECIPES_MIN_SCORE
+    with transaction.atomic():
+        # locking the recipe keeps two refreshes of it from inserting the same rows
+        user_id = Recipe.objects.select_for_update().filter(id=recipe_id).values_list('user_id', flat=True).first()
+        if user_id is None:
+            return  # deleted since the refresh was queued, its rows went with it
+        features = load_features(user_id, [recipe_id])[recipe_id]
+        candidates = set()
+        for relation in RELATIONS:
+            field = f'{relation[:-1]}_id'
+            linked_ids = [pk for kind, pk in features if kind == relation]
+            candidates.update(getattr(Recipe, relation).through.objects
+                              .filter(recipe__user_id=user_id, **{f'{field}__in': linked_ids})
+                              .values_list('recipe_id', flat=True))
+        candidates.discard(recipe_id)
+        vectors = load_features(user_id, candidates)
+        scored = scores(features, vectors, inverted_index(vectors))
+
+        current = defaultdict(list)  # candidate -> its stored (score, similar id, row id) other than this recipe
+        for row in (SimilarRecipe.objects.filter(recipe_id__in=[pk for pk, score in scored.items()
+                                                                if score >= min_score])
+                    .exclude(similar_id=recipe_id).values_list('recipe_id', 'score', 'similar_id', 'id')):
+            current[row[0]].append(row[1:])
+        rows, evicted = [], []
+        for other, score in scored.items():
+            if score < min_score:
+                continue
+            held = current[other]
+            if len(held) >= count:
+                floor = min(held)
+                if (score, recipe_id) < floor[:2]:
+                    continue
+                evicted.append(floor[2])
+            rows.append(SimilarRecipe(recipe_id=other, similar_id=recipe_id, score=score))
+        rows.extend(SimilarRecipe(recipe_id=recipe_id, similar_id=other, score=score)
+                    for score, other in best(scored, count, min_score))
+
+        SimilarRecipe.objects.filter(recipe_id=recipe_id).delete()
+        SimilarRecipe.objects.filter(similar_id=recipe_id).delete()
+        SimilarRecipe.objects.filter(id__in=evicted).delete()
+        SimilarRecipe.objects.bulk_create(rows)
+
+
+class PendingRefresh:
+    """on_commit callback queueing one refresh job for every recipe whose links changed in the transaction"""
+
+    def __init__(self, recipe_ids):
+        self.recipe_ids = set(recipe_ids)
+
+    def __call__(self):
+        from recipe.tasks import refresh_similar_recipes  # recipe.tasks imports this module
+        refresh_similar_recipes.delay(*sorted(self.recipe_ids))
+
+
+def queue_refresh(recipe_ids):
+    """Refresh recipe_ids once the current transaction commits, with one job however often it is called"""
+    connection = transaction.get_connection()
+    # Django drops the callback if the transaction rolls back, so an aborted write never finds a stale one
+    pending = next((func for sids, func in connection.run_on_commit if isinstance(func, PendingRefresh)), None)
+    if pending is not None:
+        pending.recipe_ids.update(recipe_ids)
+    elif recipe_ids:
+        transaction.on_commit(PendingRefresh(recipe_ids))  # runs straight away outside a transaction
+
+
+def recipe_links_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """m2m_changed receiver: refresh every recipe whose tags or ingredients changed, once the write commits"""
+    if action not in ('post_add', 'post_remove', 'pre_clear' if reverse else 'post_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'pre_clear':  # pk_set isn't given for a clear, find the recipes before their links go
+        recipe_ids = list(Recipe.objects.filter(**{f'{type(instance)._meta.model_name}s': instance})
+                          .values_list('id', flat=True))
+    else:
+        recipe_ids = pk_set
+    queue_refresh(recipe_ids)
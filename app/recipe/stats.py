@@ -0,0 +1,90 @@
+"""Recipe statistics computed in the database: three aggregate queries however many recipes there are"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Avg, CharField, Count, Max, Min, Q, Value
+
+from core.models import Recipe
+
+CENT = Decimal('0.01')
+
+
+def _buckets(field, bounds):
+    """Conditional counts for the ranges (0, b1], (b1, b2] ... (bn, inf) keyed f'{field}_{index}'"""
+    edges = [None] + list(bounds) + [None]
+    counts = {}
+    for index, (low, high) in enumerate(zip(edges, edges[1:])):
+        condition = Q()
+        if low is not None:
+            condition &= Q(**{f'{field}__gt': low})
+        if high is not None:
+            condition &= Q(**{f'{field}__lte': high})
+        counts[f'{field}_{index}'] = Count('id', filter=condition)
+    return counts
+
+
+def _histogram(totals, field, bounds):
+    edges = [None] + list(bounds) + [None]
+    return [{'above': low, 'up_to': high, 'count': totals[f'{field}_{index}']}
+            for index, (low, high) in enumerate(zip(edges, edges[1:]))]
+
+
+def _money(value):
+    return None if value is None else str(Decimal(value).quantize(CENT))
+
+
+def _usage(recipe_ids, relation):
+    """(relation, id, name, recipes) for each tag or ingredient used by the recipes, grouped in the database"""
+    through = getattr(Recipe, relation).through
+    column = relation[:-1]  # tag / ingredient
+    return (through.objects.filter(recipe__in=recipe_ids)
+            .annotate(relation=Value(relation, output_field=CharField()))
+            .values_list('relation', f'{column}_id', f'{column}__name')
+            .annotate(count=Count('recipe_id')))
+
+
+def _top(recipe_ids, relation, limit):
+    """The relation's (tags or ingredients) most used rows among the recipes"""
+    return [{'id': pk, 'name': name, 'recipes': count} for _, pk, name, count in (
+            _usage(recipe_ids, relation).order_by('-count', f'{relation[:-1]}__name')[:limit])]
+
+
+def facet_counts(queryset, relations, limit):
+    """
+    For each relation (tags, ingredients) the number of queryset's recipes carrying each of its values, most
+    used first. Every relation is grouped in one UNION ALL query
+    """
+    recipe_ids = queryset.order_by().values('id').distinct()
+    parts = [_usage(recipe_ids, relation).order_by() for relation in relations]
+    facets = {relation: [] for relation in relations}
+    for relation, pk, name, count in parts[0].union(*parts[1:], all=True):
+        facets[relation].append({'id': pk, 'name': name, 'recipes': count})
+    for values in facets.values():
+        values.sort(key=lambda value: (-value['recipes'], value['name']))
+        del values[limit:]
+    return facets
+
+
+def recipe_stats(queryset):
+    """Counts, ranges, histograms and most used tags and ingredients for the recipes in queryset"""
+    # filters joining tags or ingredients can repeat a recipe, so aggregate over the distinct ids
+    recipes = Recipe.objects.filter(id__in=queryset.order_by().values('id'))
+    totals = recipes.aggregate(
+            count=Count('id'),
+            price_min=Min('price'), price_max=Max('price'), price_avg=Avg('price'),
+            time_min=Min('time_minutes'), time_max=Max('time_minutes'), time_avg=Avg('time_minutes'),
+            **_buckets('time_minutes', settings.STATS_TIME_BUCKETS),
+            **_buckets('price', settings.STATS_PRICE_BUCKETS),
+    )
+    ids = recipes.values('id')
+    return {
+            'count':           totals['count'],
+            'price':           {'min': _money(totals['price_min']), 'max': _money(totals['price_max']),
+                                'avg': _money(totals['price_avg'])},
+            'time_minutes':    {'min': totals['time_min'], 'max': totals['time_max'],
+                                'avg': None if totals['time_avg'] is None else round(totals['time_avg'], 1)},
+            'time_histogram':  _histogram(totals, 'time_minutes', settings.STATS_TIME_BUCKETS),
+            'price_histogram': _histogram(totals, 'price', settings.STATS_PRICE_BUCKETS),
+            'top_tags':        _top(ids, 'tags', settings.STATS_TOP_COUNT),
+            'top_ingredients': _top(ids, 'ingredients', settings.STATS_TOP_COUNT),
+    }
@@ -0,0 +1,16 @@
+"""Background jobs for recipes, run by `manage.py run_worker`"""
+from jobs.queue import task
+from recipe import documents, similarity
+
+
+@task(queue='low')
+def refresh_similar_recipes(*recipe_ids):
+    """Update the similar recipes index after these recipes' tags or ingredients changed"""
+    for recipe_id in recipe_ids:
+        similarity.refresh(recipe_id)
+
+
+@task(queue='low')
+def refresh_recipe_documents(user_id):
+    """Render the user's stale recipe documents, after a rename touched too many to do in the request"""
+    documents.refresh_stale(user_id)
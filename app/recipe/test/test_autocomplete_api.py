@@ -0,0 +1,65 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Tag, Ingredient, Recipe
+from recipe import typeahead
+
+TAG_AUTOCOMPLETE_URL = reverse('recipe:tag-autocomplete')
+INGREDIENT_AUTOCOMPLETE_URL = reverse('recipe:ingredient-autocomplete')
+
+
+class AutocompleteApiTests(TestCase):
+    """Test tag and ingredient name autocomplete"""
+
+    def setUp(self):
+        typeahead.cache.clear()
+        self.user = get_user_model().objects.create_user('typeahead@test.com', 'testPass')
+        self.client = APIClient()
+        for name in ('Salt', 'salsa', 'Sage', 'Sugar', 'Éclair'):
+            Ingredient.objects.create(user=self.user, name=name)
+        recipe = Recipe.objects.create(user=self.user, title='Dip', time_minutes=5, price=1)
+        recipe.ingredients.add(Ingredient.objects.get(name='salsa'))
+        Ingredient.objects.create(user=get_user_model().objects.create_user('other@test.com', 'pass'), name='Saffron')
+
+    def complete(self, url, **params):
+        # token authentication loads the user, and its change number, afresh on every request
+        self.client.force_authenticate(get_user_model().objects.get(id=self.user.id))
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['name'] for row in response.data]
+
+    def test_prefix_ranked_by_usage(self):
+        """Test matches ignore case and come most used first, then by name"""
+        self.assertEqual(self.complete(INGREDIENT_AUTOCOMPLETE_URL, q='SA'), ['salsa', 'Sage', 'Salt'])
+        self.assertEqual(self.complete(INGREDIENT_AUTOCOMPLETE_URL, q='sal'), ['salsa', 'Salt'])
+        self.assertEqual(self.complete(INGREDIENT_AUTOCOMPLETE_URL, q='éc'), ['Éclair'])
+
+    def test_limit(self):
+        """Test at most limit matches are returned"""
+        self.assertEqual(self.complete(INGREDIENT_AUTOCOMPLETE_URL, q='s', limit=2), ['salsa', 'Sage'])
+
+    def test_new_names_seen(self):
+        """Test a name created after an earlier search is found by the next one"""
+        self.complete(TAG_AUTOCOMPLETE_URL, q='v')
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        self.assertEqual(self.complete(TAG_AUTOCOMPLETE_URL, q='v'), ['Vegan'])
+
+    def test_usage_changes_seen(self):
+        """Test ranking follows recipes being tagged after an earlier search"""
+        self.complete(INGREDIENT_AUTOCOMPLETE_URL, q='sa')
+        recipe = Recipe.objects.create(user=self.user, title='Roast', time_minutes=60, price=5)
+        recipe.ingredients.add(Ingredient.objects.get(name='Salt'))
+        Recipe.objects.create(user=self.user, title='Chips', time_minutes=20, price=2).ingredients.add(
+                Ingredient.objects.get(name='Salt'))
+
+        self.assertEqual(self.complete(INGREDIENT_AUTOCOMPLETE_URL, q='sa')[0], 'Salt')
+
+    def test_query_required(self):
+        """Test an empty query is a bad request"""
+        self.client.force_authenticate(self.user)
+        response = self.client.get(TAG_AUTOCOMPLETE_URL, {'q': ' '})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,98 @@
+import gzip
+import json
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag, Ingredient
+from recipe.serializers import RecipeSerializer
+
+RECIPE_URL = reverse('recipe:recipe-list')
+TAG_URL = reverse('recipe:tag-list')
+
+
+def rows(document):
+    """Rebuild per row dicts from a columnar document"""
+    names = [column['name'] for column in document['schema']]
+    return [dict(zip(names, values)) for values in zip(*document['columns'])]
+
+
+class ColumnarListTests(TestCase):
+    """Test the columnar list format"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('columns@test.com', 'testPass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        kale = Ingredient.objects.create(user=self.user, name='Kale')
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        soup = Recipe.objects.create(user=self.user, title='Soup', time_minutes=10, price='2.50')
+        soup.tags.add(vegan)
+        soup.ingredients.add(kale, salt)
+        Recipe.objects.create(user=self.user, title='Toast', time_minutes=2, price='1.00', link='https://t.st')
+
+    def test_same_data_as_regular_format(self):
+        """Test the columns hold exactly what the regular list returns"""
+        regular = self.client.get(RECIPE_URL).json()
+        response = self.client.get(RECIPE_URL, {'format': 'columnar'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.recipe.columnar+json')
+        document = response.json()
+        self.assertEqual(document['count'], 2)
+        self.assertEqual([column['name'] for column in document['schema']],
+                         ['id', 'title', 'ingredients', 'tags', 'time_minutes', 'price', 'link', 'version'])
+        self.assertEqual(rows(document), regular)
+
+    def test_schema_types(self):
+        """Test each column is typed by its model field, subclasses like PositiveIntegerField included"""
+        document = self.client.get(RECIPE_URL, {'format': 'columnar'}).json()
+
+        self.assertEqual({column['name']: column['type'] for column in document['schema']}, {
+                'id': 'integer', 'title': 'string', 'ingredients': 'integer[]', 'tags': 'integer[]',
+                'time_minutes': 'integer', 'price': 'decimal', 'link': 'string', 'version': 'integer'})
+
+    def test_accept_header(self):
+        """Test the format can be negotiated with Accept"""
+        response = self.client.get(TAG_URL, HTTP_ACCEPT='application/vnd.recipe.columnar+json')
+
+        self.assertEqual(response.json()['columns'], [[Tag.objects.get().id], ['Vegan']])
+
+    def test_filters_apply(self):
+        """Test list filters still apply in the columnar format"""
+        tag = Tag.objects.get()
+        document = self.client.get(RECIPE_URL, {'format': 'columnar', 'tags': tag.id}).json()
+
+        self.assertEqual(document['columns'][1], ['Soup'])
+
+    def test_query_count(self):
+        """Test recipes are listed with one query per column source, however many rows"""
+        for i in range(20):
+            Recipe.objects.create(user=self.user, title=f'Recipe {i}', time_minutes=1, price='1.00')
+
+        with self.assertNumQueries(3):  # rows, tag links, ingredient links
+            self.client.get(RECIPE_URL, {'format': 'columnar'})
+
+    def test_detail_not_columnar(self):
+        """Test only list endpoints offer the format"""
+        recipe = Recipe.objects.first()
+        response = self.client.get(reverse('recipe:recipe-detail', args=[recipe.id]), {'format': 'columnar'})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(LIST_GZIP_MIN_BYTES=100)
+    def test_large_lists_gzipped(self):
+        """Test list bodies over the threshold are gzipped when the client accepts it"""
+        response = self.client.get(RECIPE_URL, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)),
+                         RecipeSerializer(Recipe.objects.filter(user=self.user).order_by('-id'), many=True).data)
+
+    def test_small_lists_not_gzipped(self):
+        """Test small bodies and clients without gzip get plain responses"""
+        self.assertFalse(self.client.get(TAG_URL, HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+        with override_settings(LIST_GZIP_MIN_BYTES=1):
+            self.assertFalse(self.client.get(TAG_URL).has_header('Content-Encoding'))
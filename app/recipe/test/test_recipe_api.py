@@ -2,14 +2,17 @@ import tempfile
 import os
 from PIL import Image
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APIClient
 from core.models import Recipe, Tag, Ingredient
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
 RECIPE_URL = reverse('recipe:recipe-list')
+BULK_DELETE_URL = reverse('recipe:recipe-bulk-delete')
 
 
 def image_upload_url(recipe_id):
@@ -148,6 +151,74 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(ingredient1, ingredients)
         self.assertIn(ingredient2, ingredients)
 
+    def test_create_recipe_with_tag_and_ingredient_names(self):
+        """Test named tags and ingredients are reused or created in the same request"""
+        existing = sample_tag(user=self.user, name='Dessert')
+        other_user_tag = sample_tag(user=create_user(email='bob@mail.com'), name='Vegan')
+        payload = {
+                'title':            'Lemon tart',
+                'tag_names':        ['dessert', 'Vegan'],
+                'ingredient_names': ['Lemon', 'Sugar', 'lemon'],
+                'time_minutes':     40,
+                'price':            6.00
+        }
+        response = self.client.post(RECIPE_URL, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        tags = recipe.tags.all()
+        self.assertEqual(tags.count(), 2)
+        self.assertIn(existing, tags)
+        self.assertNotIn(other_user_tag, tags)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(sorted(i.name for i in recipe.ingredients.all()), ['Lemon', 'Sugar'])
+
+    def test_partial_update_recipe_with_tag_names(self):
+        """Test tag names are combined with tag ids on update"""
+        recipe = sample_recipe(user=self.user)
+        tag = sample_tag(user=self.user, name='curry')
+        payload = {'tags': [tag.id], 'tag_names': ['Spicy']}
+        self.client.patch(detail_url(recipe.id), payload, format='json')
+        self.assertEqual(sorted(t.name for t in recipe.tags.all()), ['Spicy', 'curry'])
+
+    def test_partial_update_names_keep_existing_links(self):
+        """Test names sent without ids on a partial update are added to the recipe's tags and ingredients"""
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(user=self.user, name='curry'))
+        recipe.ingredients.add(sample_ingredient(user=self.user, name='Rice'))
+        payload = {'tag_names': ['Spicy'], 'ingredient_names': ['Chilli']}
+        self.client.patch(detail_url(recipe.id), payload, format='json')
+        self.assertEqual(sorted(t.name for t in recipe.tags.all()), ['Spicy', 'curry'])
+        self.assertEqual(sorted(i.name for i in recipe.ingredients.all()), ['Chilli', 'Rice'])
+
+    def test_bulk_delete_recipes(self):
+        """Test deleting several recipes at once only touches the user's own"""
+        recipe1 = sample_recipe(user=self.user)
+        recipe1.tags.add(sample_tag(user=self.user))
+        recipe2 = sample_recipe(user=self.user)
+        keep = sample_recipe(user=self.user)
+        other = sample_recipe(user=create_user(email='bob@mail.com'))
+        payload = {'ids': [recipe1.id, recipe2.id, other.id]}
+        response = self.client.post(BULK_DELETE_URL, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['deleted'], 2)
+        self.assertEqual(set(Recipe.objects.values_list('id', flat=True)), {keep.id, other.id})
+        self.assertFalse(Recipe.tags.through.objects.exists())
+
+    @override_settings(DELETION_BATCH_SIZE=1, BACKGROUND_TASKS_INLINE=True)
+    def test_bulk_delete_all_recipes_in_background(self):
+        """Test deleting more than a batch is handed to the background"""
+        sample_recipe(user=self.user)
+        sample_recipe(user=self.user)
+        response = self.client.post(BULK_DELETE_URL, {'all': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['scheduled'], 2)
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+    def test_bulk_delete_requires_ids(self):
+        """Test an empty bulk delete is rejected"""
+        response = self.client.post(BULK_DELETE_URL, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_partial_update_recipe(self):
         """Test updating a recipe with patch"""
         recipe = sample_recipe(user=self.user)
@@ -176,6 +247,102 @@ class PrivateRecipeApiTests(TestCase):
         tags = recipe.tags.all()
         self.assertEqual(len(tags), 0)
 
+    def test_filter_recipes_by_time_and_price(self):
+        """Test range filters on cooking time and price, combined with a tag filter"""
+        quick_cheap = sample_recipe(user=self.user, title='Toast', time_minutes=5, price=2)
+        sample_recipe(user=self.user, title='Roast', time_minutes=120, price=8)
+        sample_recipe(user=self.user, title='Lobster', time_minutes=20, price=60)
+        tag = sample_tag(user=self.user)
+        quick_cheap.tags.add(tag)
+
+        def titles(params):
+            return [recipe['title'] for recipe in self.client.get(RECIPE_URL, params).data]
+
+        self.assertEqual(titles({'max_time': 30, 'max_price': '10.00'}), ['Toast'])
+        self.assertEqual(titles({'min_price': '5', 'ordering': 'price'}), ['Roast', 'Lobster'])
+        self.assertEqual(titles({'max_time': 30, 'tags': tag.id}), ['Toast'])
+
+    def test_ordering(self):
+        """Test ordering by time and price, ties broken by id so the order is stable"""
+        first = sample_recipe(user=self.user, title='A', time_minutes=30, price=3)
+        second = sample_recipe(user=self.user, title='B', time_minutes=10, price=3)
+        third = sample_recipe(user=self.user, title='C', time_minutes=20, price=1)
+
+        def ids(ordering):
+            return [recipe['id'] for recipe in self.client.get(RECIPE_URL, {'ordering': ordering}).data]
+
+        self.assertEqual(ids('time_minutes'), [second.id, third.id, first.id])
+        self.assertEqual(ids('-time_minutes'), [first.id, third.id, second.id])
+        self.assertEqual(ids('price'), [third.id, first.id, second.id])
+        self.assertEqual(ids('-price'), [second.id, first.id, third.id])
+        self.assertEqual(ids('id'), [first.id, second.id, third.id])
+
+    def test_invalid_range_filters(self):
+        """Test malformed ranges and unknown orderings are a bad request"""
+        for params in ({'max_time': 'soon'}, {'max_time': '-1'}, {'min_price': 'cheap'}, {'max_price': 'NaN'},
+                       {'max_price': 'Infinity'}, {'max_time': '99999999999999999999'}, {'max_time': 2 ** 31},
+                       {'min_price': '1000'}, {'max_price': '999.999'}, {'ordering': 'title'}, {'ordering': '-user'}):
+            with self.subTest(params=params):
+                response = self.client.get(RECIPE_URL, params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_range_filters_at_column_limits(self):
+        """Test the largest values the columns hold are accepted"""
+        sample_recipe(user=self.user)
+
+        response = self.client.get(RECIPE_URL, {'max_time': 2 ** 31 - 1, 'min_price': '0', 'max_price': '999.99'})
+
+        self.assertEqual(len(response.data), 1)
+
+    def test_ordering_ignored_outside_list(self):
+        """Test ?ordering= only applies to the list, a bad value doesn't break reads and writes of one recipe"""
+        recipe = sample_recipe(user=self.user)
+
+        self.assertEqual(self.client.get(detail_url(recipe.id), {'ordering': 'title'}).status_code,
+                         status.HTTP_200_OK)
+        response = self.client.patch(f'{detail_url(recipe.id)}?ordering=title', {'title': 'Renamed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_facets(self):
+        """Test ?facets= adds per tag and ingredient counts over the filtered recipes"""
+        vegan = sample_tag(user=self.user, name='Vegan')
+        quick = sample_tag(user=self.user, name='Quick')
+        salt = sample_ingredient(user=self.user, name='Salt')
+        toast = sample_recipe(user=self.user, title='Toast', time_minutes=5)
+        soup = sample_recipe(user=self.user, title='Soup', time_minutes=40)
+        sample_recipe(user=self.user, title='Stew', time_minutes=90).tags.add(quick)
+        toast.tags.add(vegan, quick)
+        toast.ingredients.add(salt)
+        soup.tags.add(vegan)
+
+        response = self.client.get(RECIPE_URL, {'tags': vegan.id, 'facets': 'tags,ingredients'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['title'] for recipe in response.data['results']], ['Soup', 'Toast'])
+        self.assertEqual(response.data['facets'], {
+                'tags':        [{'id': vegan.id, 'name': 'Vegan', 'recipes': 2},
+                                {'id': quick.id, 'name': 'Quick', 'recipes': 1}],
+                'ingredients': [{'id': salt.id, 'name': 'Salt', 'recipes': 1}],
+        })
+
+    def test_facets_one_query(self):
+        """Test the facets cost one query on top of the list however many values there are"""
+        for i in range(5):
+            recipe = sample_recipe(user=self.user, title=f'Recipe {i}')
+            recipe.tags.add(sample_tag(user=self.user, name=f'Tag {i}'))
+            recipe.ingredients.add(sample_ingredient(user=self.user, name=f'Ingredient {i}'))
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get(RECIPE_URL)
+        with CaptureQueriesContext(connection) as faceted:
+            self.client.get(RECIPE_URL, {'facets': 'tags,ingredients'})
+
+        self.assertEqual(len(faceted), len(plain) + 1)
+
+    def test_invalid_facets(self):
+        """Test unknown facets are a bad request"""
+        response = self.client.get(RECIPE_URL, {'facets': 'tags,users'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class RecipeImageUploadTests(TestCase):
 
@@ -243,3 +410,14 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn(serializer1.data, response.data)
         self.assertIn(serializer2.data, response.data)
         self.assertNotIn(serializer3.data, response.data)
+
+    @override_settings(MAX_FILTER_IDS=3)
+    def test_filter_too_many_ids(self):
+        """Test filters with more ids than allowed are rejected"""
+        response = self.client.get(RECIPE_URL, {'tags': '1,2,3,4'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_invalid_ids(self):
+        """Test non integer filter ids are a bad request"""
+        response = self.client.get(RECIPE_URL, {'ingredients': '1,salt'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,146 @@
+import json
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.deletion import delete_rows
+from core.models import Recipe, Tag, Ingredient
+from recipe import documents
+from recipe.serializers import RecipeDetailSerializer
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def sample_recipe(user, **kwargs):
+    """Helper function to create a sample recipe"""
+    defaults = {
+            'title':        'Sample Recipe',
+            'time_minutes': 10,
+            'price':        5.0
+    }
+    defaults.update(kwargs)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeDocumentTests(TestCase):
+    """Test recipe detail responses come from the stored document and it keeps up with writes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('document@test.com', 'testPass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(self.user, title='Curry')
+        self.spicy = Tag.objects.create(user=self.user, name='Spicy')
+        self.rice = Ingredient.objects.create(user=self.user, name='Rice')
+        self.recipe.tags.add(self.spicy)
+        self.recipe.ingredients.add(self.rice)
+
+    def detail(self, recipe=None):
+        """The decoded detail response body"""
+        response = self.client.get(detail_url((recipe or self.recipe).id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)
+
+    def expected(self, recipe=None):
+        recipe = Recipe.objects.get(id=(recipe or self.recipe).id)
+        return json.loads(json.dumps(RecipeDetailSerializer(recipe).data))
+
+    def test_retrieve_is_one_read(self):
+        """Test the detail endpoint sends the stored document with a single query"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(detail_url(self.recipe.id))
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), self.expected())
+        self.assertEqual(response.content.decode(), Recipe.objects.get(id=self.recipe.id).document)
+
+    def test_follows_updates(self):
+        """Test editing fields and links through the API shows in the document"""
+        egg = Ingredient.objects.create(user=self.user, name='Egg')
+        self.client.patch(detail_url(self.recipe.id), {'title': 'Egg fried rice', 'ingredients': [self.rice.id, egg.id],
+                                                       'tags': []}, format='json')
+
+        document = self.detail()
+        self.assertEqual(document['title'], 'Egg fried rice')
+        self.assertEqual(document['tags'], [])
+        self.assertEqual(sorted(item['name'] for item in document['ingredients']), ['Egg', 'Rice'])
+
+    def test_rendered_once_per_write(self):
+        """Test an API write renders the document once, however many links it sets"""
+        egg = Ingredient.objects.create(user=self.user, name='Egg')
+        payload = {'title': 'Egg fried rice', 'time_minutes': 5, 'price': '3.00', 'tags': [],
+                   'ingredients': [self.rice.id, egg.id]}
+
+        with patch('recipe.documents.render', wraps=documents.render) as render:
+            self.client.post(reverse('recipe:recipe-list'), payload, format='json')
+            self.client.patch(detail_url(self.recipe.id), payload, format='json')
+
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(self.detail(), self.expected())
+
+    def test_rename_fans_out(self):
+        """Test renaming a tag re-renders every recipe carrying it"""
+        other = sample_recipe(self.user, title='Chilli')
+        other.tags.add(self.spicy)
+
+        self.spicy.name = 'Hot'
+        self.spicy.save()
+
+        for recipe in (self.recipe, other):
+            self.assertEqual(self.detail(recipe)['tags'], [{'id': self.spicy.id, 'name': 'Hot'}])
+
+    @override_settings(RECIPE_DOCUMENT_FANOUT_LIMIT=1)
+    def test_large_rename_left_to_job(self):
+        """Test a rename touching more recipes than the limit still reaches them all through the job"""
+        others = [sample_recipe(self.user, title=f'Dish {i}') for i in range(3)]
+        self.rice.recipe_set.add(*others)
+
+        self.rice.name = 'Basmati'
+        self.rice.save()
+
+        for recipe in [self.recipe] + others:
+            self.assertEqual(self.detail(recipe)['ingredients'], [{'id': self.rice.id, 'name': 'Basmati'}])
+
+    def test_stale_document_rendered_on_read(self):
+        """Test deleting a tag, which bypasses the signals, leaves a document that is rebuilt when read"""
+        delete_rows(Tag.objects.filter(id=self.spicy.id))
+
+        self.assertEqual(Recipe.objects.get(id=self.recipe.id).document, '')
+        self.assertEqual(self.detail(), self.expected())
+        self.assertNotEqual(Recipe.objects.get(id=self.recipe.id).document, '')
+
+    def test_read_repair_keeps_newer_write(self):
+        """Test rendering a stale document on read never replaces one a write stored in the meantime"""
+        Recipe.objects.filter(id=self.recipe.id).update(document='')
+        render = documents.render
+
+        def render_while_written(recipe):
+            Recipe.objects.filter(id=recipe.id).update(document='{"written": true}')  # a write commits mid render
+            return render(recipe)
+
+        with patch('recipe.documents.render', side_effect=render_while_written):
+            self.assertEqual(self.detail(), self.expected())
+        self.assertEqual(Recipe.objects.get(id=self.recipe.id).document, '{"written": true}')
+
+    def test_other_users_recipe(self):
+        """Test another user's recipe is not found"""
+        recipe = sample_recipe(get_user_model().objects.create_user('other@test.com', 'testPass'))
+
+        response = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_browsable_api(self):
+        """Test other renderers still get the decoded document"""
+        response = self.client.get(detail_url(self.recipe.id), {'format': 'api'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'Curry', response.content)
@@ -0,0 +1,101 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag, Ingredient, SimilarRecipe
+
+BULK_DUPLICATE_URL = reverse('recipe:recipe-bulk-duplicate')
+
+
+def duplicate_url(recipe_id):
+    return reverse('recipe:recipe-duplicate', args=[recipe_id])
+
+
+def sample_recipe(user, **kwargs):
+    """Helper function to create a sample recipe"""
+    defaults = {
+            'title':        'Sample Recipe',
+            'time_minutes': 10,
+            'price':        5.0
+    }
+    defaults.update(kwargs)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeDuplicateApiTests(TestCase):
+    """Test copying recipes on the server"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('duplicate@test.com', 'testPass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(self.user, title='Curry', time_minutes=45, price='7.50', link='https://x.test')
+        self.recipe.tags.add(Tag.objects.create(user=self.user, name='Spicy'))
+        self.recipe.ingredients.add(*(Ingredient.objects.create(user=self.user, name=name)
+                                      for name in ('Rice', 'Chilli')))
+        Recipe.objects.filter(id=self.recipe.id).update(image='uploads/recipe/curry.jpg')
+
+    def assert_copy(self, copy_id, title='Curry'):
+        copy = Recipe.objects.get(id=copy_id)
+        self.assertNotEqual(copy.id, self.recipe.id)
+        self.assertEqual((copy.title, copy.time_minutes, str(copy.price), copy.link, copy.image.name),
+                         (title, 45, '7.50', 'https://x.test', 'uploads/recipe/curry.jpg'))
+        self.assertEqual(set(copy.tags.all()), set(self.recipe.tags.all()))
+        self.assertEqual(set(copy.ingredients.all()), set(self.recipe.ingredients.all()))
+        return copy
+
+    def test_duplicate(self):
+        """Test a copy gets the fields, links and image file of its source"""
+        response = self.client.post(duplicate_url(self.recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        copy = self.assert_copy(response.data['id'])
+        self.assertEqual(sorted(response.data['ingredients']), sorted(i.id for i in self.recipe.ingredients.all()))
+        self.assertGreater(copy.change_seq, self.recipe.change_seq)  # syncing clients learn about the copy
+
+    def test_duplicate_with_title(self):
+        """Test a copy can be renamed as it is made, and its stored detail document follows"""
+        response = self.client.post(duplicate_url(self.recipe.id), {'title': 'Mild curry'})
+
+        self.assert_copy(response.data['id'], title='Mild curry')
+        detail = self.client.get(reverse('recipe:recipe-detail', args=[response.data['id']]))
+        self.assertEqual(detail.data['title'], 'Mild curry')
+        self.assertEqual(len(detail.data['ingredients']), 2)
+
+    @override_settings(BACKGROUND_TASKS_INLINE=True)
+    def test_copy_is_most_similar(self):
+        """Test the similar recipes index learns about the copy"""
+        response = self.client.post(duplicate_url(self.recipe.id))
+
+        self.assertTrue(SimilarRecipe.objects.filter(recipe_id=response.data['id'], similar=self.recipe,
+                                                     score=1.0).exists())
+
+    def test_bulk_duplicate(self):
+        """Test many recipes are copied at once and other users' ids are skipped"""
+        plain = sample_recipe(self.user, title='Toast')
+        foreign = sample_recipe(get_user_model().objects.create_user('other@test.com', 'testPass'))
+
+        response = self.client.post(BULK_DUPLICATE_URL, {'ids': [self.recipe.id, plain.id, foreign.id]},
+                                    format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([row['source'] for row in response.data], [self.recipe.id, plain.id])
+        self.assert_copy(response.data[0]['id'])
+        self.assertEqual(Recipe.objects.get(id=response.data[1]['id']).title, 'Toast')
+        self.assertEqual(Recipe.objects.filter(user=foreign.user).count(), 1)
+
+    def test_bulk_duplicate_requires_ids(self):
+        """Test an empty id list is refused"""
+        response = self.client.post(BULK_DUPLICATE_URL, {'ids': []}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_other_users_recipe(self):
+        """Test another user's recipe can't be copied"""
+        recipe = sample_recipe(get_user_model().objects.create_user('other@test.com', 'testPass'))
+
+        response = self.client.post(duplicate_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Recipe.objects.count(), 2)
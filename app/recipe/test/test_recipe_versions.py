@@ -0,0 +1,112 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Ingredient, Recipe, VersionConflict
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def sample_recipe(user, **kwargs):
+    """Helper function to create a sample recipe"""
+    defaults = {
+            'title':        'Sample Recipe',
+            'time_minutes': 10,
+            'price':        5.0
+    }
+    defaults.update(kwargs)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeVersionTests(TestCase):
+    """Test optimistic concurrency control on recipe updates"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('version@test.com', 'testPass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(self.user, title='Stew')
+
+    def test_detail_etag(self):
+        """Test the detail response carries the version in the body and the ETag"""
+        response = self.client.get(detail_url(self.recipe.id))
+
+        self.assertEqual(response.data['version'], 1)
+        self.assertEqual(response['ETag'], '"1"')
+
+    def test_update_matching_version(self):
+        """Test an If-Match of the current version updates and moves the version on"""
+        etag = self.client.get(detail_url(self.recipe.id))['ETag']
+
+        response = self.client.patch(detail_url(self.recipe.id), {'title': 'Goulash'}, HTTP_IF_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 2)
+        self.assertEqual(response['ETag'], '"2"')
+        self.recipe.refresh_from_db()
+        self.assertEqual((self.recipe.title, self.recipe.version), ('Goulash', 2))
+
+    def test_stale_version_rejected(self):
+        """Test a write based on an old version is refused and changes nothing"""
+        self.client.patch(detail_url(self.recipe.id), {'title': 'Goulash'}, HTTP_IF_MATCH='"1"')
+
+        response = self.client.put(detail_url(self.recipe.id), {'title': 'Chilli', 'time_minutes': 20, 'price': '4.00'},
+                                   HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.recipe.refresh_from_db()
+        self.assertEqual((self.recipe.title, self.recipe.version), ('Goulash', 2))
+
+    def test_stale_version_rejected_before_validation(self):
+        """Test a stale If-Match is answered 412 even when the body would not validate"""
+        self.client.patch(detail_url(self.recipe.id), {'title': 'Goulash'})
+
+        response = self.client.put(detail_url(self.recipe.id), {'title': ''}, HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_link_changes_move_version_once(self):
+        """Test a write setting the recipe's tags and ingredients moves its version on by one"""
+        self.recipe.tags.create(user=self.user, name='Vegan')
+        self.recipe.ingredients.create(user=self.user, name='Beans')
+        rice = Ingredient.objects.create(user=self.user, name='Rice')
+        version = Recipe.objects.get(id=self.recipe.id).version
+
+        response = self.client.patch(detail_url(self.recipe.id), {'tags': [], 'ingredients': [rice.id]},
+                                     HTTP_IF_MATCH=f'"{version}"', format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], version + 1)
+        self.assertEqual(Recipe.objects.get(id=self.recipe.id).version, version + 1)
+
+    def test_touch_moves_version(self):
+        """Test recipes changed without save() get a new version, so an ETag read before is refused"""
+        Recipe.objects.filter(id=self.recipe.id).touch()
+
+        response = self.client.patch(detail_url(self.recipe.id), {'title': 'Goulash'}, HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Recipe.objects.get(id=self.recipe.id).version, 2)
+
+    def test_unconditional_updates(self):
+        """Test writes without If-Match, or with *, still go through and report the stored version"""
+        self.client.patch(detail_url(self.recipe.id), {'title': 'Goulash'})
+        response = self.client.patch(detail_url(self.recipe.id), {'title': 'Chilli'}, HTTP_IF_MATCH='*')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 3)
+        self.assertEqual(Recipe.objects.get(id=self.recipe.id).version, 3)
+
+    def test_conflict_after_read(self):
+        """Test the conditional UPDATE catches a write that landed after the editor read the row"""
+        editing = Recipe.objects.get(id=self.recipe.id)
+        Recipe.objects.get(id=self.recipe.id).save()  # another writer
+
+        editing.title = 'Goulash'
+        editing.expected_version = editing.version
+        with self.assertRaises(VersionConflict):
+            editing.save()
+        self.assertEqual(Recipe.objects.get(id=self.recipe.id).title, 'Stew')
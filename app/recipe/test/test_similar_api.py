@@ -0,0 +1,186 @@
+import json
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import catalog
+from core.deletion import delete_rows
+from core.models import Recipe, Tag, Ingredient, SimilarRecipe
+from jobs.models import Job
+from recipe import similarity
+from recipe.tasks import refresh_similar_recipes
+
+
+def similar_url(recipe_id):
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def sample_recipe(user, **kwargs):
+    """Helper function to create a sample recipe"""
+    defaults = {
+            'title':        'Sample Recipe',
+            'time_minutes': 10,
+            'price':        5.0
+    }
+    defaults.update(kwargs)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def stored(user):
+    """The user's similar recipe rows as {(recipe, similar): rounded score}"""
+    return {(row.recipe_id, row.similar_id): round(row.score, 6)
+            for row in SimilarRecipe.objects.filter(recipe__user=user)}
+
+
+@override_settings(BACKGROUND_TASKS_INLINE=True)
+class SimilarRecipeApiTests(TransactionTestCase):
+    """Test the similar recipes action and the index behind it, refreshed as link changes commit"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('similar@test.com', 'testPass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.salt, self.egg, self.flour, self.rice = (Ingredient.objects.create(user=self.user, name=name)
+                                                      for name in ('Salt', 'Egg', 'Flour', 'Rice'))
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.pancake = sample_recipe(self.user, title='Pancake')
+        self.crepe = sample_recipe(self.user, title='Crepe')
+        self.omelette = sample_recipe(self.user, title='Omelette')
+        self.risotto = sample_recipe(self.user, title='Risotto')
+        self.pancake.ingredients.add(self.salt, self.egg, self.flour)
+        self.crepe.ingredients.add(self.salt, self.egg, self.flour)
+        self.omelette.ingredients.add(self.salt, self.egg)
+        self.risotto.ingredients.add(self.rice)
+        self.risotto.tags.add(self.vegan)
+
+    def tearDown(self):
+        catalog.cache.clear()  # the flush between tests deletes catalog rows, which never happens otherwise
+
+    def test_similar_best_first(self):
+        """Test matches are ranked by the Jaccard index of the tag and ingredient sets"""
+        response = self.client.get(similar_url(self.pancake.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['recipe']['title'], row['score']) for row in response.data],
+                         [('Crepe', 1.0), ('Omelette', 2 / 3)])
+        self.assertEqual(sorted(response.data[0]['recipe']['ingredients']),
+                         sorted([self.salt.id, self.egg.id, self.flour.id]))
+
+    def test_nothing_in_common(self):
+        """Test a recipe sharing no tags or ingredients has no matches"""
+        response = self.client.get(similar_url(self.risotto.id))
+
+        self.assertEqual(response.data, [])
+
+    def test_refreshed_when_links_change(self):
+        """Test changing a recipe's ingredients updates its matches and the lists it appears in"""
+        self.omelette.ingredients.set([self.rice])
+        self.omelette.tags.add(self.vegan)
+
+        self.assertEqual([row['recipe']['title'] for row in self.client.get(similar_url(self.pancake.id)).data],
+                         ['Crepe'])
+        self.assertEqual([(row['recipe']['title'], row['score'])
+                          for row in self.client.get(similar_url(self.risotto.id)).data], [('Omelette', 1.0)])
+
+    def test_refresh_through_reverse_relation(self):
+        """Test adding recipes from the ingredient side refreshes them"""
+        self.rice.recipe_set.add(self.crepe)
+
+        self.assertEqual(stored(self.user)[(self.risotto.id, self.crepe.id)], round(1 / 5, 6))
+
+    @override_settings(BACKGROUND_TASKS_INLINE=False)
+    def test_one_job_per_write(self):
+        """Test an update changing tags and ingredients queues a single refresh"""
+        self.client.patch(detail_url(self.omelette.id), {'tags': [self.vegan.id], 'ingredients': [self.rice.id]},
+                          format='json')
+
+        jobs = Job.objects.filter(task=refresh_similar_recipes.name)
+        self.assertEqual([json.loads(job.arguments)['args'] for job in jobs], [[self.omelette.id]])
+
+    @override_settings(BACKGROUND_TASKS_INLINE=False)
+    def test_rolled_back_write_queues_nothing(self):
+        """Test links changed in a transaction that rolls back don't reach the next one's refresh"""
+        try:
+            with transaction.atomic():
+                self.omelette.tags.add(self.vegan)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        with transaction.atomic():
+            self.crepe.tags.add(self.vegan)
+            self.pancake.tags.add(self.vegan)
+
+        jobs = Job.objects.filter(task=refresh_similar_recipes.name)
+        self.assertEqual([json.loads(job.arguments)['args'] for job in jobs],
+                         [sorted([self.crepe.id, self.pancake.id])])
+
+    def test_incremental_matches_rebuild(self):
+        """Test the patched index agrees with one computed from scratch"""
+        self.crepe.ingredients.remove(self.flour)
+        self.pancake.tags.add(self.vegan)
+        patched = stored(self.user)
+
+        similarity.rebuild(self.user.id)
+
+        self.assertEqual(stored(self.user), patched)
+
+    @override_settings(SIMILAR_RECIPES_COUNT=1)
+    def test_full_list_keeps_best(self):
+        """Test a recipe only pushes out a match it beats once a list is full"""
+        similarity.rebuild(self.user.id)
+        waffle = sample_recipe(self.user, title='Waffle')
+        waffle.ingredients.add(self.salt, self.egg, self.flour)
+
+        rows = stored(self.user)
+        self.assertIn((self.omelette.id, waffle.id), rows)  # ties on score go to the newer recipe
+        self.assertNotIn((self.omelette.id, self.crepe.id), rows)
+        self.assertEqual(len([key for key in rows if key[0] == self.omelette.id]), 1)
+
+    def test_deleted_recipe_leaves_lists(self):
+        """Test deleting a recipe, one at a time or in bulk, removes it from other recipes' matches"""
+        self.crepe.delete()
+        delete_rows(Recipe.objects.filter(id=self.omelette.id))
+
+        self.assertEqual(self.client.get(similar_url(self.pancake.id)).data, [])
+        self.assertEqual(stored(self.user), {})
+
+    @override_settings(SIMILAR_RECIPES_COUNT=1)
+    def test_bulk_deletes_refresh_lists(self):
+        """Test deleting recipes and ingredients without signals still refreshes the lists of the recipes left"""
+        similarity.rebuild(self.user.id)
+        delete_rows(Recipe.objects.filter(id=self.crepe.id))
+        delete_rows(Ingredient.objects.filter(id=self.flour.id))
+        patched = stored(self.user)
+
+        similarity.rebuild(self.user.id)
+
+        self.assertEqual(stored(self.user), patched)
+        self.assertEqual(patched[(self.pancake.id, self.omelette.id)], 1.0)
+
+    def test_other_users_recipe(self):
+        """Test another user's recipe is not found"""
+        other = get_user_model().objects.create_user('other@test.com', 'testPass')
+        recipe = sample_recipe(other)
+
+        response = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rebuild_command(self):
+        """Test the command restores an index built behind the signals' back"""
+        expected = stored(self.user)
+        SimilarRecipe.objects.all().delete()
+
+        out = StringIO()
+        call_command('rebuild_similar_recipes', stdout=out)
+
+        self.assertIn('for 1 users', out.getvalue())
+        self.assertEqual(stored(self.user), expected)
@@ -0,0 +1,124 @@
+import hashlib
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag, Ingredient
+
+STATS_URL = reverse('recipe:recipe-stats')
+
+
+def sample_recipe(user, **kwargs):
+    """Helper function to create a sample recipe"""
+    defaults = {
+            'title':        'Sample Recipe',
+            'time_minutes': 10,
+            'price':        5.0
+    }
+    defaults.update(kwargs)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeStatsApiTests(TestCase):
+    """Test the recipe statistics action"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('stats@test.com', 'testPass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        quick = Tag.objects.create(user=self.user, name='Quick')
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        toast = sample_recipe(self.user, title='Toast', time_minutes=5, price='2.00')
+        soup = sample_recipe(self.user, title='Soup', time_minutes=40, price='6.50')
+        stew = sample_recipe(self.user, title='Stew', time_minutes=180, price='12.00')
+        toast.tags.add(vegan, quick)
+        soup.tags.add(vegan)
+        stew.ingredients.add(salt)
+        sample_recipe(get_user_model().objects.create_user('other@test.com', 'testPass'), price='99.00')
+
+    def stats(self, **params):
+        response = self.client.get(STATS_URL, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_stats(self):
+        """Test counts, ranges, histograms and top tags for the user's recipes only"""
+        data = self.stats()
+
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['price'], {'min': '2.00', 'max': '12.00', 'avg': '6.83'})
+        self.assertEqual(data['time_minutes'], {'min': 5, 'max': 180, 'avg': 75.0})
+        self.assertEqual([bucket['count'] for bucket in data['time_histogram']], [1, 0, 1, 0, 1])
+        self.assertEqual([bucket['count'] for bucket in data['price_histogram']], [1, 1, 1, 0, 0])
+        self.assertEqual([(tag['name'], tag['recipes']) for tag in data['top_tags']], [('Vegan', 2), ('Quick', 1)])
+        self.assertEqual([ingredient['name'] for ingredient in data['top_ingredients']], ['Salt'])
+
+    def test_filters_apply(self):
+        """Test stats cover only the recipes the list would return with the same filters"""
+        vegan = Tag.objects.get(name='Vegan')
+        quick = Tag.objects.get(name='Quick')
+
+        data = self.stats(tags=f'{vegan.id},{quick.id}', max_time=60)
+
+        self.assertEqual(data['count'], 2)  # Toast carries both tags but counts once
+        self.assertEqual(data['price']['max'], '6.50')
+
+    def test_empty(self):
+        """Test a user without recipes gets zeros and nulls"""
+        self.client.force_authenticate(get_user_model().objects.create_user('new@test.com', 'testPass'))
+
+        data = self.stats()
+
+        self.assertEqual(data['count'], 0)
+        self.assertIsNone(data['price']['avg'])
+        self.assertEqual(data['top_tags'], [])
+
+    def test_fixed_query_count(self):
+        """Test the stats take the same few queries however many recipes there are"""
+        for i in range(20):
+            sample_recipe(self.user, title=f'Recipe {i}')
+        self.client.force_authenticate(get_user_model().objects.get(id=self.user.id))
+
+        with self.assertNumQueries(3):
+            self.stats()
+
+    def test_cached_until_user_changes(self):
+        """Test results are served from cache until the user writes, then recomputed"""
+        self.stats()
+        Recipe.objects.filter(user=self.user).update(price='1.00')  # bypasses the change number
+        self.assertEqual(self.stats()['price']['max'], '12.00')
+
+        sample_recipe(self.user, price='30.00')
+        self.client.force_authenticate(get_user_model().objects.get(id=self.user.id))
+        self.assertEqual(self.stats()['price']['max'], '30.00')
+
+    def test_etag(self):
+        """Test a client holding the current ETag gets a 304"""
+        etag = self.client.get(STATS_URL)['ETag']
+
+        response = self.client.get(STATS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(STATS_URL, {'max_time': 10}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_equivalent_filters_share_etag(self):
+        """Test filters written differently but meaning the same get the same ETag"""
+        tags = ','.join(str(tag.id) for tag in Tag.objects.filter(user=self.user).order_by('id'))
+        etag = self.client.get(STATS_URL, {'tags': tags, 'max_price': '10'})['ETag']
+
+        reordered = ','.join(reversed(tags.split(',')))
+        response = self.client.get(STATS_URL, {'tags': reordered, 'max_price': '10.00'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_invalid_filters_rejected_before_etag(self):
+        """Test malformed filters are a bad request even for a client sending an ETag"""
+        raw_query = hashlib.md5(b'max_time=soon').hexdigest()[:12]  # what the ETag used to be made from
+        etag = f'"stats-{self.user.change_seq}-{raw_query}"'
+
+        response = self.client.get(STATS_URL, {'max_time': 'soon'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
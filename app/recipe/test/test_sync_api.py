@@ -0,0 +1,183 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag, Ingredient
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def create_user(password="testPass", email="steve@test.com"):
+    """Helper function to create a user"""
+    return get_user_model().objects.create_user(password=password, email=email)
+
+
+def sample_recipe(user, **kwargs):
+    """Helper function to create a sample recipe"""
+    defaults = {
+            'title':        'Sample Recipe',
+            'time_minutes': 10,
+            'price':        5.0
+    }
+    defaults.update(kwargs)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicSyncApiTests(TestCase):
+    """Test unauthenticated sync API access"""
+
+    def test_auth_required(self):
+        """Test authentication is required to sync"""
+        response = APIClient().get(SYNC_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateSyncApiTests(TestCase):
+    """Test delta sync for an authenticated user"""
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user, name='Kale')
+        self.recipe = sample_recipe(self.user)
+        self.recipe.tags.add(self.tag)
+
+    def sync(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        response = self.client.get(SYNC_URL, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_full_sync(self):
+        """Test a first sync returns every row and a cursor"""
+        data = self.sync()
+
+        self.assertEqual([recipe['id'] for recipe in data['recipes']], [self.recipe.id])
+        self.assertEqual(data['recipes'][0]['tags'], [self.tag.id])
+        self.assertEqual([tag['name'] for tag in data['tags']], ['Vegan'])
+        self.assertEqual([ingredient['name'] for ingredient in data['ingredients']], ['Kale'])
+        self.assertEqual(data['deleted'], {'recipes': [], 'tags': [], 'ingredients': []})
+        self.assertFalse(data['has_more'])
+        self.assertGreater(data['cursor'], 0)
+
+    def test_nothing_changed(self):
+        """Test syncing again from the returned cursor returns nothing"""
+        cursor = self.sync()['cursor']
+        data = self.sync(cursor)
+
+        self.assertEqual((data['recipes'], data['tags'], data['ingredients']), ([], [], []))
+        self.assertEqual(data['cursor'], cursor)
+
+    def test_only_changes_returned(self):
+        """Test an edited recipe and a new tag are the only rows in the next sync"""
+        other = sample_recipe(self.user, title='Untouched')
+        cursor = self.sync()['cursor']
+        self.client.patch(reverse('recipe:recipe-detail', args=[self.recipe.id]), {'title': 'Edited'})
+        self.client.post(reverse('recipe:tag-list'), {'name': 'Quick'})
+
+        data = self.sync(cursor)
+
+        self.assertEqual([recipe['title'] for recipe in data['recipes']], ['Edited'])
+        self.assertNotIn(other.id, [recipe['id'] for recipe in data['recipes']])
+        self.assertEqual([tag['name'] for tag in data['tags']], ['Quick'])
+        self.assertGreater(data['cursor'], cursor)
+
+    def test_link_changes_are_recipe_changes(self):
+        """Test adding an ingredient to a recipe, even by name, syncs the recipe and the new ingredient"""
+        cursor = self.sync()['cursor']
+        self.client.patch(reverse('recipe:recipe-detail', args=[self.recipe.id]),
+                          {'ingredient_names': ['Kale', 'Salt']}, format='json')
+
+        data = self.sync(cursor)
+
+        self.assertEqual(len(data['recipes']), 1)
+        self.assertEqual(len(data['recipes'][0]['ingredients']), 2)
+        self.assertEqual([ingredient['name'] for ingredient in data['ingredients']], ['Salt'])
+
+    def test_deleted_recipe_tombstone(self):
+        """Test a deleted recipe is reported by id"""
+        cursor = self.sync()['cursor']
+        self.client.delete(reverse('recipe:recipe-detail', args=[self.recipe.id]))
+
+        data = self.sync(cursor)
+
+        self.assertEqual(data['deleted']['recipes'], [self.recipe.id])
+        self.assertEqual(data['recipes'], [])
+
+    def test_bulk_deleted_recipes_tombstones(self):
+        """Test recipes removed by bulk delete are reported too"""
+        cursor = self.sync()['cursor']
+        self.client.post(reverse('recipe:recipe-bulk-delete'), {'all': True}, format='json')
+
+        self.assertEqual(self.sync(cursor)['deleted']['recipes'], [self.recipe.id])
+
+    def test_deleted_tag_changes_recipes(self):
+        """Test deleting a tag reports it and re-sends the recipes that carried it"""
+        cursor = self.sync()['cursor']
+        tag_id = self.tag.id
+        self.tag.delete()
+
+        data = self.sync(cursor)
+
+        self.assertEqual(data['deleted']['tags'], [tag_id])
+        self.assertEqual(data['recipes'][0]['tags'], [])
+
+    def test_other_users_changes_excluded(self):
+        """Test another user's writes never show up"""
+        cursor = self.sync()['cursor']
+        other = create_user(email='other@test.com')
+        sample_recipe(other).tags.add(Tag.objects.create(user=other, name='Theirs'))
+
+        data = self.sync(cursor)
+
+        self.assertEqual((data['recipes'], data['tags']), ([], []))
+        self.assertEqual(data['cursor'], cursor)
+
+    def test_paging(self):
+        """Test a sync bigger than the limit is returned across pages without losing rows"""
+        for i in range(5):
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+        seen, cursor, pages = set(), 0, 0
+        while True:
+            data = self.sync(cursor, limit=2)
+            seen.update(tag['name'] for tag in data['tags'])
+            cursor, pages = data['cursor'], pages + 1
+            if not data['has_more']:
+                break
+
+        self.assertEqual(seen, {'Vegan'} | {f'Tag {i}' for i in range(5)})
+        self.assertGreater(pages, 1)
+
+    def test_one_change_bigger_than_page(self):
+        """Test rows created in one change are never split between pages"""
+        cursor = self.sync()['cursor']
+        Tag.objects.get_or_create_by_names(self.user, ['a', 'b', 'c', 'd'])
+
+        data = self.sync(cursor, limit=2)
+
+        self.assertEqual(len(data['tags']), 4)
+        self.assertFalse(data['has_more'])
+
+    def test_query_count_independent_of_rows(self):
+        """Test a sync runs the same number of queries however many recipes changed"""
+        with CaptureQueriesContext(connection) as few:
+            self.sync()
+        for i in range(10):
+            sample_recipe(self.user, title=f'Recipe {i}').tags.add(self.tag)
+        with CaptureQueriesContext(connection) as many:
+            self.sync()
+
+        self.assertEqual(len(few), len(many))
+
+    def test_invalid_since(self):
+        """Test a malformed cursor is rejected"""
+        for since in ('abc', '-1'):
+            response = self.client.get(SYNC_URL, {'since': since})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,81 @@
+"""
+Prefix autocomplete for a user's tag and ingredient names, most used first.
+
+On Postgres the prefix is matched in the database through the (user_id, LOWER(name) text_pattern_ops) indexes
+from migration 0010. Other databases can't index a LIKE prefix, so each process keeps a sorted list of a user's
+names and binary searches it. The lists are keyed by the user's change number (core.sync), which moves on every
+write that could add a name or change its usage, so they never need invalidating.
+"""
+import bisect
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def _ranked(rows, limit):
+    return sorted(rows, key=lambda row: (-row['recipes'], row['name']))[:limit]
+
+
+def _from_database(queryset, prefix, limit):
+    return list(queryset.annotate(lower_name=Lower('name'))
+                .filter(lower_name__startswith=prefix)
+                .annotate(recipes=Count('recipe'))
+                .order_by('-recipes', 'name')
+                .values('id', 'name', 'recipes')[:limit])
+
+
+class SortedNames:
+    """A user's names sorted by lower case name, searched by prefix with bisect"""
+
+    def __init__(self, queryset):
+        # lower cased here rather than in SQL, SQLite's LOWER() leaves anything but ASCII alone
+        rows = sorted((name.lower(), pk, name, recipes) for pk, name, recipes in
+                      queryset.annotate(recipes=Count('recipe')).values_list('id', 'name', 'recipes'))
+        self.keys = [row[0] for row in rows]
+        self.rows = [{'id': pk, 'name': name, 'recipes': recipes} for _, pk, name, recipes in rows]
+
+    def search(self, prefix, limit):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\uffff', start)  # first key past every one starting with prefix
+        return _ranked(self.rows[start:end], limit)
+
+
+class NameCache:
+    """Least recently used SortedNames per (model, user, change number), bounded by TYPEAHEAD_CACHE_SIZE"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, queryset, user):
+        key = (queryset.model._meta.label, user.id, user.change_seq)
+        with self.lock:
+            names = self.entries.get(key)
+            if names is not None:
+                self.entries.move_to_end(key)
+                return names
+        names = SortedNames(queryset)
+        with self.lock:
+            self.entries[key] = names
+            while len(self.entries) > settings.TYPEAHEAD_CACHE_SIZE:
+                self.entries.popitem(last=False)  # older change numbers of the same user go first in practice
+        return names
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+cache = NameCache()
+
+
+def complete(queryset, user, prefix, limit):
+    """Up to limit of the user's rows in queryset whose name starts with prefix (any case), most used first"""
+    prefix = prefix.lower()
+    if connection.vendor == 'postgresql':
+        return _from_database(queryset, prefix, limit)
+    return cache.get(queryset, user).search(prefix, limit)
@@ -8,5 +8,6 @@ router.register('ingredients', views.IngredientViewSet)
 router.register('recipes', views.RecipeViewSet)
 app_name = 'recipe'
 urlpatterns = [
-        path('', include(router.urls))
+        path('sync/', views.SyncView.as_view(), name='sync'),
+        path('', include(router.urls)),
 ]
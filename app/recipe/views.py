@@ -1,13 +1,52 @@
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
-from core.models import Tag, Ingredient, Recipe
-from recipe import serializers
+from core import metrics, sync
+from core.performance import SerializerTimingMixin, timer
+from core.deletion import delete_in_batches
+from core.tasks import delete_recipes
+from core.models import Tag, Ingredient, Recipe, SimilarRecipe, VersionConflict
+from recipe import columnar, documents, duplication, serializers, typeahead
+from recipe.stats import facet_counts, recipe_stats
+
+
+class ColumnarListMixin:
+    """
+    Let list requests ask for the columnar format (recipe.columnar) and gzip large list bodies in either format.
+    The columns are the serializer's readable fields
+    """
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.action == 'list':
+            renderers.append(columnar.ColumnarRenderer())
+        return renderers
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format == columnar.ColumnarRenderer.format:
+            names = [name for name, field in self.get_serializer().fields.items() if not field.write_only]
+            response = Response(columnar.columns(self.filter_queryset(self.get_queryset()), names))
+        else:
+            response = super().list(request, *args, **kwargs)
+        return columnar.gzip_if_large(request, response, settings.LIST_GZIP_MIN_BYTES)
 
 
-class BaseRecipeAttributesViewSet(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin):
+class BaseRecipeAttributesViewSet(SerializerTimingMixin, ColumnarListMixin, viewsets.GenericViewSet,
+                                  mixins.ListModelMixin, mixins.CreateModelMixin):
     """Base viewset for user owned recipe attributes"""
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
@@ -25,6 +64,20 @@ class BaseRecipeAttributesViewSet(viewsets.GenericViewSet, mixins.ListModelMixin
         """Create a new attribute"""
         serializer.save(user=self.request.user)
 
+    @action(methods=['GET'], detail=False)
+    def autocomplete(self, request):
+        """Up to ?limit= of the user's names starting with ?q=, ignoring case, most used in recipes first"""
+        prefix = request.query_params.get('q', '').strip()
+        if not prefix:
+            raise ValidationError('q is required')
+        try:
+            limit = int(request.query_params.get('limit', settings.TYPEAHEAD_LIMIT))
+        except ValueError:
+            raise ValidationError('limit must be an integer')
+        limit = max(1, min(limit, settings.TYPEAHEAD_MAX_LIMIT))
+        queryset = self.queryset.filter(user=request.user)
+        return Response(typeahead.complete(queryset, request.user, prefix, limit))
+
 
 class TagViewSet(BaseRecipeAttributesViewSet):
     """Manage tags in the database"""
@@ -38,32 +91,142 @@ class IngredientViewSet(BaseRecipeAttributesViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(SerializerTimingMixin, ColumnarListMixin, viewsets.ModelViewSet):
     """Manage recipes in the database"""
 
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.defer('document')  # only retrieve reads it
     serializer_class = serializers.RecipeSerializer
+    orderings = ('id', 'time_minutes', 'price')  # each backed by a (user, field, id) index
+    facets = ('tags', 'ingredients')
 
     @staticmethod
     def _params_to_ints(queryset):
         """Convert a list of string IDs to integers"""
-        return [int(str_id) for str_id in queryset.split(',')]
+        str_ids = queryset.split(',')
+        if len(str_ids) > settings.MAX_FILTER_IDS:  # each id widens the join, keep one request from hogging the db
+            raise ValidationError(f'At most {settings.MAX_FILTER_IDS} ids can be filtered on')
+        try:
+            return [int(str_id) for str_id in str_ids]
+        except ValueError:
+            raise ValidationError('Filter ids must be comma separated integers')
+
+    @staticmethod
+    def _param_to_number(value, name, field_name):
+        """Convert a range filter value to a non negative int or Decimal the recipe field's column can hold"""
+        field = Recipe._meta.get_field(field_name)
+        if isinstance(field, models.DecimalField):
+            number_type = Decimal
+            maximum = Decimal(10) ** (field.max_digits - field.decimal_places) - Decimal(10) ** -field.decimal_places
+        else:
+            number_type = int
+            maximum = BaseDatabaseOperations.integer_field_ranges[field.get_internal_type()][1]
+        try:
+            number = number_type(value)
+        except (ValueError, InvalidOperation):
+            raise ValidationError(f'{name} must be a number')
+        if number_type is Decimal and not number.is_finite() or number < 0:
+            raise ValidationError(f'{name} must be a non negative number')
+        if number > maximum:
+            raise ValidationError(f'{name} must be at most {maximum}')
+        return number
+
+    def _ordering(self):
+        """order_by() arguments for ?ordering=, newest first by default, ties broken by id in the same direction"""
+        ordering = self.request.query_params.get('ordering', '-id')
+        field = ordering.lstrip('-')
+        if field not in self.orderings:
+            raise ValidationError(f'ordering must be one of {", ".join(self.orderings)}, prefixed with - to reverse')
+        direction = '-' if ordering.startswith('-') else ''
+        return (ordering,) if field == 'id' else (ordering, f'{direction}id')
+
+    def _filters(self):
+        """
+        The validated filters as lookup -> value, normalised so equivalent query strings (ids in another order,
+        5 and 5.00) give equal dicts
+        """
+        params = self.request.query_params
+        filters = {}
+        if params.get('tags'):  # comma separated string integers
+            filters['tags__id__in'] = sorted(set(self._params_to_ints(params['tags'])))
+        if params.get('ingredients'):
+            filters['ingredients__id__in'] = sorted(set(self._params_to_ints(params['ingredients'])))
+        if params.get('max_time'):
+            filters['time_minutes__lte'] = self._param_to_number(params['max_time'], 'max_time', 'time_minutes')
+        if params.get('min_price'):
+            filters['price__gte'] = self._param_to_number(params['min_price'], 'min_price', 'price').normalize()
+        if params.get('max_price'):
+            filters['price__lte'] = self._param_to_number(params['max_price'], 'max_price', 'price').normalize()
+        return filters
 
     def get_queryset(self):
         """Return recipes for the current authenticated user only"""
-        tags = self.request.query_params.get(
-                'tags')  # list of string integers if tags specified in get request else None
-        ingredients = self.request.query_params.get('ingredients')
         queryset = self.queryset  # preserve the original queryset
-        if tags:
-            tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
-        if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
-        return queryset.filter(user=self.request.user)
+        for lookup, value in self._filters().items():
+            queryset = queryset.filter(**{lookup: value})
+        queryset = queryset.filter(user=self.request.user)
+        if self.action == 'list':  # other actions find rows by id, ?ordering= means nothing to them
+            queryset = queryset.order_by(*self._ordering())
+        return queryset
+
+    def _facet_names(self):
+        """Facets asked for with ?facets=tags,ingredients"""
+        names = [name for name in self.request.query_params.get('facets', '').split(',') if name]
+        unknown = set(names) - set(self.facets)
+        if unknown:
+            raise ValidationError(f'Unknown facets {", ".join(sorted(unknown))}, choose from {", ".join(self.facets)}')
+        return names
+
+    def list(self, request, *args, **kwargs):
+        """
+        List recipes. With ?facets= the list moves under 'results' next to 'facets', the number of listed recipes
+        carrying each tag / ingredient, so a faceted UI needs one request
+        """
+        names = self._facet_names()
+        response = super().list(request, *args, **kwargs)
+        if names:
+            counts = facet_counts(self.filter_queryset(self.get_queryset()), names, settings.FACET_LIMIT)
+            if isinstance(response.data, dict):  # the columnar format is already an object
+                response.data['facets'] = counts
+            else:
+                response.data = {'results': response.data, 'facets': counts}
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        """Return the recipe's stored detail document (recipe.documents), rendering it first if it went stale"""
+        lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        pk, document, version = get_object_or_404(queryset.values_list('id', 'document', 'version'), **lookup)
+        if not document:
+            document = documents.refresh([pk], stale_only=True)[pk]
+        response = documents.DocumentResponse(document)
+        response['ETag'] = f'"{version}"'  # send it back in If-Match to update only this version
+        return response
+
+    def update(self, request, *args, **kwargs):
+        """
+        PUT and PATCH. With If-Match the write only goes ahead if the recipe is still at the version in the ETag,
+        otherwise it is answered 412 and nothing changes. Without it the last write wins as before
+        """
+        try:
+            response = super().update(request, *args, **kwargs)
+        except VersionConflict:
+            response = Response({'detail': 'The recipe was changed since it was read, fetch it and try again'},
+                                status=status.HTTP_412_PRECONDITION_FAILED)
+        else:
+            response['ETag'] = f'"{response.data["version"]}"'
+        return response
+
+    def get_object(self):
+        """The recipe to act on. Updates check If-Match here, so a stale version is refused before validation"""
+        recipe = super().get_object()
+        tags = parse_etags(self.request.META.get('HTTP_IF_MATCH', ''))
+        if self.action in ('update', 'partial_update') and tags and tags != ['*']:
+            if f'"{recipe.version}"' not in tags:
+                raise VersionConflict(f'Recipe {recipe.id} is at version {recipe.version}')
+            recipe.expected_version = recipe.version  # the UPDATE re-checks it, a write may land after our read
+        return recipe
 
     def get_serializer_class(self):
         """Return appropriate serializer """
@@ -71,18 +234,135 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'similar':
+            return serializers.SimilarRecipeSerializer
+        elif self.action == 'bulk_delete':
+            return serializers.RecipeBulkDeleteSerializer
+        elif self.action == 'duplicate':
+            return serializers.RecipeDuplicateSerializer
+        elif self.action == 'bulk_duplicate':
+            return serializers.RecipeBulkDuplicateSerializer
         return self.serializer_class
 
     def perform_create(self, serializer):
         """Create a new recipe"""
-        serializer.save(user=self.request.user)
+        self._save(serializer, user=self.request.user)
+
+    def perform_update(self, serializer):
+        self._save(serializer)
+
+    @staticmethod
+    def _save(serializer, **kwargs):
+        """
+        Save the recipe and its links in one transaction, stamping and rendering it once for the whole write
+        rather than on every m2m signal the links send
+        """
+        with transaction.atomic():  # the row and its links commit together, queueing their side effects once
+            with sync.collect_link_changes() as changed:
+                recipe = serializer.save(**kwargs)  # save() stamps the recipe and moves its version on
+            others = changed - {recipe.pk}
+            if others:
+                Recipe.objects.filter(pk__in=others).touch()
+            documents.refresh(changed | {recipe.pk})
 
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         """Upload an image to a recipe"""
         recipe = self.get_object()
         serializer = self.get_serializer(recipe, data=request.data)
+        if 'image' in request.FILES:
+            metrics.IMAGE_UPLOAD_BYTES.observe(request.FILES['image'].size)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """The recipes sharing the most tags and ingredients with this one, best match first (see recipe.similarity)"""
+        recipe = self.get_object()
+        neighbours = (SimilarRecipe.objects.filter(recipe=recipe).select_related('similar')
+                      .prefetch_related('similar__tags', 'similar__ingredients')
+                      .order_by('-score', '-similar')[:settings.SIMILAR_RECIPES_COUNT])
+        return Response(self.get_serializer(neighbours, many=True).data)
+
+    @action(methods=['GET'], detail=False)
+    def stats(self, request):
+        """
+        Aggregates over the recipes the list would return with the same filters. Results are cached and tagged
+        with the user's change number (see core.sync), so they stay valid until the user writes something
+        """
+        filters = '&'.join(f'{lookup}={value}' for lookup, value in sorted(self._filters().items()))  # 400s first
+        version = f'{request.user.change_seq}-{hashlib.md5(filters.encode()).hexdigest()[:12]}'
+        etag = f'"stats-{version}"'
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = f'recipe-stats:{request.user.id}:{version}'
+            data = cache.get(key)
+            metrics.record_cache('recipe_stats', data is not None)
+            if data is None:
+                data = recipe_stats(self.filter_queryset(self.get_queryset()))
+                cache.set(key, data, settings.STATS_CACHE_TIMEOUT)
+            response = Response(data)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)  # always revalidate, the ETag makes it cheap
+        return response
+
+    @action(methods=['POST'], detail=True)
+    def duplicate(self, request, pk=None):
+        """Copy a recipe with its tags, ingredients and image, renamed to the title in the body if there is one"""
+        recipe = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        [(_, copy)] = duplication.duplicate(request.user, [recipe.id], serializer.validated_data.get('title'))
+        return Response(serializers.RecipeSerializer(copy).data, status=status.HTTP_201_CREATED)
+
+    @action(methods=['POST'], detail=False, url_path='bulk-duplicate')
+    def bulk_duplicate(self, request):
+        """Copy the listed recipes, ids that aren't the user's are skipped. Returns each source's copy"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        copies = duplication.duplicate(request.user, serializer.validated_data['ids'])
+        return Response([{'source': source, 'id': copy.id} for source, copy in copies], status=status.HTTP_201_CREATED)
+
+    @action(methods=['POST'], detail=False, url_path='bulk-delete')
+    def bulk_delete(self, request):
+        """Delete the listed recipes (or all of them), in the background when there are more than one batch"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = None if serializer.validated_data['all'] else serializer.validated_data['ids']
+        queryset = Recipe.objects.filter(user=request.user)
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+        count = queryset.count()
+        if count <= settings.DELETION_BATCH_SIZE:
+            return Response({'deleted': delete_in_batches(queryset)}, status=status.HTTP_200_OK)
+        delete_recipes.delay(request.user.id, ids)
+        return Response({'scheduled': count}, status=status.HTTP_202_ACCEPTED)
+
+
+class SyncView(APIView):
+    """Return what changed in the user's recipes, tags and ingredients since the cursor of a client's last sync"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    @staticmethod
+    def _param_to_int(request, name, default):
+        value = request.query_params.get(name, default)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError(f'{name} must be an integer')
+        if value < 0:
+            raise ValidationError(f'{name} must not be negative')
+        return value
+
+    def get(self, request):
+        """Changes after ?since= (0 for everything), call again with the returned cursor while has_more"""
+        since = self._param_to_int(request, 'since', 0)
+        limit = min(self._param_to_int(request, 'limit', settings.SYNC_PAGE_SIZE), settings.SYNC_PAGE_SIZE)
+        changes = sync.changes_since(request.user, since, max(limit, 1))
+        with timer('serialize'):
+            data = serializers.SyncSerializer(changes).data
+        return Response(data)
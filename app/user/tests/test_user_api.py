@@ -1,8 +1,9 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status  # HTTP status codes
+from core.models import Recipe, Tag
 
 CREATE_USER_URL = reverse('user:create')  # the endpoint urls
 TOKEN_URL = reverse('user:token')
@@ -139,3 +140,24 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(BACKGROUND_TASKS_INLINE=True)
+    def test_delete_user(self):
+        """Test deleting yourself removes the account and everything it owns"""
+        recipe = Recipe.objects.create(user=self.user, title='Stew', time_minutes=5, price=1.00)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Winter'))
+        response = self.client.delete(path=ME_URL)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(get_user_model().objects.filter(id=self.user.id).exists())
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(Tag.objects.exists())
+        self.assertFalse(Recipe.tags.through.objects.exists())
+
+    @override_settings(BACKGROUND_TASKS_INLINE=False)
+    def test_delete_user_deactivates_immediately(self):
+        """Test the account is locked out before its data is removed"""
+        response = self.client.delete(path=ME_URL)  # the background deletion waits for a commit that never comes
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertIsNotNone(self.user.deletion_requested_at)
@@ -1,11 +1,15 @@
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, authentication, permissions, status
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from core.deletion import schedule_user_deletion
+from core.performance import SerializerTimingMixin
+
 from .serializers import UserSerializer, AuthTokenSerializer
 
 
-class CreateUserView(generics.CreateAPIView):
+class CreateUserView(SerializerTimingMixin, generics.CreateAPIView):
     """Create a new user in the system."""
     serializer_class = UserSerializer
 
@@ -16,7 +20,7 @@ class CreateTokenView(ObtainAuthToken):
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(SerializerTimingMixin, generics.RetrieveUpdateDestroyAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
     authentication_classes = (authentication.TokenAuthentication,)
@@ -25,3 +29,8 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         """Retrieve and return authenticated user"""
         return self.request.user
+
+    def destroy(self, request, *args, **kwargs):
+        """Deactivate the user now and delete their data in the background"""
+        schedule_user_deletion(self.get_object())
+        return Response(status=status.HTTP_202_ACCEPTED)